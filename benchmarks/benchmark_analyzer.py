@@ -0,0 +1,388 @@
+"""
+Micro-benchmarks of script planning by TrackAnalyzer. Builds single
+synthetic track from 1k to 1M boxes and measures initialization of
+analyzer and 'generate_sequences' for every mode:
+- time of both stages
+- peak memory of python allocations (tracemalloc, separate run)
+
+Larger tracks of the mode are skipped after a run slower than the time
+limit. Scaling curve can be plotted with matplotlib.
+
+Parity check runs analyzer with fixed seed and compares digests of
+'sequences' and 'frames_to_skip' with the reference file, so
+optimizations of the analyzer can not change its output silently.
+
+Usage:
+    python -m benchmarks.benchmark_analyzer --sizes 1000 10000 --plot
+    python -m benchmarks.benchmark_analyzer --parity-only
+    python -m benchmarks.benchmark_analyzer --parity-only --update-parity
+"""
+import gc
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import tracemalloc
+
+from collections import OrderedDict
+
+from utils import constants as c
+from utils.track_analyzer import TrackAnalyzer
+from benchmarks import synthetic_data
+from benchmarks.benchmark_generator import get_environment, save_results
+
+
+
+def get_benchmark_track(boxes_number, seed):
+    """Generates track in CVAT format of annotation parser with moving
+    box and switching signals. Lists of box attributes are shared
+    between boxes with the same states to keep large tracks in memory.
+
+    Args:
+        boxes_number (int): Number of boxes (frames) in track
+        seed (int): Seed of generator
+
+    Returns:
+        dict: Track data as parsed by xmltodict
+    """
+    rng = random.Random(seed)
+    synthetic_track = synthetic_data.get_synthetic_tracks(
+        boxes_number, 1, c.SYNTHETIC_RESOLUTION, c.SYNTHETIC_FPS,
+        c.SYNTHETIC_SWITCH_RATE, rng
+    )[0]
+    attribute_lists = {}
+    boxes = []
+    for frame, (box, attributes) in enumerate(
+            zip(synthetic_track['boxes'], synthetic_track['attributes'])):
+        states = tuple(attributes.items())
+        if states not in attribute_lists:
+            attribute_lists[states] = [
+                {'@name': attribute, '#text': str(state).lower()}
+                for attribute, state in states
+            ]
+        boxes.append({
+            '@frame': str(frame),
+            '@outside': '0',
+            '@occluded': '0',
+            '@keyframe': '1',
+            '@xtl': f"{box[0]}.00",
+            '@ytl': f"{box[1]}.00",
+            '@xbr': f"{box[2]}.00",
+            '@ybr': f"{box[3]}.00",
+            '@z_order': '0',
+            'attribute': attribute_lists[states],
+        })
+    return {'@id': '0', '@label': c.CVAT_LABELS, 'box': boxes}
+
+
+
+def get_analyzer_settings(mode):
+    """Creates script settings and labels for analyzer. All synthetic
+    signals are target attributes.
+
+    Args:
+        mode (str): 'sequence', 'singleshot' or 'difference'
+
+    Returns:
+        tuple: (settings, labels)
+    """
+    settings = {
+        'mode': mode,
+        'target_attributes': {c.CVAT_LABELS: c.SYNTHETIC_ATTRIBUTES},
+    }
+    labels = {c.CVAT_LABELS: c.SYNTHETIC_ATTRIBUTES}
+    return settings, labels
+
+
+
+def run_analyzer(track, mode):
+    """Runs analyzer over the track and measures its stages.
+
+    Args:
+        track (dict): Track from 'get_benchmark_track'
+        mode (str): 'sequence', 'singleshot' or 'difference'
+
+    Returns:
+        tuple: (TrackAnalyzer instance, init seconds, generate seconds)
+    """
+    settings, labels = get_analyzer_settings(mode)
+    start_time = time.perf_counter()
+    analyzer = TrackAnalyzer(track, settings, labels, len(track['box']), False)
+    init_seconds = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    analyzer.generate_sequences(c.ADD_REVERSED)
+    generate_seconds = time.perf_counter() - start_time
+    return analyzer, init_seconds, generate_seconds
+
+
+
+def get_peak_memory(track, mode):
+    """Runs analyzer under tracemalloc. Timings of this run are not
+    used, as tracing slows allocations down.
+
+    Args:
+        track (dict): Track from 'get_benchmark_track'
+        mode (str): 'sequence', 'singleshot' or 'difference'
+
+    Returns:
+        int: Peak size of allocated memory in bytes
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        analyzer, _, _ = run_analyzer(track, mode)
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del analyzer
+    return peak_bytes
+
+
+
+def get_parity_digest(analyzer):
+    """Calculates digest of the analyzer outputs.
+
+    Args:
+        analyzer (obj): TrackAnalyzer instance after 'generate_sequences'
+
+    Returns:
+        str: SHA-256 of 'sequences' and 'frames_to_skip'
+    """
+    outputs = json.dumps([analyzer.sequences, analyzer.frames_to_skip])
+    return hashlib.sha256(outputs.encode('utf-8')).hexdigest()
+
+
+
+def check_parity(parity_path, update=False):
+    """Compares digests of analyzer outputs in every mode with the
+    reference file. Reference is written if it does not exist or
+    update is requested, boxes number and seed are taken from
+    constants then. Otherwise they are read from the reference.
+
+    Args:
+        parity_path (str): Path to the reference file
+        update (bool, optional): Rewrite reference. Defaults to False.
+
+    Returns:
+        OrderedDict: Parity report with 'mismatches' modes
+    """
+    reference = None
+    if os.path.isfile(parity_path) and not update:
+        with open(parity_path, encoding='utf-8') as file:
+            reference = json.load(file)
+    boxes_number = c.ANALYZER_PARITY_BOXES if reference is None else reference['boxes']
+    seed = c.ANALYZER_PARITY_SEED if reference is None else reference['seed']
+    track = get_benchmark_track(boxes_number, seed)
+    digests = OrderedDict()
+    for mode in c.BENCHMARK_MODES:
+        analyzer, _, _ = run_analyzer(track, mode)
+        digests[mode] = get_parity_digest(analyzer)
+    parity = OrderedDict()
+    parity['boxes'] = boxes_number
+    parity['seed'] = seed
+    parity['digests'] = digests
+    if reference is None:
+        with open(parity_path, 'w', encoding='utf-8') as file:
+            json.dump(parity, file, indent=4)
+        parity['mismatches'] = []
+    else:
+        parity['mismatches'] = [
+            mode for mode, digest in digests.items()
+            if reference['digests'].get(mode) != digest
+        ]
+    return parity
+
+
+
+def run_benchmarks(sizes, modes, seed, time_limit, measure_memory=True):
+    """Measures analyzer on tracks of every size in every mode.
+
+    Args:
+        sizes (list): Numbers of boxes in track
+        modes (list): Generator modes
+        seed (int): Seed of tracks generator
+        time_limit (float): Larger tracks of the mode are skipped after
+            a run slower than this number of seconds
+        measure_memory (bool, optional): Measure peak memory in separate
+            traced run. Defaults to True.
+
+    Returns:
+        list: Result of every mode and size
+    """
+    results = []
+    slow_modes = set()
+    for boxes_number in sorted(sizes):
+        track = None
+        for mode in modes:
+            result = OrderedDict()
+            result['mode'] = mode
+            result['boxes'] = boxes_number
+            if mode in slow_modes:
+                result['skipped'] = True
+                results.append(result)
+                print(f"{mode:<12} boxes={boxes_number:<9} skipped")
+                continue
+            if track is None:
+                track = get_benchmark_track(boxes_number, seed)
+            gc.collect()
+            analyzer, init_seconds, generate_seconds = run_analyzer(track, mode)
+            seconds = init_seconds + generate_seconds
+            result['skipped'] = False
+            result['init_seconds'] = init_seconds
+            result['generate_seconds'] = generate_seconds
+            result['seconds'] = seconds
+            result['sequences'] = len(analyzer)
+            result['frames_to_skip'] = len(analyzer.frames_to_skip)
+            del analyzer
+            result['peak_memory_bytes'] = None
+            if seconds > time_limit:
+                slow_modes.add(mode)
+            elif measure_memory:
+                result['peak_memory_bytes'] = get_peak_memory(track, mode)
+            results.append(result)
+            peak_memory = result['peak_memory_bytes']
+            memory_message = '' if peak_memory is None \
+                else f" {peak_memory / 2 ** 20:10.1f} MiB"
+            print(f"{mode:<12} boxes={boxes_number:<9} {seconds:10.3f} s"
+                  f"{memory_message}")
+        del track
+    return results
+
+
+
+def plot_scaling(results, plot_path):
+    """Plots time and peak memory of analyzer against track size.
+
+    Args:
+        results (list): Results from 'run_benchmarks'
+        plot_path (str): Path to the image
+    """
+    # Optional dependency, is needed only for plotting
+    from matplotlib import pyplot as plt
+
+    figure, (time_axis, memory_axis) = plt.subplots(1, 2, figsize=(12, 5))
+    modes = list(OrderedDict.fromkeys(result['mode'] for result in results))
+    for mode in modes:
+        measured = [result for result in results
+                    if result['mode'] == mode and not result['skipped']]
+        time_axis.plot(
+            [result['boxes'] for result in measured],
+            [result['seconds'] for result in measured],
+            marker='o', label=mode
+        )
+        traced = [result for result in measured
+                  if result['peak_memory_bytes'] is not None]
+        memory_axis.plot(
+            [result['boxes'] for result in traced],
+            [result['peak_memory_bytes'] / 2 ** 20 for result in traced],
+            marker='o', label=mode
+        )
+    for axis, label in ((time_axis, 'seconds'), (memory_axis, 'peak memory, MiB')):
+        axis.set_xscale('log')
+        axis.set_yscale('log')
+        axis.set_xlabel('boxes in track')
+        axis.set_ylabel(label)
+        axis.grid(True, which='both', alpha=0.3)
+        axis.legend()
+    figure.suptitle('TrackAnalyzer scaling')
+    figure.savefig(plot_path)
+    plt.close(figure)
+
+
+
+if __name__ == '__main__':
+    """Runs parity check and scaling benchmarks of track analyzer.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--modes',
+        type=str,
+        nargs='+',
+        default=list(c.BENCHMARK_MODES),
+        choices=['sequence', 'singleshot', 'difference'],
+        help='Generator modes to benchmark'
+    )
+    parser.add_argument(
+        '--sizes',
+        type=int,
+        nargs='+',
+        default=list(c.ANALYZER_BENCHMARK_SIZES),
+        help='Numbers of boxes in benchmark tracks'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Seed of benchmark tracks'
+    )
+    parser.add_argument(
+        '--time-limit',
+        type=float,
+        default=c.ANALYZER_BENCHMARK_TIME_LIMIT,
+        help='Seconds. Larger tracks of the mode are skipped after a slower run'
+    )
+    parser.add_argument(
+        '--no-memory',
+        action='store_true',
+        help='Do not measure peak memory in traced runs'
+    )
+    parser.add_argument(
+        '--plot',
+        action='store_true',
+        help='Plot scaling curve next to the results file. Requires matplotlib'
+    )
+    parser.add_argument(
+        '--results',
+        type=str,
+        default=c.BENCHMARK_RESULTS_DIR,
+        help='Directory for results files'
+    )
+    parser.add_argument(
+        '--parity',
+        type=str,
+        default=c.ANALYZER_PARITY_FILE,
+        help='Reference digests of analyzer outputs. Exits with code 1 on mismatch'
+    )
+    parser.add_argument(
+        '--update-parity',
+        action='store_true',
+        help='Rewrite reference digests with current analyzer outputs'
+    )
+    parser.add_argument(
+        '--parity-only',
+        action='store_true',
+        help='Run parity check without scaling benchmarks'
+    )
+    args = parser.parse_args()
+
+    parity = check_parity(args.parity, args.update_parity)
+    for mode, digest in parity['digests'].items():
+        status = 'MISMATCH' if mode in parity['mismatches'] else 'ok'
+        print(f"parity {mode:<12} {digest[:16]} {status}")
+    if args.update_parity:
+        print(f"Parity reference: {args.parity}")
+
+    if not args.parity_only:
+        results = run_benchmarks(
+            args.sizes, args.modes, args.seed, args.time_limit,
+            measure_memory=not args.no_memory
+        )
+        report = OrderedDict()
+        report['created'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        report['environment'] = get_environment()
+        report['seed'] = args.seed
+        report['time_limit'] = args.time_limit
+        report['parity'] = parity
+        report['results'] = results
+        report_path = save_results(args.results, report, name='analyzer')
+        print(f"Results: {report_path}")
+        if args.plot:
+            plot_path = f"{os.path.splitext(report_path)[0]}.png"
+            plot_scaling(results, plot_path)
+            print(f"Plot: {plot_path}")
+
+    if parity['mismatches']:
+        sys.exit(1)
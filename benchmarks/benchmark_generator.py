@@ -0,0 +1,297 @@
+"""
+End-to-end benchmarks of dataset generator on synthetic data. Runs
+'generate_dataset' for every mode and number of workers, stores results
+to JSON file and compares throughput with the baseline results to catch
+regressions offline.
+
+Usage:
+    python -m benchmarks.benchmark_generator --modes sequence --workers 1 2
+    python -m benchmarks.benchmark_generator --baseline {results.json}
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import cv2
+
+from collections import OrderedDict
+
+import dataset_generator
+
+from utils import constants as c
+from utils import logging_tool
+from utils import manifest_tool
+from benchmarks import synthetic_data
+
+
+
+def get_environment():
+    """Collects environment of the benchmark run.
+
+    Returns:
+        OrderedDict: Versions, platform and git revision
+    """
+    environment = OrderedDict()
+    environment['python'] = platform.python_version()
+    environment['opencv'] = cv2.__version__
+    environment['platform'] = platform.platform()
+    environment['cpu_count'] = os.cpu_count()
+    try:
+        environment['git_revision'] = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        environment['git_revision'] = None
+    return environment
+
+
+
+def run_generator(input_path, work_path, mode, workers, logger):
+    """Runs generator once and measures its duration.
+
+    Args:
+        input_path (str): Path to the synthetic input directory
+        work_path (str): Directory for temporary datasets
+        mode (str): Generator mode
+        workers (int): Number of worker processes
+        logger (obj): logging class object
+
+    Returns:
+        OrderedDict: Duration, written files and decoded frames
+    """
+    output_path = tempfile.mkdtemp(prefix=f"{mode}_w{workers}_", dir=work_path)
+    manifest = manifest_tool.BuildManifest(output_path)
+    start_time = time.perf_counter()
+    dataset_generator.generate_dataset(
+        input_path, output_path, mode, True, logger, False, manifest,
+        workers=workers
+    )
+    seconds = time.perf_counter() - start_time
+    run = OrderedDict()
+    run['seconds'] = seconds
+    run['files_written'] = sum(
+        len(manifest.get_video_chunks(video['video']))
+        for video in manifest.get_videos()
+    )
+    run['frames_decoded'] = None
+    profile_path = os.path.join(output_path, c.PROFILER_REPORT_FILENAME)
+    if os.path.isfile(profile_path):
+        with open(profile_path, encoding='utf-8') as file:
+            profile = json.load(file)
+        run['frames_decoded'] = profile['overall'].get('decode', {}).get('count')
+    manifest.close()
+    shutil.rmtree(output_path, ignore_errors=True)
+    return run
+
+
+
+def run_benchmarks(input_path, work_path, modes, workers_list, repeats, logger):
+    """Runs generator for every mode and number of workers. The fastest
+    run of repeats is used as result.
+
+    Args:
+        input_path (str): Path to the synthetic input directory
+        work_path (str): Directory for temporary datasets
+        modes (list): Generator modes
+        workers_list (list): Numbers of worker processes
+        repeats (int): Runs of every benchmark
+        logger (obj): logging class object
+
+    Returns:
+        list: Result of every benchmark
+    """
+    results = []
+    for mode in modes:
+        for workers in workers_list:
+            runs = [
+                run_generator(input_path, work_path, mode, workers, logger)
+                for _ in range(repeats)
+            ]
+            best_run = min(runs, key=lambda run: run['seconds'])
+            result = OrderedDict()
+            result['mode'] = mode
+            result['workers'] = workers
+            result['seconds'] = best_run['seconds']
+            result['files_written'] = best_run['files_written']
+            result['frames_decoded'] = best_run['frames_decoded']
+            result['files_per_second'] = \
+                best_run['files_written'] / max(best_run['seconds'], 1e-9)
+            result['runs_seconds'] = [run['seconds'] for run in runs]
+            results.append(result)
+            print(f"{mode:<12} workers={workers:<3} {result['seconds']:8.2f} s "
+                  f"{result['files_per_second']:8.1f} files/s")
+    return results
+
+
+
+def compare_with_baseline(results, baseline_results, tolerance):
+    """Compares throughput of benchmarks with the baseline ones.
+
+    Args:
+        results (list): Current results
+        baseline_results (list): Results from baseline file
+        tolerance (float): Allowed relative drop of throughput
+
+    Returns:
+        list: Comparisons of benchmarks found in both results
+    """
+    baseline = {
+        (result['mode'], result['workers']): result
+        for result in baseline_results
+    }
+    comparisons = []
+    for result in results:
+        baseline_result = baseline.get((result['mode'], result['workers']))
+        if baseline_result is None:
+            continue
+        ratio = result['files_per_second'] / \
+            max(baseline_result['files_per_second'], 1e-9)
+        comparison = OrderedDict()
+        comparison['mode'] = result['mode']
+        comparison['workers'] = result['workers']
+        comparison['baseline_files_per_second'] = baseline_result['files_per_second']
+        comparison['files_per_second'] = result['files_per_second']
+        comparison['ratio'] = ratio
+        comparison['regression'] = ratio < (1 - tolerance)
+        comparisons.append(comparison)
+    return comparisons
+
+
+
+def save_results(results_path, report, name='generator'):
+    """Saves benchmark report to JSON file.
+
+    Args:
+        results_path (str): Path to the results directory
+        report (dict): Benchmark report
+        name (str, optional): Name of the benchmark, prefix of the file
+            name. Defaults to 'generator'.
+
+    Returns:
+        str: Path to the results file
+    """
+    os.makedirs(results_path, exist_ok=True)
+    file_name = time.strftime(f'{name}_%Y-%m-%d--%H-%M-%S.json')
+    report_path = os.path.join(results_path, file_name)
+    with open(report_path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=4)
+    return report_path
+
+
+
+if __name__ == '__main__':
+    """Runs benchmarks of dataset generator.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-i',
+        '--input',
+        type=str,
+        default=None,
+        help='Directory with synthetic data. Generated to the work' \
+             ' directory if not set'
+    )
+    parser.add_argument(
+        '--modes',
+        type=str,
+        nargs='+',
+        default=list(c.BENCHMARK_MODES),
+        choices=['sequence', 'singleshot', 'difference'],
+        help='Generator modes to benchmark'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        nargs='+',
+        default=list(c.BENCHMARK_WORKERS),
+        help='Numbers of worker processes to benchmark'
+    )
+    parser.add_argument(
+        '--repeats',
+        type=int,
+        default=c.BENCHMARK_REPEATS,
+        help='Runs of every benchmark, the fastest one is stored'
+    )
+    parser.add_argument(
+        '--results',
+        type=str,
+        default=c.BENCHMARK_RESULTS_DIR,
+        help='Directory for results files'
+    )
+    parser.add_argument(
+        '--baseline',
+        type=str,
+        default=None,
+        help='Results file to compare with. Exits with code 1 on regression'
+    )
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=c.BENCHMARK_REGRESSION_TOLERANCE,
+        help='Allowed relative drop of throughput from baseline'
+    )
+    parser.add_argument(
+        '--debug',
+        action="store_true",
+        help='Enable debug log writing, logging is included in timings'
+    )
+    parser = synthetic_data.add_synthetic_arguments(parser)
+    args = parser.parse_args()
+
+    # Off by default, so timings do not include writing of debug log
+    dataset_generator.debug = args.debug
+    dataset_generator.logger = logging_tool.start_logging(dataset_generator.debug)
+    work_path = tempfile.mkdtemp(prefix='generator_benchmark_')
+    input_path = args.input
+    synthetic_settings = OrderedDict()
+    if input_path is None:
+        input_path = os.path.join(work_path, 'input')
+        synthetic_settings['videos'] = args.videos
+        synthetic_settings['frames'] = args.frames
+        synthetic_settings['resolution'] = (args.width, args.height)
+        synthetic_settings['fps'] = args.fps
+        synthetic_settings['tracks'] = args.tracks
+        synthetic_settings['switch_rate'] = args.switch_rate
+        synthetic_settings['seed'] = args.seed
+        synthetic_data.generate_synthetic_dataset(
+            input_path, *synthetic_settings.values()
+        )
+
+    try:
+        results = run_benchmarks(
+            input_path, work_path, args.modes, args.workers, args.repeats,
+            dataset_generator.logger
+        )
+    finally:
+        shutil.rmtree(work_path, ignore_errors=True)
+
+    report = OrderedDict()
+    report['created'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    report['environment'] = get_environment()
+    report['input'] = args.input
+    report['debug'] = args.debug
+    report['synthetic_data'] = synthetic_settings
+    report['results'] = results
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline_report = json.load(file)
+        report['baseline'] = args.baseline
+        report['comparisons'] = compare_with_baseline(
+            results, baseline_report['results'], args.tolerance
+        )
+        for comparison in report['comparisons']:
+            print(f"{comparison['mode']:<12} workers={comparison['workers']:<3} "
+                  f"x{comparison['ratio']:.2f} of baseline"
+                  f"{' REGRESSION' if comparison['regression'] else ''}")
+        regressions = [comparison for comparison in report['comparisons']
+                       if comparison['regression']]
+    print(f"Results: {save_results(args.results, report)}")
+    if regressions:
+        sys.exit(1)
@@ -0,0 +1,338 @@
+"""
+Generator of synthetic source videos with CVAT annotations for
+benchmarks. Every video contains vehicles as colored boxes moving over
+the noisy background. Vehicles have blinking lights of their signals:
+- brake - two red lights at the top corners
+- turn_left / turn_right - amber light at the left / right side
+- alarm - both amber lights
+
+Matching 'task_{video}_cvat for video 1.1.zip' archive is written for
+every video, so the directory can be used as generator input.
+
+Usage:
+    python -m benchmarks.synthetic_data -o {output} --videos 2 --frames 900
+"""
+import os
+import random
+import argparse
+import cv2
+import numpy as np
+
+from zipfile import ZipFile, ZIP_DEFLATED
+from xml.sax.saxutils import quoteattr
+
+from utils import constants as c
+
+
+
+def get_synthetic_tracks(frames_number, tracks_number, resolution, fps,
+                         switch_rate, rng):
+    """Generates moving boxes and signal states of vehicles.
+
+    Args:
+        frames_number (int): Number of frames in video
+        tracks_number (int): Number of vehicles
+        resolution (tuple): Width and heights of video in pixels
+        fps (int): Frames per second of video
+        switch_rate (float): Expected switches of every signal per
+            second
+        rng (random.Random): Random generator
+
+    Returns:
+        list: Dicts of tracks with 'boxes' and 'attributes' per frame
+    """
+    width, height = resolution
+    tracks = []
+    for track_id in range(tracks_number):
+        box_width = rng.randint(width // 10, width // 5)
+        box_height = int(box_width * rng.uniform(0.6, 0.9))
+        x = rng.uniform(0, width - box_width)
+        y = rng.uniform(0, height - box_height)
+        speed_x = rng.uniform(-2, 2)
+        speed_y = rng.uniform(-1, 1)
+        states = {attribute: False for attribute in c.SYNTHETIC_ATTRIBUTES}
+        frames_in_state = {attribute: 0 for attribute in c.SYNTHETIC_ATTRIBUTES}
+        boxes = []
+        attributes = []
+        for _ in range(frames_number):
+            # Vehicle bounces from the borders of the frame
+            if not 0 <= x + speed_x <= width - box_width:
+                speed_x = -speed_x
+            if not 0 <= y + speed_y <= height - box_height:
+                speed_y = -speed_y
+            x += speed_x
+            y += speed_y
+            for attribute in c.SYNTHETIC_ATTRIBUTES:
+                frames_in_state[attribute] += 1
+                state_can_switch = \
+                    frames_in_state[attribute] >= c.SYNTHETIC_MIN_STATE_FRAMES
+                if state_can_switch and rng.random() < (switch_rate / fps):
+                    states[attribute] = not states[attribute]
+                    frames_in_state[attribute] = 0
+            boxes.append((int(x), int(y), int(x) + box_width, int(y) + box_height))
+            attributes.append(dict(states))
+        tracks.append({
+            'id': track_id,
+            'color': tuple(rng.randint(60, 200) for _ in range(3)),
+            'boxes': boxes,
+            'attributes': attributes,
+        })
+    return tracks
+
+
+
+def draw_vehicle(image, box, color, attributes, frame):
+    """Draws vehicle box with lights of active signals. Turn signals
+    and alarm are blinking.
+
+    Args:
+        image (array): Frame image
+        box (tuple): Box coordinates (ax, ay, bx, by)
+        color (tuple): BGR color of the vehicle
+        attributes (dict): States of signals
+        frame (int): Frame number
+    """
+    ax, ay, bx, by = box
+    cv2.rectangle(image, (ax, ay), (bx, by), color, -1)
+    light_radius = max((bx - ax) // 12, 2)
+    left_light = (ax + light_radius * 2, ay + light_radius * 2)
+    right_light = (bx - light_radius * 2, ay + light_radius * 2)
+    blink_is_on = (frame // c.SYNTHETIC_BLINK_FRAMES) % 2 == 0
+    if attributes.get('brake'):
+        cv2.circle(image, left_light, light_radius, (0, 0, 255), -1)
+        cv2.circle(image, right_light, light_radius, (0, 0, 255), -1)
+    if blink_is_on:
+        amber = (0, 190, 255)
+        side_light_y = ay + (by - ay) // 2
+        if attributes.get('turn_left') or attributes.get('alarm'):
+            cv2.circle(image, (ax + light_radius, side_light_y), light_radius, amber, -1)
+        if attributes.get('turn_right') or attributes.get('alarm'):
+            cv2.circle(image, (bx - light_radius, side_light_y), light_radius, amber, -1)
+
+
+
+def write_synthetic_video(video_path, tracks, frames_number, resolution, fps,
+                          rng):
+    """Writes video with vehicles of tracks.
+
+    Args:
+        video_path (str): Path to the new video file
+        tracks (list): Tracks from 'get_synthetic_tracks'
+        frames_number (int): Number of frames in video
+        resolution (tuple): Width and heights of video in pixels
+        fps (int): Frames per second of video
+        rng (random.Random): Random generator
+    """
+    width, height = resolution
+    noise_generator = np.random.default_rng(rng.randrange(2 ** 32))
+    # Noise makes encoding and decoding cost closer to real footage
+    background = noise_generator.integers(
+        60, 100, size=(height, width, 3), dtype=np.uint8
+    )
+    codec = cv2.VideoWriter_fourcc(*c.SYNTHETIC_VIDEO_CODEC)
+    output = cv2.VideoWriter(video_path, codec, fps, resolution)
+    assert output.isOpened(), f"Can not write video: {video_path}"
+    for frame in range(frames_number):
+        image = background.copy()
+        for track in tracks:
+            draw_vehicle(
+                image,
+                track['boxes'][frame],
+                track['color'],
+                track['attributes'][frame],
+                frame
+            )
+        output.write(image)
+    output.release()
+
+
+
+def get_cvat_annotation(source_name, tracks, frames_number, resolution):
+    """Generates annotation in CVAT for video 1.1 XML format.
+
+    Args:
+        source_name (str): Name of the video file
+        tracks (list): Tracks from 'get_synthetic_tracks'
+        frames_number (int): Number of frames in video
+        resolution (tuple): Width and heights of video in pixels
+
+    Returns:
+        str: XML annotation
+    """
+    label_attributes = ''.join(
+        f"<attribute><name>{attribute}</name><mutable>True</mutable>"
+        f"<input_type>checkbox</input_type><default_value>false</default_value>"
+        f"<values>false</values></attribute>"
+        for attribute in c.SYNTHETIC_ATTRIBUTES
+    )
+    xml = [
+        '<?xml version="1.0" encoding="utf-8"?>',
+        '<annotations><version>1.1</version><meta><task>',
+        f"<size>{frames_number}</size><mode>interpolation</mode>",
+        f"<start_frame>0</start_frame><stop_frame>{frames_number - 1}</stop_frame>",
+        f"<labels><label><name>{c.CVAT_LABELS}</name>",
+        f"<attributes>{label_attributes}</attributes></label></labels>",
+        f"<original_size><width>{resolution[0]}</width>",
+        f"<height>{resolution[1]}</height></original_size>",
+        f"</task><source>{source_name}</source></meta>",
+    ]
+    for track in tracks:
+        xml.append(f"<track id=\"{track['id']}\" label={quoteattr(c.CVAT_LABELS)}>")
+        for frame, (box, attributes) in \
+                enumerate(zip(track['boxes'], track['attributes'])):
+            box_attributes = ''.join(
+                f"<attribute name=\"{attribute}\">{str(state).lower()}</attribute>"
+                for attribute, state in attributes.items()
+            )
+            xml.append(
+                f"<box frame=\"{frame}\" outside=\"0\" occluded=\"0\" keyframe=\"1\" "
+                f"xtl=\"{box[0]}.00\" ytl=\"{box[1]}.00\" "
+                f"xbr=\"{box[2]}.00\" ybr=\"{box[3]}.00\" z_order=\"0\">"
+                f"{box_attributes}</box>"
+            )
+        xml.append('</track>')
+    xml.append('</annotations>')
+    return '\n'.join(xml)
+
+
+
+def get_annotation_name(video_name):
+    """Generates CVAT export name of the annotation archive.
+
+    Args:
+        video_name (str): Name of the video file
+
+    Returns:
+        str: Archive name
+    """
+    return f"{c.CVAT_STARTSWITH}{video_name.lower()}_{c.CVAT_ENDSWITH}"
+
+
+
+def generate_synthetic_dataset(output_path, videos_number, frames_number,
+                               resolution, fps, tracks_number, switch_rate,
+                               seed=0):
+    """Generates source videos and annotation archives.
+
+    Args:
+        output_path (str): Path to the output directory
+        videos_number (int): Number of videos
+        frames_number (int): Number of frames in every video
+        resolution (tuple): Width and heights of videos in pixels
+        fps (int): Frames per second of videos
+        tracks_number (int): Number of vehicles in every video
+        switch_rate (float): Expected switches of every signal per
+            second
+        seed (int, optional): Seed of generator. Defaults to 0.
+
+    Returns:
+        list: Names of generated videos
+    """
+    # Single track is collapsed to dict by xmltodict, parser needs list
+    assert tracks_number >= 2, "At least 2 tracks are needed"
+    os.makedirs(output_path, exist_ok=True)
+    rng = random.Random(seed)
+    video_names = []
+    for video_index in range(videos_number):
+        video_name = f"{c.SYNTHETIC_VIDEO_PREFIX}{video_index:05d}.ts"
+        tracks = get_synthetic_tracks(
+            frames_number, tracks_number, resolution, fps, switch_rate, rng
+        )
+        write_synthetic_video(
+            os.path.join(output_path, video_name),
+            tracks, frames_number, resolution, fps, rng
+        )
+        annotation = get_cvat_annotation(video_name, tracks, frames_number, resolution)
+        annotation_path = os.path.join(output_path, get_annotation_name(video_name))
+        with ZipFile(annotation_path, 'w', ZIP_DEFLATED) as archive:
+            archive.writestr('annotations.xml', annotation)
+        video_names.append(video_name)
+    return video_names
+
+
+
+def add_synthetic_arguments(parser):
+    """Adds arguments of synthetic data generation to parser.
+
+    Args:
+        parser (obj): Parser object
+
+    Returns:
+        obj: Parser object with synthetic data arguments
+    """
+    parser.add_argument(
+        '--videos',
+        type=int,
+        default=c.SYNTHETIC_VIDEOS,
+        help='Number of synthetic videos'
+    )
+    parser.add_argument(
+        '--frames',
+        type=int,
+        default=c.SYNTHETIC_FRAMES,
+        help='Number of frames in every video'
+    )
+    parser.add_argument(
+        '--width',
+        type=int,
+        default=c.SYNTHETIC_RESOLUTION[0],
+        help='Width of videos in pixels'
+    )
+    parser.add_argument(
+        '--height',
+        type=int,
+        default=c.SYNTHETIC_RESOLUTION[1],
+        help='Height of videos in pixels'
+    )
+    parser.add_argument(
+        '--fps',
+        type=int,
+        default=c.SYNTHETIC_FPS,
+        help='Frames per second of videos'
+    )
+    parser.add_argument(
+        '--tracks',
+        type=int,
+        default=c.SYNTHETIC_TRACKS,
+        help='Number of vehicle tracks in every video (at least 2)'
+    )
+    parser.add_argument(
+        '--switch-rate',
+        type=float,
+        default=c.SYNTHETIC_SWITCH_RATE,
+        help='Expected switches of every signal per second'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Seed of generator'
+    )
+    return parser
+
+
+
+if __name__ == '__main__':
+    """Generates synthetic input directory.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-o',
+        '--output',
+        type=str,
+        required=True,
+        help='Output directory for videos and annotation archives'
+    )
+    parser = add_synthetic_arguments(parser)
+    args = parser.parse_args()
+    video_names = generate_synthetic_dataset(
+        args.output,
+        args.videos,
+        args.frames,
+        (args.width, args.height),
+        args.fps,
+        args.tracks,
+        args.switch_rate,
+        args.seed
+    )
+    print(f"Generated {len(video_names)} videos: {args.output}")
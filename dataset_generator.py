@@ -8,21 +8,35 @@ Author: Filippenko Artyom, 2021-2022
 MISIS Master Degree Project
 """
 import os
+import time
 import argparse
 
+from collections import OrderedDict
+
 from utils import constants as c
 from utils import args_parser
 from utils import logging_tool
 from utils import filesystem_tool as fs
 from utils import extractor
 from utils import video_editor
-from utils import video_writer
+from utils import manifest_tool
+from utils import planner
+from utils import sharding
+from utils import scheduler
+from utils import sweep
+from utils import profiler
+from utils import metrics as generation_metrics
+from utils import memory
 
 
 
 def analyze_video(source_path, output_path, file, annotation,
-                  overwrite, mode, logger, allow_class_mixing):
-    """Creates extraction task.
+                  overwrite, mode, logger, allow_class_mixing, manifest,
+                  class_balance=None, build_key=None, annotation_data=None,
+                  resolutions=None, script_overrides=None):
+    """Creates extraction task. Annotation is read only if video is not
+    up to date in the build manifest or if classes are balanced, as
+    balancing needs chunks of all videos.
 
     Args:
         source_path (str): Path to the source directory
@@ -35,12 +49,24 @@ def analyze_video(source_path, output_path, file, annotation,
         allow_class_mixing (bool): e.g. If True - One frame can be added to
             brake and turn_left classes at the same time. Else - mixed signals
             frames will be dropped as confusing.
+        manifest (obj): BuildManifest instance
+        class_balance (dict, optional): Class balancing settings.
+            Defaults to None - settings from constants.
+        build_key (str, optional): Key of the extraction in manifest.
+            Defaults to None - video name.
+        annotation_data (tuple, optional): Already parsed annotation of
+            the video. Defaults to None.
+        resolutions (list, optional): Output resolutions. Defaults to
+            None - resolutions from constants.
+        script_overrides (dict, optional): Script settings of the
+            extraction instead of constants. ex.: {'chunk_size': 7}.
+            Defaults to None.
 
     Returns:
         obj: ExtractionTask instance
     """
     if debug:
-        logger.debug(f"Analyzing... {file}")
+        logger.debug("Analyzing... %s", file)
     extraction = extractor.ExtractionTask(
         source_path,
         output_path,
@@ -51,7 +77,26 @@ def analyze_video(source_path, output_path, file, annotation,
         logger,
         allow_class_mixing
     )
-    extraction.read_annotation()
+    if class_balance is not None:
+        extraction.class_balance = class_balance
+    if build_key is not None:
+        extraction.build_key = build_key
+    if resolutions is not None:
+        extraction.resolutions = resolutions
+    if script_overrides is not None:
+        for setting, value in script_overrides.items():
+            setattr(extraction, setting, value)
+    extraction.annotation_hash = \
+        manifest_tool.get_file_hash(extraction.annotation_path)
+    extraction.build_settings = video_editor.read_script_settings(extraction)
+    extraction.is_up_to_date = manifest.is_up_to_date(
+        extraction.build_key,
+        extraction.annotation_hash,
+        manifest_tool.get_settings_hash(extraction.build_settings)
+    )
+    if extraction.is_up_to_date and not extraction.class_balance['enabled']:
+        return extraction
+    extraction.read_annotation(annotation_data)
     extraction.is_supported = fs.supported_labels_check(extraction)
 
     return extraction
@@ -59,9 +104,28 @@ def analyze_video(source_path, output_path, file, annotation,
 
 
 def generate_dataset(video_path, output_path, mode,
-                     overwrite, logger, allow_class_mixing):
+                     overwrite, logger, allow_class_mixing, manifest,
+                     shard_index=0, num_shards=1, workers=1,
+                     class_balance=None, multi_modes=c.MULTI_MODES,
+                     resolutions=None, sweep_configs=None, metrics=None,
+                     max_memory=None):
     """Runs generator. Analyzes files in 'video_path' and if finds some
-    supported ones (with annotation)
+    supported ones (with annotation). Videos which were already built
+    with the same annotation and settings are skipped. Scripts of all
+    videos are created first, then chunks are written by scheduler.
+    With class balancing scripts of all videos are balanced together and
+    video is skipped only if its selected chunks are the same too.
+
+    Durations and memory peaks of generation stages are collected for
+    every video and written to the JSON report in the output directory.
+    Live throughput and progress are collected by metrics. With memory
+    budget workers take new tasks only while their estimated memory fits
+    it.
+
+    In 'multi' mode scripts are created for every mode from
+    'multi_modes' and written to '{output_path}/{mode}'. Every source is
+    decoded once for all modes. Sweep works the same way with one
+    dataset '{output_path}/{config_name}' per configuration of settings.
 
     WARNING: Annotation file must meet the criteria:
     filename = 'task_{VIDEO_FILE_NAME}_cvat for video 1.1.zip'.
@@ -71,57 +135,271 @@ def generate_dataset(video_path, output_path, mode,
         video_path (str): Path to the video files and annotation
             directory
         output_path (str): Path to the output directory
-        mode (str): 'sequence' or 'singleshot'
+        mode (str): 'sequence', 'singleshot', 'difference' or 'multi'
         overwrite (bool): Overwrite dataset if already exists
         logger (obj): logging class object
         allow_class_mixing (bool): e.g. If True - One frame can be added to
             brake and turn_left classes at the same time. Else - mixed signals
             frames will be dropped as confusing.
+        manifest (obj): BuildManifest instance
+        shard_index (int, optional): Index of the shard. Defaults to 0.
+        num_shards (int, optional): Number of shards. Defaults to 1.
+        workers (int, optional): Number of worker processes. Defaults
+            to 1.
+        class_balance (dict, optional): Class balancing settings.
+            Defaults to None - settings from constants.
+        multi_modes (tuple, optional): Modes of 'multi' mode. Defaults
+            to MULTI_MODES from constants.
+        resolutions (list, optional): Output resolutions. Several ones
+            are written to '{output_path}/{W}x{H}'. Defaults to None -
+            resolutions from constants.
+        sweep_configs (list, optional): Settings of sweep
+            configurations. Defaults to None - no sweep.
+        metrics (obj, optional): GenerationMetrics instance. Defaults to
+            None - metrics are collected without writing to files.
+        max_memory (int, optional): Memory budget of all processes in
+            bytes. Defaults to None - MAX_MEMORY from constants.
+
+    Returns:
+        obj: GenerationMetrics instance with metrics of the run
     """
+    start_time = time.perf_counter()
+    if metrics is None:
+        metrics = generation_metrics.GenerationMetrics()
+    if max_memory is None:
+        max_memory = c.MAX_MEMORY
+    if class_balance is None:
+        class_balance = video_editor.get_class_balance_settings()
+    # Variant is a dataset from the same sources: (name, mode, settings)
+    variants = [(None, mode, None)]
+    if mode == 'multi':
+        variants = [(variant_mode, variant_mode, None) for variant_mode in multi_modes]
+    elif sweep_configs:
+        variants = [
+            (sweep.get_config_name(config), mode, config)
+            for config in sweep_configs
+        ]
+    extractions = OrderedDict()
+    analyzed_extractions = OrderedDict()
+    video_profilers = OrderedDict()
+    # Unrecorded chunks of interrupted videos: {output path: source names}
+    interrupted_sources = {}
+    def start_video(key, extraction):
+        """Subtask. Marks extraction as started in manifest. Unrecorded
+        chunks of interrupted extraction are removed before writing.
+
+        Args:
+            key (str): Key of the extraction in manifest
+            extraction (obj): ExtractionTask instance
+        """
+        is_interrupted = manifest.start_video(
+            key,
+            extraction.info['source_name'],
+            extraction.annotation_hash,
+            extraction.build_settings
+        )
+        if is_interrupted:
+            interrupted_sources.setdefault(extraction.output_path, set()).add(
+                extraction.info['source_name']
+            )
+
     supported_files = fs.extract_video_from_path(video_path)
-    for file, annotation in supported_files.items():
-        extraction = analyze_video(
+    if num_shards > 1:
+        supported_files = sharding.get_shard_files(
             video_path,
-            output_path,
-            file,
-            annotation,
-            overwrite,
-            mode,
-            logger,
-            allow_class_mixing,
+            supported_files,
+            shard_index,
+            num_shards
         )
-        if extraction.is_supported:
-            export_chunks_from_extraction(extraction)
+    for file, annotation in supported_files.items():
+        annotation_data = None
+        for variant_name, variant_mode, script_overrides in variants:
+            extraction_output_path = output_path
+            build_key = file
+            if variant_name is not None:
+                extraction_output_path = os.path.join(output_path, variant_name)
+                build_key = f"{variant_name}/{file}"
+            video_profiler = profiler.get_new_profiler()
+            with profiler.collect(video_profiler):
+                extraction = analyze_video(
+                    video_path,
+                    extraction_output_path,
+                    file,
+                    annotation,
+                    overwrite,
+                    variant_mode,
+                    logger,
+                    allow_class_mixing,
+                    manifest,
+                    class_balance,
+                    build_key,
+                    annotation_data,
+                    resolutions,
+                    script_overrides,
+                )
+            extraction.variant = variant_name
+            # Balanced selection is checked after balancing of all videos
+            if extraction.is_up_to_date and \
+                    (not class_balance['enabled'] or not extraction.is_supported):
+                if debug:
+                    logger.debug("Video is up to date in manifest. Skip file...")
+                continue
+            if video_profiler is not None:
+                video_profilers[build_key] = video_profiler
+            annotation_data = \
+                (extraction.annotation_meta, extraction.annotation_tracks)
+            if not extraction.is_supported:
+                if debug:
+                    logger.debug("No supported labels for extraction")
+                start_video(build_key, extraction)
+                manifest.finish_video(build_key, [], {})
+            else:
+                # Balanced videos are started when selection of all
+                # videos is known
+                if not class_balance['enabled']:
+                    start_video(build_key, extraction)
+                analyzed_extractions[build_key] = extraction
+
+    # Track analysis of all videos and variants runs in parallel
+    scripts = scheduler.plan_scripts(
+        list(analyzed_extractions.values()), workers, max_memory
+    )
+    for (build_key, extraction), (script, timings, memory_peaks) in \
+            zip(analyzed_extractions.items(), scripts):
+        if build_key in video_profilers:
+            video_profilers[build_key].merge(timings)
+            video_profilers[build_key].merge_memory_peaks(memory_peaks)
+        # Parsed annotation is not needed after track analysis
+        extraction.annotation_tracks = None
+        if prepare_script(extraction, script):
+            extractions[build_key] = extraction
         else:
+            if class_balance['enabled']:
+                start_video(build_key, extraction)
+            manifest.finish_video(build_key, [], extraction.script['statistics'])
+
+    if class_balance['enabled'] and extractions:
+        # Classes of different variants are not comparable
+        for variant_name, _, _ in variants:
+            targets = video_editor.balance_scripts(
+                {key: extraction.script for key, extraction in extractions.items()
+                 if extraction.variant == variant_name},
+                class_balance
+            )
             if debug:
-                logger.debug("No supported labels for extraction")
+                logger.debug("Class balance targets: %s: %s", variant_name, targets)
+        for key, extraction in list(extractions.items()):
+            # Selected chunks of the video depend on all videos, so the
+            # video is up to date only if its selection is the same
+            extraction.build_settings['balanced_chunks'] = manifest_tool.get_settings_hash([
+                (chunk['track'], chunk['class'], list(chunk['sequence'].keys()))
+                for chunk in extraction.script['chunks']
+            ])
+            if manifest.is_up_to_date(
+                    key,
+                    extraction.annotation_hash,
+                    manifest_tool.get_settings_hash(extraction.build_settings)):
+                if debug:
+                    logger.debug("Video is up to date in manifest: %s. Skip file...", key)
+                video_profilers.pop(key, None)
+                del extractions[key]
+                continue
+            start_video(key, extraction)
+            if len(extraction.script['chunks']) == 0:
+                manifest.finish_video(key, [], extraction.script['statistics'])
+                del extractions[key]
+
+    for extraction_output_path, source_names in interrupted_sources.items():
+        removed_files = manifest_tool.remove_partial_files(
+            extraction_output_path, source_names
+        )
+        if debug:
+            logger.debug("Removed %d partial files of interrupted videos", removed_files)
+
+    def finish_video(key, writer_report):
+        """Subtask. Records chunks of the finished video to manifest.
+
+        Args:
+            key (str): Key of the extraction in manifest
+            writer_report (OrderedDict): Merged report of writer
+        """
+        if debug:
+            logger.debug("Finished: %s", key)
+            logging_tool.log_writer_report(logger, writer_report)
+        if key in video_profilers:
+            video_profilers[key].merge(writer_report['Stage timings'])
+            video_profilers[key].merge_memory_peaks(writer_report['Stage memory'])
+        manifest.finish_video(
+            key,
+            writer_report['Written chunks list'],
+            extractions[key].script['statistics']
+        )
 
+    def record_chunks(key, writer_report):
+        """Subtask. Records chunks of the finished sub-task to manifest.
 
+        Args:
+            key (str): Key of the extraction in manifest
+            writer_report (OrderedDict): Report of writer
+        """
+        manifest.add_chunks(key, writer_report['Written chunks list'])
+
+    tasks = scheduler.get_tasks(extractions.values(), max_memory)
+    metrics.start_videos(
+        {key: extraction.script['statistics'] for key, extraction in extractions.items()},
+        len(tasks),
+        workers
+    )
+    scheduler.run_tasks(tasks, workers, finish_video, logger, metrics, max_memory,
+                        record_chunks)
+    metrics.finish()
+
+    if video_profilers:
+        report_path = profiler.write_report(
+            output_path,
+            video_profilers,
+            time.perf_counter() - start_time,
+            {'mode': mode, 'workers': workers, 'videos': len(video_profilers),
+             'max_memory': max_memory}
+        )
+        if debug:
+            logger.debug("Profile report: %s", report_path)
+
+    if sweep_configs:
+        sweep_stats = sweep.get_sweep_stats(sweep_configs, manifest)
+        stats_path = sweep.write_sweep_stats(output_path, sweep_stats)
+        sweep.print_sweep_stats(sweep_stats)
+        if debug:
+            logger.debug("Sweep stats: %s", stats_path)
+
+    return metrics
 
-def export_chunks_from_extraction(extraction):
-    """Generate script data, and if script has at least one chunk -
-    creates direc
+
+
+def prepare_script(extraction, script=None):
+    """Generate script data and checks if script has at least one
+    chunk.
 
     Args:
         extraction (obj): ExtractionTask instance
+        script (dict, optional): Already generated script. Defaults to
+            None - script is generated.
+
+    Returns:
+        bool: True if there are chunks to write, else - False
     """
-    extraction.script = video_editor.get_script(extraction)
+    if script is None:
+        script = video_editor.get_script(extraction)
+    extraction.script = script
     chunks_are_availible_in_script = (len(extraction.script['chunks']) > 0)
     if chunks_are_availible_in_script:
         if debug:
             extraction.log_attributes()
-            logger.debug(f"Writing chunks to: {extraction.output_path}")
-        writer_report = video_writer.start_writing_video_chunks(
-            source=extraction.source_path,
-            output=extraction.output_path,
-            script=extraction.script,
-            logger=logger
-        )
-        if debug:
-            logging_tool.log_writer_report(logger, writer_report)
+            logger.debug("Writing chunks to: %s", extraction.output_path)
     else:
         if debug:
             logger.debug("No chunks in script. Skip file...")
+    return chunks_are_availible_in_script
 
 
 
@@ -145,6 +423,7 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser = args_parser.add_custom_arguments(parser)
     args = parser.parse_args()
+    args_parser.check_arguments(parser, args)
     input_path = args.input
     output_path = args.output
     generator_mode = args.mode
@@ -158,12 +437,89 @@ if __name__ == '__main__':
         debug = args.debug
     else:
         debug = c.ENABLE_DEBUG_LOGGER
-    if debug:
-        logger = logging_tool.get_logger()
-    # Create directory for dataset
-    output_path = fs.create_dir(
-        path=output_path,
-        overwrite=overwrite
+    # Records of all processes are written by listener thread
+    logger = logging_tool.start_logging(debug)
+    # Started before the pool, so workers trace allocations too
+    memory.start_tracing(args.trace_memory)
+    class_balance = video_editor.get_class_balance_settings(
+        enabled=args.balance,
+        caps={**c.CLASS_BALANCE_CAPS,
+              **{name: int(value) for name, value in args.class_cap}},
+        ratios={**c.CLASS_BALANCE_RATIOS, **dict(args.class_ratio)},
+        strata=args.balance_strata
+    )
+    assert not (class_balance['enabled'] and args.num_shards > 1), \
+        "Class balancing needs all videos in one build, it does not support shards"
+    sweep_configs = None
+    if args.sweep:
+        assert generator_mode != 'multi', "Sweep does not support multi mode"
+        sweep_configs = sweep.get_sweep_configs(args.sweep)
+    if args.plan:
+        plan_variants = [(None, generator_mode, None)]
+        if generator_mode == 'multi':
+            plan_variants = [(plan_mode, plan_mode, None)
+                             for plan_mode in args.multi_modes]
+        elif sweep_configs:
+            plan_variants = [(sweep.get_config_name(config), generator_mode, config)
+                             for config in sweep_configs]
+        plans = planner.plan_dataset(input_path, plan_variants,
+                                     allow_class_mixing, logger,
+                                     class_balance=class_balance,
+                                     resolutions=args.resolutions,
+                                     max_memory=args.max_memory)
+        planner.print_plan(plans)
+        raise SystemExit(0)
+    if args.merge_shards:
+        index = sharding.merge_shards(output_path)
+        print(f"Merged {len(index['shards'])} shards: "
+              f"{index['chunks_total']} chunks total")
+        raise SystemExit(0)
+    if args.num_shards > 1:
+        os.makedirs(output_path, exist_ok=True)
+        output_path = sharding.get_shard_output_path(
+            output_path,
+            args.shard_index,
+            args.num_shards
+        )
+    if args.cleanup:
+        for removed_dir in fs.cleanup_trash_dirs(output_path):
+            print(f"Removed: {removed_dir}")
+        raise SystemExit(0)
+    # Create directory for dataset. Overwritten dataset is generated in
+    # staging directory, so old one is not deleted on the critical path.
+    # Resumed build continues in staging directory of the interrupted run
+    is_staging_resumed = args.resume and os.path.isdir(fs.get_staging_path(output_path))
+    if overwrite and (not args.resume or is_staging_resumed):
+        build_path = fs.create_staging_dir(output_path, resume=args.resume)
+    else:
+        build_path = fs.create_dir(
+            path=output_path,
+            overwrite=overwrite,
+            resume=args.resume
+        )
+    manifest = manifest_tool.BuildManifest(build_path)
+    metrics_path = args.metrics_dir if args.metrics_dir is not None else build_path
+    if args.metrics:
+        os.makedirs(metrics_path, exist_ok=True)
+    metrics = generation_metrics.GenerationMetrics(
+        metrics_path,
+        args.metrics,
+        args.metrics_interval,
+        args.progress
     )
-    generate_dataset(input_path, output_path, generator_mode,
-                     overwrite, logger, allow_class_mixing)
+    generator_args = (input_path, build_path, generator_mode,
+                      overwrite, logger, allow_class_mixing, manifest,
+                      args.shard_index, args.num_shards, args.workers,
+                      class_balance, args.multi_modes, args.resolutions,
+                      sweep_configs, metrics, args.max_memory)
+    if args.profile:
+        capture_path = profiler.run_with_capture(
+            args.profile, build_path, generate_dataset, *generator_args
+        )
+        capture_name = os.path.basename(capture_path)
+        print(f"Profile capture: {os.path.join(output_path, capture_name)}")
+    else:
+        generate_dataset(*generator_args)
+    manifest.close()
+    if build_path != output_path:
+        fs.swap_staging_dir(build_path, output_path)
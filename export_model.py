@@ -0,0 +1,115 @@
+"""
+Export module for the project of vehicle signals recognition.
+Converts trained keras model to TFLite with float16 and int8
+post-training quantization (optionally to ONNX) and benchmarks exported
+models on CPU against the keras model.
+"""
+import os
+import json
+import argparse
+
+from collections import OrderedDict
+
+from utils import constants as c
+from utils import model_export
+from run_inference import load_keras_model, get_classes
+
+
+def print_report(report):
+    accuracy_delta = report.get('accuracy_delta')
+    accuracy_delta = '' if accuracy_delta is None else f"{accuracy_delta:+.3f}"
+    agreement = report.get('agreement')
+    agreement = '' if agreement is None else f"{agreement:.3f}"
+    print(f"{report['model']:<18} {report['size_bytes'] / 2 ** 20:8.2f} MB "
+          f"{report['latency']['mean_ms']:8.2f} ms "
+          f"{report['throughput']['samples_per_second']:8.1f} samples/s "
+          f"accuracy: {report['accuracy']:.3f} {accuracy_delta:>7} "
+          f"agreement: {agreement}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export of trained model to TFLite / ONNX" \
+                                                 " with quantization and CPU benchmark")
+    parser.add_argument('--model', type=str, required=True,
+                        help='trained keras model, e.g. chkp/weights.XX-X.XX.hdf5')
+    parser.add_argument('--dataset', type=str, required=True,
+                        help="dataset with 'train' (calibration) and 'test' (benchmark) dirs")
+    parser.add_argument('--output', type=str, default='./export',
+                        help='directory of exported models and report (default: ./export)')
+    parser.add_argument('--quantization', type=str, nargs='+',
+                        default=list(c.EXPORT_QUANTIZATIONS),
+                        choices=['float32', 'float16', 'int8'],
+                        help='TFLite post-training quantizations (default: all)')
+    parser.add_argument('--onnx', action='store_true', default=False,
+                        help='export to ONNX too, tf2onnx and onnxruntime must be installed separately')
+    parser.add_argument('--calibration-samples', type=int, default=c.EXPORT_CALIBRATION_SAMPLES,
+                        help=f'training samples for int8 calibration (default: {c.EXPORT_CALIBRATION_SAMPLES})')
+    parser.add_argument('--test-samples', type=int, default=None,
+                        help='random subset of test split for benchmark (default: all)')
+    parser.add_argument('--batch-size', type=int, default=c.EXPORT_BENCHMARK_BATCH,
+                        help=f'batch of throughput measurement (default: {c.EXPORT_BENCHMARK_BATCH})')
+    parser.add_argument('--rescale', type=float, default=None,
+                        help='scale of samples (default: 1/255 for sequence models, 1 for image models)')
+    parser.add_argument('--classes', type=str, nargs='+', default=None,
+                        help='class names in order of model outputs')
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    model = load_keras_model(args.model)
+    input_shape = tuple(model.input_shape[1:])
+    classes = get_classes(args, model.output_shape[-1])
+    rescale = args.rescale
+    if rescale is None:
+        # LSTM is trained on VideoFrameGenerator frames, CNN on raw pixels
+        rescale = 1/255. if len(input_shape) == 4 else 1.
+    calibration_samples, _ = model_export.load_samples(
+        args.dataset, 'train', input_shape, classes, limit=args.calibration_samples)
+    test_samples, test_labels = model_export.load_samples(
+        args.dataset, 'test', input_shape, classes, limit=args.test_samples)
+
+    reports = []
+    keras_report, keras_classes = model_export.benchmark_model(
+        'keras', model.predict_on_batch, model_export.get_file_size(args.model),
+        test_samples, test_labels, None, args.batch_size, rescale)
+    reports.append(keras_report)
+    model_name = os.path.splitext(os.path.basename(args.model.rstrip('/\\')))[0]
+    for quantization in args.quantization:
+        tflite_path = os.path.join(args.output, f'{model_name}_{quantization}.tflite')
+        with open(tflite_path, 'wb') as file:
+            file.write(model_export.convert_tflite(model, quantization, calibration_samples, rescale))
+        tflite_model = model_export.TFLiteModel(tflite_path)
+        report, _ = model_export.benchmark_model(
+            f'tflite_{quantization}', tflite_model.predict, os.path.getsize(tflite_path),
+            test_samples, test_labels, keras_classes, args.batch_size, rescale)
+        report['path'] = tflite_path
+        reports.append(report)
+    if args.onnx:
+        onnx_path = os.path.join(args.output, f'{model_name}.onnx')
+        model_export.convert_onnx(model, onnx_path)
+        onnx_model = model_export.ONNXModel(onnx_path)
+        report, _ = model_export.benchmark_model(
+            'onnx', onnx_model.predict, os.path.getsize(onnx_path),
+            test_samples, test_labels, keras_classes, args.batch_size, rescale)
+        report['path'] = onnx_path
+        reports.append(report)
+    for report in reports[1:]:
+        report['accuracy_delta'] = report['accuracy'] - keras_report['accuracy']
+    for report in reports:
+        print_report(report)
+
+    export_report = OrderedDict()
+    export_report['model'] = args.model
+    export_report['input_shape'] = list(input_shape)
+    export_report['classes'] = classes
+    export_report['rescale'] = rescale
+    export_report['calibration_samples'] = len(calibration_samples)
+    export_report['test_samples'] = len(test_samples)
+    export_report['results'] = reports
+    report_path = os.path.join(args.output, c.EXPORT_REPORT_FILENAME)
+    with open(report_path, 'w', encoding='utf-8') as file:
+        json.dump(export_report, file, indent=4)
+    print(f"Report: {report_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Inference module for the project of vehicle signals recognition.
+Classifies every tracked vehicle of the full video with trained model.
+"""
+import os
+import argparse
+
+from utils import constants as c
+from utils import inference
+
+
+def load_keras_model(model_path):
+    """Loads trained keras model, e.g. checkpoint of training scripts.
+
+    Args:
+        model_path (str): Path to the model
+
+    Returns:
+        obj: Keras model
+    """
+    import keras
+
+    return keras.models.load_model(model_path)
+
+
+def get_classes(args, outputs_number):
+    """Returns class names in order of model outputs: sorted directories
+    of the training dataset, as in training scripts.
+
+    Args:
+        args (obj): Parsed arguments
+        outputs_number (int): Number of model outputs
+
+    Returns:
+        list: Class names
+    """
+    if args.classes:
+        classes = list(args.classes)
+    elif args.dataset is not None:
+        train_path = os.path.join(args.dataset, 'train')
+        classes = sorted(
+            name for name in os.listdir(train_path)
+            if os.path.isdir(os.path.join(train_path, name))
+        )
+    else:
+        classes = [f'class_{index}' for index in range(outputs_number)]
+    assert len(classes) == outputs_number, \
+        f"Model has {outputs_number} outputs, got {len(classes)} classes"
+    return classes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming inference of vehicle signals" \
+                                                 " for every track of the video")
+    parser.add_argument('--video', type=str, required=True,
+                        help='source video (.ts)')
+    parser.add_argument('--tracks', type=str, required=True,
+                        help='CVAT archive (.zip) or tracker output in MOT format' \
+                             ' (frame,id,left,top,width,height,...)')
+    parser.add_argument('--model', type=str, required=True,
+                        help='trained keras model, e.g. chkp/weights.XX-X.XX.hdf5')
+    parser.add_argument('--output', type=str, default='./inference',
+                        help='directory of predictions and report (default: ./inference)')
+    parser.add_argument('--dataset', type=str, default=None,
+                        help='training dataset, its class directories name model outputs')
+    parser.add_argument('--classes', type=str, nargs='+', default=None,
+                        help='class names in order of model outputs')
+    parser.add_argument('--batch-size', type=int, default=c.INFERENCE_BATCH_SIZE,
+                        help=f'windows classified at once (default: {c.INFERENCE_BATCH_SIZE})')
+    parser.add_argument('--frame-step', type=int, default=c.FRAME_STEP,
+                        help=f'frames between crops of window (default: {c.FRAME_STEP})')
+    parser.add_argument('--incremental', action='store_true', default=False,
+                        help='split sequence model to per-frame encoder and temporal head,' \
+                             ' encode every crop once and keep embeddings of tracks')
+    parser.add_argument('--rescale', type=float, default=1/255.,
+                        help='scale of crops: 1/255 for LSTM (VideoFrameGenerator),' \
+                             ' 1 for CNN (default: 1/255)')
+    args = parser.parse_args()
+
+    model = load_keras_model(args.model)
+    input_shape = tuple(model.input_shape[1:])
+    if args.incremental:
+        encoder, head = inference.split_action_model(model)
+        classifier = inference.IncrementalClassifier(
+            encoder.predict_on_batch, head.predict_on_batch, input_shape,
+            frame_step=args.frame_step,
+            batch_size=args.batch_size,
+            rescale=args.rescale)
+    else:
+        classifier = inference.StreamingClassifier(
+            model.predict_on_batch, input_shape,
+            frame_step=args.frame_step,
+            batch_size=args.batch_size,
+            rescale=args.rescale)
+    outputs_number = model.output_shape[-1]
+    classes = get_classes(args, outputs_number)
+    report = inference.run_inference(args.video, args.tracks, classifier,
+                                     args.output, classes)
+    print(f"Tracks: {report['tracks_number']}, frames: {report['decoded_frames']}, " \
+          f"windows: {report['windows']}, encoded crops: {report['encoded_crops']} " \
+          f"in {report['seconds']:.2f} s " \
+          f"({report['frames_per_second']:.1f} frames/s, " \
+          f"{report['windows_per_second']:.1f} windows/s)")
+    print(f"Predictions: {report['predictions']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Serving module for the project of vehicle signals recognition.
+Local HTTP service with dynamic micro-batching of requests of tracks.
+"""
+import argparse
+
+from utils import constants as c
+from utils import serving
+from run_inference import get_classes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local inference service with dynamic" \
+                                                 " micro-batching")
+    parser.add_argument('--model', type=str, required=True,
+                        help='trained keras model or exported .tflite model')
+    parser.add_argument('--host', type=str, default=c.SERVING_HOST,
+                        help=f'host (default: {c.SERVING_HOST})')
+    parser.add_argument('--port', type=int, default=c.SERVING_PORT,
+                        help=f'port (default: {c.SERVING_PORT})')
+    parser.add_argument('--max-batch-size', type=int, default=c.SERVING_MAX_BATCH_SIZE,
+                        help=f'requests in micro-batch (default: {c.SERVING_MAX_BATCH_SIZE})')
+    parser.add_argument('--max-latency-ms', type=float, default=c.SERVING_MAX_LATENCY_MS,
+                        help='max wait of the first request of micro-batch' \
+                             f' (default: {c.SERVING_MAX_LATENCY_MS})')
+    parser.add_argument('--processes', type=int, default=0,
+                        help='worker processes with own model instance' \
+                             ' (default: 0 - model in the service process)')
+    parser.add_argument('--dataset', type=str, default=None,
+                        help='training dataset, its class directories name model outputs')
+    parser.add_argument('--classes', type=str, nargs='+', default=None,
+                        help='class names in order of model outputs')
+    parser.add_argument('--rescale', type=float, default=None,
+                        help='scale of crops (default: 1/255 for sequence models, 1 for image models)')
+    args = parser.parse_args()
+
+    run_batch, input_shape, outputs_number, executor = \
+        serving.get_batch_runner(args.model, args.processes)
+    classes = get_classes(args, outputs_number)
+    rescale = args.rescale
+    if rescale is None:
+        rescale = 1/255. if len(input_shape) == 4 else 1.
+    batcher = serving.MicroBatcher(
+        run_batch,
+        max_batch_size=args.max_batch_size,
+        max_latency=args.max_latency_ms / 1000,
+        concurrency=max(args.processes, 1))
+    server = serving.create_server(args.host, args.port, batcher, input_shape, classes, rescale)
+    print(f"Serving {args.model} on http://{args.host}:{args.port}" \
+          f" (POST /predict, GET /metrics, GET /health)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.stop()
+        executor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
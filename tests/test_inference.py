@@ -0,0 +1,38 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+
+from utils import inference
+
+
+
+class EdgeBoxTest(unittest.TestCase):
+    def test_mot_box_crossing_the_edge(self):
+        with tempfile.TemporaryDirectory() as directory:
+            tracks_path = os.path.join(directory, 'tracks.txt')
+            with open(tracks_path, 'w', encoding='utf-8') as file:
+                file.write('1,7,-3.5,-2.0,20.0,30.0,1,-1,-1,-1\n')
+                file.write('2,7,-30.0,10.0,20.0,30.0,1,-1,-1,-1\n')
+            track_boxes = inference.read_mot_tracks(tracks_path)
+        frame_boxes = inference.get_frame_boxes(track_boxes)
+        classifier = inference.StreamingClassifier(
+            lambda batch: np.zeros((len(batch), 3)), (32, 32, 3), batch_size=1)
+        image = np.full((48, 64, 3), 255, dtype=np.uint8)
+        for frame in sorted(frame_boxes):
+            classifier.add_frame(frame, image, frame_boxes[frame])
+        classifier.flush()
+        # The first box is clipped, the second one is out of the frame
+        self.assertEqual(classifier.crops_counter, 1)
+        self.assertEqual([frame for _, frame, _ in classifier.pop_predictions()], [0])
+
+
+    def test_clip_box(self):
+        self.assertEqual(inference.clip_box((-3, -2, 16, 28), (48, 64, 3)), (0, 0, 16, 28))
+        self.assertEqual(inference.clip_box((50, 40, 70, 60), (48, 64, 3)), (50, 40, 64, 48))
+        self.assertIsNone(inference.clip_box((-30, 10, -10, 40), (48, 64, 3)))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import json
+import time
+import unittest
+import threading
+import http.client
+import concurrent.futures
+import numpy as np
+
+from utils import serving
+
+
+
+class MicroBatcherTest(unittest.TestCase):
+    def test_backlog_forms_full_batches(self):
+        executor = concurrent.futures.ThreadPoolExecutor(1)
+        batch_sizes = []
+
+        def run_batch(batch):
+            batch_sizes.append(len(batch))
+            def predict():
+                time.sleep(0.05)
+                return np.zeros((len(batch), 3))
+            return executor.submit(predict)
+
+        batcher = serving.MicroBatcher(run_batch, max_batch_size=8,
+                                       max_latency=0.01)
+        futures = [batcher.submit(np.zeros(4)) for _ in range(40)]
+        results = [future.result(timeout=5) for future in futures]
+        batcher.stop()
+        executor.shutdown()
+        self.assertEqual(sum(batch_sizes), 40)
+        # Only the first request can be sent before the backlog is queued
+        self.assertTrue(all(size == 8 for size in batch_sizes[1:-1]), batch_sizes)
+        self.assertLessEqual(len(batch_sizes), 6)
+        self.assertEqual([size for _, size in results[-8:]], [batch_sizes[-1]] * 8)
+
+
+    def test_waits_for_slot_while_model_is_busy(self):
+        executor = concurrent.futures.ThreadPoolExecutor(1)
+        batch_sizes = []
+
+        def run_batch(batch):
+            batch_sizes.append(len(batch))
+            def predict():
+                time.sleep(0.2)
+                return np.zeros((len(batch), 3))
+            return executor.submit(predict)
+
+        batcher = serving.MicroBatcher(run_batch, max_batch_size=8,
+                                       max_latency=0.01)
+        first = batcher.submit(np.zeros(4))
+        time.sleep(0.05)
+        # Requests come one by one while the first batch is running
+        futures = []
+        for _ in range(8):
+            futures.append(batcher.submit(np.zeros(4)))
+            time.sleep(0.01)
+        first.result(timeout=5)
+        for future in futures:
+            future.result(timeout=5)
+        batcher.stop()
+        executor.shutdown()
+        self.assertEqual(batch_sizes, [1, 8])
+
+
+
+class PredictionServerTest(unittest.TestCase):
+    def test_undecodable_frames_are_bad_requests(self):
+        executor = concurrent.futures.ThreadPoolExecutor(1)
+        batcher = serving.MicroBatcher(
+            lambda batch: executor.submit(np.zeros, (len(batch), 3)))
+        server = serving.create_server('127.0.0.1', 0, batcher, (32, 32, 3),
+                                       ['a', 'b', 'c'], 1/255.)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            for frame in ('', '!!!!', 'QUJD', 7):
+                connection = http.client.HTTPConnection(*server.server_address, timeout=5)
+                connection.request('POST', '/predict', json.dumps({'frames': [frame]}))
+                response = connection.getresponse()
+                self.assertEqual(response.status, 400, frame)
+                self.assertIn('error', json.loads(response.read()))
+                connection.close()
+            self.assertIn('inference_service_errors_total 4',
+                          batcher.metrics.get_prometheus_lines())
+        finally:
+            server.shutdown()
+            server.server_close()
+            batcher.stop()
+            executor.shutdown()
+
+
+
+if __name__ == '__main__':
+    unittest.main()
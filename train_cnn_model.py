@@ -14,6 +14,9 @@ from matplotlib import pyplot as plt
 from keras.layers import Conv2D, BatchNormalization, MaxPool2D, GlobalMaxPool2D
 from keras.layers import Dense, Dropout
 
+from utils import constants as c
+from utils import data_pipeline
+
 
 def build_convnet(shape=(112, 112, 3)):
     momentum = .9
@@ -118,6 +121,15 @@ def main():
                         help='Patience for early start')
     parser.add_argument('--dry-run', action='store_true', default=False,
                         help='quickly check a single pass')
+    parser.add_argument('--tf-data', action='store_true', default=False,
+                        help='decode images once to uint8 cache, parallel map and prefetch')
+    parser.add_argument('--tf-data-cache', type=str, default='', metavar='FILE',
+                        help='file of tf.data cache of decoded images (default: in memory)')
+    parser.add_argument('--augment', action='store_true', default=False,
+                        help='random flip and shift of training images (with --tf-data)')
+    parser.add_argument('--benchmark-input', action='store_true', default=False,
+                        help='compare steps/s of image_dataset_from_directory and' \
+                             ' --tf-data pipelines without training and exit')
     args = parser.parse_args()
 
     # some global params
@@ -148,6 +160,35 @@ def main():
         image_size=SIZE,
         batch_size=TEST_BS)
 
+    if args.tf_data or args.benchmark_input:
+        # Images are decoded once to uint8 cache, float conversion and
+        # augmentation run in graph. Values are in the same range as in
+        # image_dataset_from_directory (0-255), resized images differ
+        # only by uint8 rounding
+        train_dataset, train_number, _ = data_pipeline.get_image_dataset(
+            f"{args.input}/train", SIZE)
+        test_dataset, test_number, _ = data_pipeline.get_image_dataset(
+            f"{args.input}/test", SIZE)
+        test_cache = f'{args.tf_data_cache}_test' if args.tf_data_cache else ''
+        fast_train = data_pipeline.get_training_pipeline(
+            train_dataset, train_number, len(train.class_names), BS,
+            shuffle=True, augment=args.augment, cache_path=args.tf_data_cache,
+            rescale=1., one_hot=False)
+        fast_valid = data_pipeline.get_training_pipeline(
+            test_dataset, test_number, len(train.class_names), TEST_BS,
+            shuffle=False, augment=False, cache_path=test_cache,
+            rescale=1., one_hot=False)
+        if args.benchmark_input:
+            for name, dataset in (('image_dataset_from_directory', train),
+                                  ('tf.data cache + prefetch', fast_train)):
+                steps_per_second = data_pipeline.benchmark_pipeline(
+                    dataset, c.PIPELINE_BENCHMARK_EPOCHS)
+                print(f"{name:<30} " + " ".join(
+                    f"epoch {epoch + 1}: {steps:8.1f} steps/s"
+                    for epoch, steps in enumerate(steps_per_second)))
+            return
+        train, valid = fast_train, fast_valid
+
     INSHAPE=SIZE + (CHANNELS,) # (112, 112, 3)
     model = cnn_model(INSHAPE)
 
@@ -13,14 +13,79 @@ import keras
 import tensorflow
 import time
 import keras_video.utils
+import json
 import argparse
+import numpy as np
 
 from plot_keras_history import plot_history
 from matplotlib import pyplot as plt
 from keras_video import VideoFrameGenerator
 from keras.layers import Conv2D, BatchNormalization, MaxPool2D, GlobalMaxPool2D
 from keras.layers import TimeDistributed, Dense, Dropout, LSTM
-
+from keras.layers import Conv3D, MaxPool3D, GlobalAveragePooling3D, GRU
+from keras.layers import SeparableConv2D, GlobalAveragePooling2D, Permute, Reshape, ReLU
+
+from utils import constants as c
+from utils import tensor_cache
+from utils import data_pipeline
+from utils import feature_cache
+from utils import model_profile
+
+
+
+class TensorCacheGenerator(keras.utils.Sequence):
+    """Batches of pre-decoded tensor cache. Replaces VideoFrameGenerator
+    with the same normalization and augmentation, but without decoding
+    of videos.
+    """
+    def __init__(self, frames, labels, nbout, batch_size=16, shuffle=True,
+                 transformation=None, rescale=1/255.):
+        """
+        Args:
+            frames (array): Memory-mapped uint8 frames (N, NBFRAME, H, W, 3)
+            labels (array): Class indexes (N,)
+            nbout (int): Number of classes
+            batch_size (int, optional): Defaults to 16.
+            shuffle (bool, optional): Shuffle samples every epoch.
+                Defaults to True.
+            transformation (obj, optional): ImageDataGenerator. The same
+                random transform is applied to all frames of the sample.
+                Defaults to None.
+            rescale (float, optional): Defaults to 1/255.
+        """
+        self.frames = frames
+        self.labels = labels
+        self.nbout = nbout
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.transformation = transformation
+        self.rescale = rescale
+        self.indexes = np.arange(len(labels))
+        self.on_epoch_end()
+
+
+    def __len__(self):
+        return int(np.ceil(len(self.indexes) / self.batch_size))
+
+
+    def __getitem__(self, batch_index):
+        # Sorted indexes read the memory-mapped file sequentially
+        indexes = np.sort(
+            self.indexes[batch_index * self.batch_size:(batch_index + 1) * self.batch_size]
+        )
+        x = self.frames[indexes].astype('float32') * self.rescale
+        if self.transformation is not None:
+            for sample in x:
+                params = self.transformation.get_random_transform(sample.shape[1:])
+                for frame_index, frame in enumerate(sample):
+                    sample[frame_index] = self.transformation.apply_transform(frame, params)
+        y = keras.utils.to_categorical(self.labels[indexes], self.nbout)
+        return x, y
+
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            np.random.shuffle(self.indexes)
 
 
 def build_convnet(shape=(112, 112, 3)):
@@ -55,14 +120,23 @@ def build_convnet(shape=(112, 112, 3)):
     return model
 
 
-def build_mobilenet(shape=(224, 224, 3), nbout=3):
-    model = keras.applications.mobilenet.MobileNet(
+def get_pretrained_backbone(name, shape=(224, 224, 3)):
+    if name == 'mobilenet':
+        return keras.applications.mobilenet.MobileNet(
+            include_top=False,
+            input_shape=shape,
+            weights='imagenet')
+    return tensorflow.keras.applications.EfficientNetB7(
         include_top=False,
-        input_shape=shape,
-        weights='imagenet')
+        weights='imagenet',
+        input_shape=shape)
+
+
+def build_mobilenet(shape=(224, 224, 3), nbout=3):
+    model = get_pretrained_backbone('mobilenet', shape)
 
     # Keep 9 layers to train
-    trainable = 9
+    trainable = c.BACKBONE_TRAINABLE_LAYERS
     for layer in model.layers[:-trainable]:
         layer.trainable = False
     for layer in model.layers[-trainable:]:
@@ -72,13 +146,10 @@ def build_mobilenet(shape=(224, 224, 3), nbout=3):
 
 
 def build_efficentnet(shape=(224, 224, 3), nbout=3):
-    model = tensorflow.keras.applications.EfficientNetB7(
-        include_top=False,
-        weights='imagenet',
-        input_shape=shape)
+    model = get_pretrained_backbone('efficientnet', shape)
 
     # Keep 9 layers to train
-    trainable = 9
+    trainable = c.BACKBONE_TRAINABLE_LAYERS
     for layer in model.layers[:-trainable]:
         layer.trainable = False
     for layer in model.layers[-trainable:]:
@@ -87,12 +158,11 @@ def build_efficentnet(shape=(224, 224, 3), nbout=3):
     return keras.Sequential([model, output])
 
 
-def action_model(shape=(5, 112, 112, 3), nbout=3, hidden_layers=64):
+def action_model(shape=(5, 112, 112, 3), nbout=3, hidden_layers=64, convnet=None):
     momentum = .9
     # Create our convnet with (112, 112, 3) input shape
-    convnet = build_convnet(shape[1:])
-    #convnet = build_mobilenet(shape[1:])
-    #convnet = build_efficentnet(shape[1:])
+    if convnet is None:
+        convnet = build_convnet(shape[1:])
 
     # Classifictation LSTM blocs
     model = keras.Sequential()
@@ -108,6 +178,71 @@ def action_model(shape=(5, 112, 112, 3), nbout=3, hidden_layers=64):
     return model
 
 
+def r2plus1d_model(shape=(5, 112, 112, 3), nbout=3, filters=(32, 64, 128, 256)):
+    # (2+1)D convolutions: spatial 1x3x3 and temporal 3x1x1 instead of 3D
+    momentum = .9
+    model = keras.Sequential()
+    model.add(keras.Input(shape=shape))
+    for block_filters in filters:
+        model.add(Conv3D(block_filters, (1, 3, 3), padding='same', use_bias=False))
+        model.add(BatchNormalization(momentum=momentum))
+        model.add(ReLU())
+        model.add(Conv3D(block_filters, (3, 1, 1), padding='same', use_bias=False))
+        model.add(BatchNormalization(momentum=momentum))
+        model.add(ReLU())
+        model.add(MaxPool3D(pool_size=(1, 2, 2)))
+    model.add(GlobalAveragePooling3D())
+    model.add(Dropout(.5))
+    model.add(Dense(nbout, activation='softmax'))
+    return model
+
+
+def build_separable_convnet(shape=(112, 112, 3), filters=(64, 128, 256)):
+    # Depthwise-separable encoder of one frame
+    momentum = .9
+    model = keras.Sequential()
+    model.add(Conv2D(32, (3,3), strides=2, input_shape=shape, padding='same', use_bias=False))
+    model.add(BatchNormalization(momentum=momentum))
+    model.add(ReLU())
+    for block_filters in filters:
+        model.add(SeparableConv2D(block_filters, (3,3), strides=2, padding='same', use_bias=False))
+        model.add(BatchNormalization(momentum=momentum))
+        model.add(ReLU())
+    model.add(GlobalAveragePooling2D())
+    return model
+
+
+def separable_gru_model(shape=(5, 112, 112, 3), nbout=3, units=64):
+    model = keras.Sequential()
+    model.add(TimeDistributed(build_separable_convnet(shape[1:]), input_shape=shape))
+    model.add(GRU(units))
+    model.add(Dropout(.5))
+    model.add(Dense(nbout, activation='softmax'))
+    return model
+
+
+def frame_stack_model(shape=(5, 112, 112, 3), nbout=3):
+    # Early fusion: frames are stacked to channels of one image
+    frames, height, width, channels = shape
+    model = keras.Sequential()
+    model.add(Permute((2, 3, 1, 4), input_shape=shape))
+    model.add(Reshape((height, width, frames * channels)))
+    model.add(build_separable_convnet((height, width, frames * channels)))
+    model.add(Dropout(.5))
+    model.add(Dense(nbout, activation='softmax'))
+    return model
+
+
+def build_model(name, shape=(5, 112, 112, 3), nbout=3, hidden_layers=64, convnet=None):
+    if name == 'r2plus1d':
+        return r2plus1d_model(shape, nbout)
+    if name == 'separable_gru':
+        return separable_gru_model(shape, nbout)
+    if name == 'frame_stack':
+        return frame_stack_model(shape, nbout)
+    return action_model(shape, nbout, hidden_layers=hidden_layers, convnet=convnet)
+
+
 def main():
     parser = argparse.ArgumentParser(description="TF LSTM Model for vehicle image classification." \
                                                  " Must contain 'train' and 'test' dirs.")
@@ -127,6 +262,30 @@ def main():
                         help='Patience for early start (default: 150)')
     parser.add_argument('--dry-run', action='store_true', default=False,
                         help='quickly check a single pass')
+    parser.add_argument('--tensor-cache', type=str, default=None, metavar='DIR',
+                        help='decode videos once to memory-mapped arrays in DIR and' \
+                             ' train from them (rebuilt if dataset is changed)')
+    parser.add_argument('--rebuild-cache', action='store_true', default=False,
+                        help='rebuild tensor cache even if it is valid')
+    parser.add_argument('--cache-only', action='store_true', default=False,
+                        help='build tensor cache and exit')
+    parser.add_argument('--tf-data', action='store_true', default=False,
+                        help='use tf.data pipeline with parallel decoding, cache and prefetch')
+    parser.add_argument('--tf-data-cache', type=str, default='', metavar='FILE',
+                        help='file of tf.data cache of decoded videos (default: in memory)')
+    parser.add_argument('--backbone', type=str, default='convnet',
+                        choices=['convnet', 'mobilenet', 'efficientnet'],
+                        help='per-frame convnet, pretrained ones use 224x224 frames (default: convnet)')
+    parser.add_argument('--feature-cache', type=str, default=None, metavar='DIR',
+                        help='run frozen layers of pretrained backbone once over tensor cache,' \
+                             ' store activations in DIR and train the last layers from them')
+    parser.add_argument('--model', type=str, default='lstm',
+                        choices=['lstm', 'r2plus1d', 'separable_gru', 'frame_stack'],
+                        help='lstm - TimeDistributed convnet + LSTM, r2plus1d - (2+1)D convolutions,' \
+                             ' separable_gru - depthwise-separable encoder + GRU,' \
+                             ' frame_stack - CNN on stacked frames (default: lstm)')
+    parser.add_argument('--profile-models', action='store_true', default=False,
+                        help='print params, FLOPs and CPU latency of all models and exit')
     args = parser.parse_args()
 
     # Fix path string to avoid bugs with VideoFrameGenerator
@@ -138,7 +297,7 @@ def main():
     classes.sort()
 
     # some global params
-    SIZE = (112, 112) # Basic CNN (224, 224)  # MobilNet
+    SIZE = (112, 112) if args.backbone == 'convnet' else (224, 224) # Basic CNN or MobilNet
     CHANNELS = 3
     NBFRAME = 5
     BS = args.batch_size
@@ -169,38 +328,104 @@ def main():
         width_shift_range=.1,
         height_shift_range=.1)
 
-    # Create video frame generator
-    train = VideoFrameGenerator(
-        classes=classes,
-        glob_pattern=train_glob_pattern,
-        nb_frames=NBFRAME,
-        #split=.0,
-        shuffle=True,
-        batch_size=BS,
-        target_shape=SIZE,
-        nb_channel=CHANNELS,
-        transformation=data_aug,
-        use_frame_cache=True)
-
-    valid = VideoFrameGenerator(
-        classes=classes,
-        glob_pattern=test_glob_pattern,
-        nb_frames=NBFRAME,
-        #split=.0,
-        shuffle=False,
-        batch_size=TEST_BS,
-        target_shape=SIZE,
-        nb_channel=CHANNELS,
-        #transformation=data_aug,
-        use_frame_cache=True)
+    assert not (args.tf_data and args.tensor_cache is not None), \
+        "Use one of --tf-data and --tensor-cache"
+    assert args.feature_cache is None or \
+        (args.tensor_cache is not None and args.backbone != 'convnet'), \
+        "--feature-cache needs --tensor-cache and pretrained --backbone"
+    assert args.model == 'lstm' or (args.backbone == 'convnet' and args.feature_cache is None), \
+        "--backbone and --feature-cache are used by lstm model only"
+    assert not (args.profile_models and args.feature_cache is not None), \
+        "--profile-models measures models on frames, use it without --feature-cache"
+    INSHAPE=(NBFRAME,) + SIZE + (CHANNELS,) # (5, 112, 112, 3)
+    convnet = None
+    if args.tf_data:
+        # Same files and class order as glob patterns of VideoFrameGenerator
+        train_dataset, train_number = data_pipeline.get_video_dataset(
+            args.input, 'train', classes, NBFRAME, SIZE)
+        test_dataset, test_number = data_pipeline.get_video_dataset(
+            args.input, 'test', classes, NBFRAME, SIZE)
+        test_cache = f'{args.tf_data_cache}_test' if args.tf_data_cache else ''
+        train = data_pipeline.get_training_pipeline(
+            train_dataset, train_number, len(classes), BS,
+            shuffle=True, augment=True, cache_path=args.tf_data_cache)
+        valid = data_pipeline.get_training_pipeline(
+            test_dataset, test_number, len(classes), TEST_BS,
+            shuffle=False, augment=False, cache_path=test_cache)
+    elif args.tensor_cache is not None:
+        # Videos are decoded once, batches are read from memory-mapped arrays
+        tensor_cache.build_tensor_cache(args.input, args.tensor_cache, classes,
+                                        NBFRAME, SIZE, rebuild=args.rebuild_cache)
+        if args.cache_only:
+            return
+        train_frames, train_labels = tensor_cache.load_tensor_cache(args.tensor_cache, 'train')
+        test_frames, test_labels = tensor_cache.load_tensor_cache(args.tensor_cache, 'test')
+        train = TensorCacheGenerator(train_frames, train_labels, len(classes),
+                                     batch_size=BS, shuffle=True,
+                                     transformation=data_aug)
+        valid = TensorCacheGenerator(test_frames, test_labels, len(classes),
+                                     batch_size=TEST_BS, shuffle=False)
+        if args.feature_cache is not None:
+            # Frozen layers run once, only the tail and LSTM head are
+            # trained. Cached activations are not augmented
+            frozen, tail = feature_cache.split_backbone(
+                get_pretrained_backbone(args.backbone, SIZE + (CHANNELS,)),
+                c.BACKBONE_TRAINABLE_LAYERS)
+            feature_cache.build_feature_cache(frozen, args.backbone, args.tensor_cache,
+                                              args.feature_cache, rebuild=args.rebuild_cache)
+            train_features, train_labels = feature_cache.load_feature_cache(
+                args.feature_cache, args.tensor_cache, 'train')
+            test_features, test_labels = feature_cache.load_feature_cache(
+                args.feature_cache, args.tensor_cache, 'test')
+            train = TensorCacheGenerator(train_features, train_labels, len(classes),
+                                         batch_size=BS, shuffle=True, rescale=1.)
+            valid = TensorCacheGenerator(test_features, test_labels, len(classes),
+                                         batch_size=TEST_BS, shuffle=False, rescale=1.)
+            convnet = keras.Sequential([tail, GlobalMaxPool2D()])
+            INSHAPE = train_features.shape[1:]
+    else:
+        # Create video frame generator
+        train = VideoFrameGenerator(
+            classes=classes,
+            glob_pattern=train_glob_pattern,
+            nb_frames=NBFRAME,
+            #split=.0,
+            shuffle=True,
+            batch_size=BS,
+            target_shape=SIZE,
+            nb_channel=CHANNELS,
+            transformation=data_aug,
+            use_frame_cache=True)
+
+        valid = VideoFrameGenerator(
+            classes=classes,
+            glob_pattern=test_glob_pattern,
+            nb_frames=NBFRAME,
+            #split=.0,
+            shuffle=False,
+            batch_size=TEST_BS,
+            target_shape=SIZE,
+            nb_channel=CHANNELS,
+            #transformation=data_aug,
+            use_frame_cache=True)
 
     # TODO: Refactor for sample demonstration. Add flags?
     #keras_video.utils.show_sample(train)
     #keras_video.utils.show_sample(valid)
     #input()
 
-    INSHAPE=(NBFRAME,) + SIZE + (CHANNELS,) # (5, 112, 112, 3)
-    model = action_model(INSHAPE, len(classes), hidden_layers=HL)
+    if convnet is None and args.backbone == 'mobilenet':
+        convnet = build_mobilenet(SIZE + (CHANNELS,))
+    elif convnet is None and args.backbone == 'efficientnet':
+        convnet = build_efficentnet(SIZE + (CHANNELS,))
+    if args.profile_models:
+        for name in ('lstm', 'r2plus1d', 'separable_gru', 'frame_stack'):
+            model_profile.print_model_report(model_profile.get_model_report(
+                build_model(name, INSHAPE, len(classes), HL,
+                            convnet=convnet if name == 'lstm' else None),
+                INSHAPE, name))
+        return
+    model = build_model(args.model, INSHAPE, len(classes), hidden_layers=HL, convnet=convnet)
 
     optimizer = tensorflow.keras.optimizers.Adam(LR)
 
@@ -232,6 +457,14 @@ def main():
                       f"_patience{PATIENCE}.png")
     plt.close()
 
+    # Cost of the model next to its accuracy
+    report = model_profile.get_model_report(model, INSHAPE, args.model)
+    report['accuracy'] = max(history.history['val_binary_accuracy'])
+    model_profile.print_model_report(report)
+    with open(f".//learning_histories//{timestr}_{args.model}_report.json", 'w',
+              encoding='utf-8') as file:
+        json.dump(report, file, indent=4)
+
 
 if __name__ == '__main__':
     main()
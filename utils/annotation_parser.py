@@ -11,6 +11,8 @@ import xmltodict
 
 from zipfile import ZipFile
 
+from utils import profiler
+
 
 
 def get_annotation(annotation_path):
@@ -25,9 +27,12 @@ def get_annotation(annotation_path):
     assert os.path.isfile(annotation_path), \
         f"No {annotation_path} in directory"
 
-    with ZipFile(annotation_path) as zipfile:
-        with zipfile.open('annotations.xml') as xml_file:
-            video_annotation = xmltodict.parse(xml_file.read())
+    with profiler.stage('zip_read'):
+        with ZipFile(annotation_path) as zipfile:
+            with zipfile.open('annotations.xml') as xml_file:
+                xml_data = xml_file.read()
+    with profiler.stage('xml_parse'):
+        video_annotation = xmltodict.parse(xml_data)
 
     video_metadata = video_annotation['annotations']['meta']
     tracks_data = video_annotation['annotations']['track']
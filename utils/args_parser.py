@@ -1,8 +1,92 @@
 """Custom module for parsing of the script arguments
 """
+import argparse
+
 from utils import constants as c
 
 
+def parse_class_value(record):
+    """Parses 'CLASS=VALUE' record of the argument.
+
+    Args:
+        record (str): Argument record. ex.: 'idle_static=500'
+
+    Returns:
+        tuple: (class name, float value)
+    """
+    class_name, _, value = record.partition('=')
+    try:
+        value = float(value)
+    except ValueError:
+        value = None
+    if not class_name or value is None:
+        raise argparse.ArgumentTypeError(f"Expected CLASS=VALUE, got '{record}'")
+    return class_name, value
+
+
+def parse_memory_size(record):
+    """Parses memory size with optional binary suffix.
+
+    Args:
+        record (str): ex.: '8G', '512M', '1048576'
+
+    Returns:
+        int: Bytes
+    """
+    suffixes = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30, 'T': 2 ** 40}
+    size = record.strip().upper().rstrip('B')
+    multiplier = 1
+    if size and size[-1] in suffixes:
+        multiplier = suffixes[size[-1]]
+        size = size[:-1]
+    if not size.replace('.', '', 1).isdigit():
+        raise argparse.ArgumentTypeError(f"Expected size like 8G or 512M, got '{record}'")
+    return int(float(size) * multiplier)
+
+
+def parse_sweep_value(record):
+    """Parses 'SETTING=V1,V2,...' record of the argument.
+
+    Args:
+        record (str): Argument record. ex.: 'chunk_size=3,5,7'
+
+    Returns:
+        tuple: (setting name, list of int values)
+    """
+    setting, _, values = record.partition('=')
+    if setting not in c.SWEEP_SETTINGS:
+        raise argparse.ArgumentTypeError(
+            f"Unknown sweep setting '{setting}'. Supported: {c.SWEEP_SETTINGS}"
+        )
+    try:
+        values = [int(value) for value in values.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected SETTING=V1,V2, got '{record}'")
+    for value in values:
+        if setting == 'chunk_size' and (value <= 1 or value % 2 == 0):
+            raise argparse.ArgumentTypeError(
+                f"Chunk size must be odd and greater than 1, got {value}"
+            )
+        if setting == 'frame_step' and value <= 0:
+            raise argparse.ArgumentTypeError(f"Frame step must be positive, got {value}")
+    return setting, values
+
+
+def parse_resolution(record):
+    """Parses 'WIDTHxHEIGHT' record of the argument.
+
+    Args:
+        record (str): Argument record. ex.: '224x224'
+
+    Returns:
+        tuple: (width, height) in pixels
+    """
+    width, _, height = record.lower().partition('x')
+    if not (width.isdigit() and height.isdigit() and int(width) > 0 and int(height) > 0):
+        raise argparse.ArgumentTypeError(f"Expected WIDTHxHEIGHT, got '{record}'")
+    return int(width), int(height)
+
+
 def add_custom_arguments(parser):
     """Adding new optional arguments for parser to
 
@@ -31,14 +115,170 @@ def add_custom_arguments(parser):
         '--mode',
         type=str,
         default=c.GENERATOR_MODE,
-        choices=['sequence', 'singleshot', 'difference'],
+        choices=['sequence', 'singleshot', 'difference', 'multi'],
         help='Dataset generator mode. Sequence for MJPG and singleshot for JPG' \
-             ' , difference generates singleshot with images substraction'
+             ' , difference generates singleshot with images substraction' \
+             ' , multi generates several modes with single decoding'
+    )
+    parser.add_argument(
+        '--multi-modes',
+        type=str,
+        nargs='+',
+        default=list(c.MULTI_MODES),
+        choices=['sequence', 'singleshot', 'difference'],
+        help='Modes of multi generator mode. Every mode is written to' \
+             ' its own subdirectory'
+    )
+    parser.add_argument(
+        '--sweep',
+        type=parse_sweep_value,
+        action='append',
+        default=[],
+        metavar='SETTING=V1,V2',
+        help='Parameter sweep. Generates dataset for every combination of' \
+             ' settings to "{output}/{config}" with single decoding and' \
+             ' comparative stats table. Can be repeated'
+    )
+    parser.add_argument(
+        '--resolutions',
+        type=parse_resolution,
+        nargs='+',
+        default=list(c.EXTRACTOR_RESOLUTIONS),
+        metavar='WxH',
+        help='Output resolutions. Smaller levels are downscaled from the' \
+             ' largest crop, several levels are written to "{output}/{W}x{H}"'
     )
     parser.add_argument(
         '--overwrite',
         action="store_true",
-        help='Overwrite current dataset directory if exists'
+        help='Overwrite current dataset directory if exists. New dataset is' \
+             ' generated in staging directory and swapped when done'
+    )
+    parser.add_argument(
+        '--cleanup',
+        action="store_true",
+        help='Remove trash and staging directories left near output directory' \
+             ' and exit'
+    )
+    parser.add_argument(
+        '--plan',
+        action="store_true",
+        help='Dry run. Parse annotations, analyze tracks and report chunks,' \
+             ' frame reads, seeks, decoded frames, output size and time estimate'
+    )
+    parser.add_argument(
+        '--balance',
+        action="store_true",
+        default=c.CLASS_BALANCED,
+        help='Balance classes across all videos before writing. Surplus' \
+             ' chunks are never decoded'
+    )
+    parser.add_argument(
+        '--class-cap',
+        type=parse_class_value,
+        action='append',
+        default=[],
+        metavar='CLASS=N',
+        help='Maximum chunks of class for balancing. Can be repeated'
+    )
+    parser.add_argument(
+        '--class-ratio',
+        type=parse_class_value,
+        action='append',
+        default=[],
+        metavar='CLASS=R',
+        help='Relative weight of class for balancing. Can be repeated'
+    )
+    parser.add_argument(
+        '--balance-strata',
+        type=str,
+        default=c.CLASS_BALANCE_STRATA,
+        choices=['video_track', 'video', 'none'],
+        help='Sample chunks of class from every video and track, every video' \
+             ' or without strata, proportionally to chunks of the stratum'
+    )
+    parser.add_argument(
+        '--resume',
+        action="store_true",
+        help='Keep current dataset directory and process only new, changed' \
+             ' or interrupted videos from the build manifest'
+    )
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        default=c.GENERATOR_WORKERS,
+        help='Number of worker processes. Videos are dispatched longest first' \
+             ' and big ones are split into sub-tasks'
+    )
+    parser.add_argument(
+        '--shard-index',
+        type=int,
+        default=0,
+        help='Index of the shard processed by this node (default: 0)'
+    )
+    parser.add_argument(
+        '--num-shards',
+        type=int,
+        default=1,
+        help='Number of nodes sharing the input set. Videos are partitioned' \
+             ' by estimated work and every shard writes to its own directory' \
+             ' (default: 1)'
+    )
+    parser.add_argument(
+        '--merge-shards',
+        action="store_true",
+        help='Combine manifests and statistics of all shards in output' \
+             ' directory to one dataset index and exit'
+    )
+    parser.add_argument(
+        '--profile',
+        type=str,
+        default=None,
+        choices=['cprofile', 'pyinstrument'],
+        help='Capture profile of the main process to the dataset directory.' \
+             ' pyinstrument must be installed separately'
+    )
+    parser.add_argument(
+        '--metrics',
+        type=str,
+        nargs='+',
+        default=list(c.METRICS_FORMATS),
+        choices=['prometheus', 'jsonl'],
+        help='Periodically flush live throughput metrics to Prometheus' \
+             ' textfile and / or JSONL stream'
+    )
+    parser.add_argument(
+        '--metrics-dir',
+        type=str,
+        default=None,
+        help='Directory of metrics files, e.g. textfile directory of node' \
+             ' exporter (default: dataset directory)'
+    )
+    parser.add_argument(
+        '--metrics-interval',
+        type=float,
+        default=c.METRICS_INTERVAL,
+        help='Seconds between flushes of live metrics'
+    )
+    parser.add_argument(
+        '--max-memory',
+        type=parse_memory_size,
+        default=c.MAX_MEMORY,
+        metavar='SIZE',
+        help='Memory budget of all processes, ex.: 8G or 512M. Workers' \
+             ' take new tasks only while their estimated memory fits it'
+    )
+    parser.add_argument(
+        '--trace-memory',
+        action="store_true",
+        help='Trace python allocations of the main process and workers' \
+             ' for peaks of stages in the profile report (slower)'
+    )
+    parser.add_argument(
+        '--progress',
+        action="store_true",
+        help='Print progress and ETA of every video and of the whole run'
     )
     parser.add_argument(
         '--debug',
@@ -52,3 +292,20 @@ def add_custom_arguments(parser):
     )
 
     return parser
+
+
+def check_arguments(parser, args):
+    """Checks values which depend on several arguments. Wrong values are
+    reported as usage errors.
+
+    Args:
+        parser (obj): ArgumentParser with custom arguments
+        args (obj): Parsed arguments
+    """
+    if args.num_shards < 1:
+        parser.error(f"argument --num-shards: must be positive, got {args.num_shards}")
+    if not 0 <= args.shard_index < args.num_shards:
+        parser.error(
+            f"argument --shard-index: must be in [0, {args.num_shards - 1}]"
+            f" for {args.num_shards} shards, got {args.shard_index}"
+        )
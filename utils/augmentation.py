@@ -0,0 +1,183 @@
+"""
+Module for generation-time augmentations of chunks. Augmented chunks
+are derived by writer from crops of the original chunk, which are
+already in memory, so augmentation does not need extra decoding or
+seeking of the source. Supported augmentations:
+- reverse: reversed frames of dynamic chunk. Activation becomes
+    deactivation and vice versa
+- hflip: horizontally flipped frames. Left and right classes are
+    swapped
+- stride: faster motion with frames taken with temporal stride around
+    the center frame of the sequence chunk. Frames out of the chunk are
+    planned from the track and read by writer with the chunk, chunk is
+    not augmented if strided frames run past the track
+"""
+
+import cv2
+
+from collections import OrderedDict
+
+from utils import constants as c
+
+
+
+def get_chunk_augmentations(chunk, augmentations, mode):
+    """Selects augmentations which can be applied to the chunk.
+
+    Args:
+        chunk (dict): Dict from extraction task script
+        augmentations (iterable): Augmentation names from script
+            settings
+        mode (str): 'sequence', 'singleshot' or 'difference'
+
+    Returns:
+        list: Names of applicable augmentations
+    """
+    chunk_augmentations = []
+    for augmentation in augmentations:
+        assert augmentation in c.SUPPORTED_AUGMENTATIONS, \
+            f"Unknown augmentation: {augmentation}"
+        if augmentation == 'reverse':
+            # Order of frames matters only for dynamic sequences
+            if mode == 'singleshot' or chunk['type'] != 'dynamic':
+                continue
+        elif augmentation == 'stride':
+            if mode != 'sequence' or 'stride_sequence' not in chunk:
+                continue
+        chunk_augmentations.append(augmentation)
+    return chunk_augmentations
+
+
+
+def get_augmented_class(chunk_class, augmentation):
+    """Generates class of the augmented chunk.
+
+    Args:
+        chunk_class (str): Class of the original chunk
+        augmentation (str): Augmentation name
+
+    Returns:
+        str: Class of the augmented chunk
+    """
+    swaps = {}
+    if augmentation == 'reverse':
+        swaps = {
+            c.ACTIVATION_NAME: c.DEACTIVATION_NAME,
+            c.DEACTIVATION_NAME: c.ACTIVATION_NAME,
+        }
+    elif augmentation == 'hflip':
+        swaps = c.AUGMENTATION_HFLIP_SWAPS
+    parts = chunk_class.split('_')
+    for swap_from, swap_to in swaps.items():
+        swap_from_parts = swap_from.split('_')
+        for index in range(len(parts) - len(swap_from_parts) + 1):
+            if parts[index:index + len(swap_from_parts)] == swap_from_parts:
+                parts[index:index + len(swap_from_parts)] = swap_to.split('_')
+                return '_'.join(parts)
+    return chunk_class
+
+
+
+def get_augmentation_suffix(augmentation, stride):
+    """Generates suffix of the augmented chunk file name.
+
+    Args:
+        augmentation (str): Augmentation name
+        stride (int): Temporal stride of 'stride' augmentation
+
+    Returns:
+        str: Suffix. ex.: 'rev', 'hflip', 'stride2'
+    """
+    suffixes = {
+        'reverse': 'rev',
+        'hflip': 'hflip',
+        'stride': f"stride{stride}",
+    }
+    return suffixes[augmentation]
+
+
+
+def get_stride_sequence(sequence_frames, track_frames, stride, frames_to_skip=()):
+    """Plans frames of the strided chunk around the center frame of the
+    sequence, with the same frame step multiplied by stride.
+
+    Example for 5 frames, frame step 1 and stride 2 around frame 10:
+    [6, 8, 10, 12, 14]
+
+    Args:
+        sequence_frames (dict): Where: key - frame, value - coordinates
+            of the sequence chunk
+        track_frames (dict): Where: key - frame, value - frame data of
+            the track with 'coordinates'
+        stride (int): Temporal stride
+        frames_to_skip (iterable, optional): Frames which can not be
+            used. Defaults to ().
+
+    Returns:
+        OrderedDict | None: Frames with coordinates. None if strided
+            frames run past the track
+    """
+    frames = list(sequence_frames.keys())
+    if len(frames) < 2:
+        return None
+    frame_step = frames[1] - frames[0]
+    center_index = (len(frames) - 1) // 2
+    stride_frames = [
+        frames[center_index] + (index - center_index) * frame_step * stride
+        for index in range(len(frames))
+    ]
+    frames_are_available = all(
+        frame in track_frames and frame not in frames_to_skip
+        for frame in stride_frames
+    )
+    if not frames_are_available:
+        return None
+    return OrderedDict(
+        (frame, track_frames[frame]['coordinates']) for frame in stride_frames
+    )
+
+
+
+def get_extra_frames(chunk, augmentations, mode):
+    """Returns frames which writer reads for augmentations of the chunk
+    in addition to the frames of the chunk.
+
+    Args:
+        chunk (dict): Dict from extraction task script
+        augmentations (iterable): Augmentation names from script
+            settings
+        mode (str): 'sequence', 'singleshot' or 'difference'
+
+    Returns:
+        list: Tuples (frame, coordinates)
+    """
+    if 'stride' not in get_chunk_augmentations(chunk, augmentations, mode):
+        return []
+    return [
+        (frame, coordinates)
+        for frame, coordinates in chunk['stride_sequence'].items()
+        if frame not in chunk['sequence']
+    ]
+
+
+
+def apply_augmentation(crops, augmentation, stride_crops=None):
+    """Derives crops of the augmented chunk from the original crops.
+
+    Args:
+        crops (list): Cropped and resized images of chunk frames
+        augmentation (str): Augmentation name
+        stride_crops (list, optional): Crops of frames of
+            'stride_sequence' for 'stride' augmentation. Defaults to
+            None.
+
+    Returns:
+        list: Augmented images
+    """
+    if augmentation == 'reverse':
+        augmented_crops = list(reversed(crops))
+    elif augmentation == 'hflip':
+        augmented_crops = [cv2.flip(crop, 1) for crop in crops]
+    elif augmentation == 'stride':
+        augmented_crops = list(stride_crops)
+    return augmented_crops
@@ -4,6 +4,8 @@ Project constants
 # LOGGER
 ENABLE_DEBUG_LOGGER = True
 LOGGER_FILENAME = 'debug.log'
+LOGGER_NAME = 'dataset_generator'
+LOGGER_FORMAT = '%(asctime)s | %(processName)s | %(levelname)s | %(message)s'
 # exclude long attributes from logs
 LOGGER_SKIP_ATTRIBUTES = (
     'annotation_file',
@@ -16,6 +18,7 @@ LOGGER_SKIP_ATTRIBUTES = (
 DATA_DIR_PATH = 'D:\\data_ml\\raw_data'
 DATASET_DIR_PATH = 'D:\\data_ml\\baseline_dataset'
 EXTRACTOR_RESOLUTION = (500, 500)           # pixels
+EXTRACTOR_RESOLUTIONS = (EXTRACTOR_RESOLUTION,) # Output pyramid. Several levels are written to '{output}/{W}x{H}'
 #VIDEO_CHUNK_SIZE = 2                       # seconds
 #SKIP_FRAME_NUM = 1
 #TARGET_FPS = 30
@@ -23,7 +26,123 @@ SUPPORTED_VIDEO_FORMATS = ('.ts')
 OUTPUT_EXTENTION = 'avi'
 OVERWRITE = True                            # Rewrite output dataset directory or backup it
 GENERATOR_MODE = 'sequence'                 # 'sequence' or 'singleshot'
+MULTI_MODES = ('sequence', 'singleshot', 'difference') # Modes of 'multi' generator mode
+STREAM_MAX_GRAB_GAP = 90                    # Longer gaps in shared stream are skipped with seek
 DIFF_THRESHOLD = 64                        # Threshold to clean images substraction noise
+TEMP_CHUNK_SUFFIX = 'tmp'                   # Chunks are written as '{name}.tmp.{ext}' and renamed when ready
+STAGING_DIR_SUFFIX = '_staging'             # Overwritten dataset is generated here and swapped when done
+TRASH_DIR_SUFFIX = '_trash_'                # Old datasets are renamed to this and removed in background
+
+# MANIFEST
+MANIFEST_FILENAME = 'dataset_manifest.sqlite'
+MANIFEST_HASH_BLOCK_SIZE = 1024 * 1024      # bytes
+MANIFEST_STATUS_STARTED = 'started'
+MANIFEST_STATUS_DONE = 'done'
+
+# SHARDING
+SHARD_DIR_PREFIX = 'shard_'                 # Shard output: '{output}/shard_{index}_of_{number}'
+DATASET_INDEX_FILENAME = 'dataset_index.json'
+
+# SCHEDULER
+GENERATOR_WORKERS = 1                       # Worker processes for chunk writing
+SCHEDULER_MAX_CHUNKS_PER_TASK = 200         # Bigger videos are split into sub-tasks
+SCHEDULER_BOX_COST = 0.01                   # Predicted cost of annotated box
+SCHEDULER_FRAME_READ_COST = 1.0             # Predicted cost of frame read by writer
+
+# SWEEP
+SWEEP_SETTINGS = (                          # Script settings which can be swept
+    'chunk_size',
+    'frame_step',
+    'border_frames_num',
+    'chunk_border_ratio',
+)
+SWEEP_STATS_FILENAME = 'sweep_stats.csv'    # Comparative table of sweep configurations
+
+# PROFILER
+ENABLE_STAGE_PROFILER = True                # Measure stages of generation and write JSON report
+PROFILER_PERCENTILES = (50, 95, 99)         # Percentiles of stage durations in report
+PROFILER_RESERVOIR_SIZE = 1024              # Sampled durations of stage for percentiles
+PROFILER_REPORT_FILENAME = 'generation_profile.json'
+PROFILER_CPROFILE_FILENAME = 'generation_cprofile.prof'
+PROFILER_PYINSTRUMENT_FILENAME = 'generation_pyinstrument.html'
+
+# METRICS
+METRICS_FORMATS = ()                        # Live metrics files: 'prometheus' and / or 'jsonl'
+METRICS_INTERVAL = 10                       # seconds between flushes of live metrics
+METRICS_PREFIX = 'dataset_generator'        # Prefix of Prometheus metric names
+METRICS_PROMETHEUS_FILENAME = 'generation_metrics.prom'
+METRICS_JSONL_FILENAME = 'generation_metrics.jsonl'
+
+# MEMORY
+MAX_MEMORY = None                           # Memory budget in bytes of all processes. None - unlimited
+MEMORY_WORKER_BASE_BYTES = 150 * 2 ** 20    # Estimated memory of idle worker process
+MEMORY_DECODE_BUFFER_FRAMES = 4             # Decoded frames of the source kept by worker
+MEMORY_ANNOTATION_BOX_BYTES = 4096          # Estimated memory of one parsed annotation box
+ENABLE_MEMORY_SAMPLING = True               # Sample RSS peaks of stages for profile report
+
+# BENCHMARK
+SYNTHETIC_VIDEO_PREFIX = 'SYN'               # Synthetic videos: 'SYN00000.ts'
+SYNTHETIC_VIDEO_CODEC = 'mpg2'               # Codec of synthetic .ts videos
+SYNTHETIC_VIDEOS = 2
+SYNTHETIC_FRAMES = 900
+SYNTHETIC_RESOLUTION = (1280, 720)           # pixels
+SYNTHETIC_FPS = 30
+SYNTHETIC_TRACKS = 4
+SYNTHETIC_SWITCH_RATE = 0.2                  # Expected switches of every signal per second
+SYNTHETIC_MIN_STATE_FRAMES = 30              # Signal state is kept at least for this number of frames
+SYNTHETIC_BLINK_FRAMES = 10                  # Half period of turn signals blinking
+SYNTHETIC_ATTRIBUTES = ('brake', 'turn_left', 'turn_right', 'alarm')
+BENCHMARK_MODES = ('sequence', 'singleshot', 'difference')
+BENCHMARK_WORKERS = (1, 2, 4)
+BENCHMARK_REPEATS = 1                        # Best run of repeats is stored
+BENCHMARK_RESULTS_DIR = 'benchmarks/results'
+BENCHMARK_REGRESSION_TOLERANCE = 0.1         # Allowed throughput drop from baseline
+ANALYZER_BENCHMARK_SIZES = (1000, 10000, 100000, 1000000)  # Boxes in track of analyzer benchmark
+ANALYZER_BENCHMARK_TIME_LIMIT = 60           # seconds. Larger tracks of the mode are skipped after slower run
+ANALYZER_PARITY_BOXES = 5000                 # Boxes in track of analyzer parity check
+ANALYZER_PARITY_SEED = 0
+ANALYZER_PARITY_FILE = 'benchmarks/analyzer_parity.json'  # Reference digests of analyzer outputs
+
+# TRAINING
+TENSOR_CACHE_META_FILENAME = 'tensor_cache.json'  # Description of pre-decoded tensor cache
+TENSOR_CACHE_COPY_BATCH = 256               # Samples copied at once on shrinking of cache arrays
+IMAGE_EXTENSIONS = ('.bmp', '.gif', '.jpeg', '.jpg', '.png')  # Images of image_dataset_from_directory
+PIPELINE_BENCHMARK_EPOCHS = 3              # Epochs of input pipeline benchmark, the first one fills cache
+FEATURE_CACHE_META_FILENAME = 'feature_cache.json'  # Description of frozen backbone feature cache
+FEATURE_CACHE_DTYPE = 'float16'             # Stored activations of frozen backbone layers
+FEATURE_CACHE_BATCH = 64                    # Frames of one prediction of frozen backbone
+BACKBONE_TRAINABLE_LAYERS = 9               # Last layers of pretrained backbones which are trained
+MODEL_PROFILE_RUNS = 50                     # Measured inference runs of model latency
+MODEL_PROFILE_WARMUP = 5                    # Inference runs before latency measurement
+MODEL_PROFILE_BATCH = 32                    # Batch of model throughput measurement
+
+# INFERENCE
+INFERENCE_BATCH_SIZE = 64                   # Windows of all tracks classified at once
+INFERENCE_PREDICTIONS_FILENAME = 'predictions.csv'
+INFERENCE_REPORT_FILENAME = 'inference_report.json'
+
+# EXPORT
+EXPORT_QUANTIZATIONS = ('float32', 'float16', 'int8')  # Post-training quantizations of TFLite export
+EXPORT_CALIBRATION_SAMPLES = 100            # Training samples for int8 calibration
+EXPORT_BENCHMARK_BATCH = 32                 # Batch of throughput measurement of exported models
+EXPORT_ONNX_OPSET = 13
+EXPORT_REPORT_FILENAME = 'export_report.json'
+
+# SERVING
+SERVING_HOST = '127.0.0.1'
+SERVING_PORT = 8500
+SERVING_MAX_BATCH_SIZE = 32                 # Requests in one micro-batch
+SERVING_MAX_LATENCY_MS = 10                 # Max wait of the first request of micro-batch
+SERVING_LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+SERVING_BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+SERVING_METRICS_PREFIX = 'inference_service'  # Prefix of Prometheus metric names of the service
+
+# PLANNER
+PLAN_JPEG_COMPRESSION_RATIO = 0.1           # Expected MJPG/JPG size to raw image size
+PLAN_CHUNK_OVERHEAD_BYTES = 4096            # Container overhead of every chunk
+PLAN_BENCHMARK_FRAMES = 60                  # Frames decoded sequentially in source benchmark
+PLAN_BENCHMARK_SEEKS = 5                    # Random seeks in source benchmark
+PLAN_BENCHMARK_ENCODES = 10                 # Encoded output images in source benchmark
 
 # VIDEO
 TARGET_ATTRIBUTES = {
@@ -46,7 +165,21 @@ CHUNK_BORDER_RATIO = 2                       # - Slice border multiplyer to make
                                              # bigger for dynamic markers
 CLASS_OVERLAY = True                         # - Same frames can be used for different classes
 CLASS_BALANCED = False                       # - Balance classes?
+CLASS_BALANCE_CAPS = {}                      # - Max chunks of class. ex.: {'idle_static': 500}
+CLASS_BALANCE_RATIOS = {}                    # - Class weights. ex.: {'idle_static': 2, 'brake_activation': 1}
+                                             # Empty - all classes balanced to the rarest one
+CLASS_BALANCE_STRATA = 'video_track'         # - Sample proportionally by: 'video_track', 'video' or 'none'
+CLASS_BALANCE_SEED = 0                       # - Seed of balancing sampler
 ADD_REVERSED = True                          # - EXPERIMENTAL.Try to reverse frames to augment data
+                                             # Legacy: frames of deactivation chunks are written reversed
+AUGMENTATIONS = ()                           # - EXPERIMENTAL. Chunks derived by writer from decoded crops:
+                                             # 'reverse', 'hflip' or 'stride'
+SUPPORTED_AUGMENTATIONS = ('reverse', 'hflip', 'stride')
+AUGMENTATION_STRIDE = 2                      # - Temporal stride of 'stride' augmentation
+AUGMENTATION_HFLIP_SWAPS = {                 # - Classes swapped by 'hflip' augmentation
+    'turn_left': 'turn_right',
+    'turn_right': 'turn_left',
+}
 
 
 
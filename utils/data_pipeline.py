@@ -0,0 +1,234 @@
+"""
+Module for tf.data input pipelines of training scripts. Videos are
+decoded in parallel map calls, decoded uint8 samples are cached in
+memory or in file, augmentation is applied to the whole batch by tensor
+operations and batches are prefetched while the model trains:
+
+    list files -> decode (parallel) -> cache -> shuffle -> batch
+        -> augment (vectorized) -> prefetch
+
+Also contains benchmark of steps per second of input pipelines.
+"""
+
+import os
+import time
+import numpy as np
+import tensorflow as tf
+
+from utils import constants as c
+from utils import tensor_cache
+
+
+
+def get_video_dataset(input_path, split, classes, nb_frames, size):
+    """Creates dataset of decoded uint8 samples of the split. Broken
+    videos are skipped.
+
+    Args:
+        input_path (str): Path to the dataset with 'train' and 'test'
+        split (str): 'train' or 'test'
+        classes (list): Sorted class names, order of labels
+        nb_frames (int): Number of frames of the sample
+        size (tuple): Width and height of frames
+
+    Returns:
+        tuple: tf.data.Dataset of (frames, label) and number of videos
+    """
+    videos = tensor_cache.get_split_videos(input_path, split, classes)
+    paths = [path for path, _ in videos]
+    labels = [class_index for _, class_index in videos]
+    frames_shape = (nb_frames, size[1], size[0], 3)
+
+    def decode(path):
+        frames = tensor_cache.read_video_frames(path.decode(), nb_frames, size)
+        if frames is None:
+            return np.zeros(frames_shape, dtype=np.uint8), np.bool_(False)
+        return frames, np.bool_(True)
+
+    def decode_video(path, label):
+        # OpenCV releases GIL while decoding, so parallel calls scale
+        frames, is_valid = tf.numpy_function(decode, [path], (tf.uint8, tf.bool))
+        frames.set_shape(frames_shape)
+        return frames, label, is_valid
+
+    dataset = tf.data.Dataset.from_tensor_slices((paths, labels))
+    dataset = dataset.map(decode_video, num_parallel_calls=tf.data.AUTOTUNE)
+    dataset = dataset.filter(lambda frames, label, is_valid: is_valid)
+    dataset = dataset.map(lambda frames, label, is_valid: (frames, label))
+    return dataset, len(videos)
+
+
+
+def get_image_dataset(directory, size):
+    """Creates dataset of decoded uint8 images with the same files, class
+    names and labels as image_dataset_from_directory. Pixel values are
+    equivalent up to uint8 rounding of resized images, images of the
+    target size are identical.
+
+    Args:
+        directory (str): Directory with subdirectory of every class
+        size (tuple): Height and width of images
+
+    Returns:
+        tuple: tf.data.Dataset of (image, label), number of images and
+            class names
+    """
+    class_names = sorted(
+        name for name in os.listdir(directory)
+        if os.path.isdir(os.path.join(directory, name))
+    )
+    paths = []
+    labels = []
+    for class_index, class_name in enumerate(class_names):
+        class_path = os.path.join(directory, class_name)
+        for root, _, files in sorted(os.walk(class_path)):
+            for file in sorted(files):
+                if file.lower().endswith(c.IMAGE_EXTENSIONS):
+                    paths.append(os.path.join(root, file))
+                    labels.append(class_index)
+
+    def decode_image(path, label):
+        image = tf.io.decode_image(tf.io.read_file(path), channels=3,
+                                   expand_animations=False)
+        image = tf.image.resize(image, size, method='bilinear')
+        # Cached as uint8, 4 times smaller than float images. Bilinear
+        # values of image_dataset_from_directory are rounded
+        image = tf.cast(tf.clip_by_value(tf.round(image), 0, 255), tf.uint8)
+        return image, label
+
+    dataset = tf.data.Dataset.from_tensor_slices((paths, labels))
+    dataset = dataset.map(decode_image, num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset, len(paths), class_names
+
+
+
+def get_translations(batch_size, height, width, shift_range):
+    """Creates random translations of projective transform.
+
+    Args:
+        batch_size (tensor): Number of transforms
+        height (tensor): Height of images
+        width (tensor): Width of images
+        shift_range (float): Max shift as part of the image size
+
+    Returns:
+        tensor: Transforms (batch_size, 8)
+    """
+    shifts = tf.random.uniform((batch_size, 2), -shift_range, shift_range)
+    dx = shifts[:, 0] * tf.cast(width, tf.float32)
+    dy = shifts[:, 1] * tf.cast(height, tf.float32)
+    ones = tf.ones_like(dx)
+    zeros = tf.zeros_like(dx)
+    return tf.stack([ones, zeros, dx, zeros, ones, dy, zeros, zeros], axis=1)
+
+
+
+def augment_batch(images, horizontal_flip=True, shift_range=.1):
+    """Applies the same random flip and shift to all frames of the
+    sample, as ImageDataGenerator in VideoFrameGenerator. Empty pixels
+    are filled with the nearest ones.
+
+    Args:
+        images (tensor): Float batch (B, H, W, C) or (B, T, H, W, C)
+        horizontal_flip (bool, optional): Defaults to True.
+        shift_range (float, optional): Max shift as part of the image
+            size. Defaults to .1.
+
+    Returns:
+        tensor: Augmented batch of the same shape
+    """
+    is_sequence = images.shape.rank == 5
+    if not is_sequence:
+        images = images[:, tf.newaxis]
+    shape = tf.shape(images)
+    batch_size, frames, height, width = shape[0], shape[1], shape[2], shape[3]
+    if horizontal_flip:
+        flips = tf.random.uniform((batch_size,)) < .5
+        images = tf.where(flips[:, tf.newaxis, tf.newaxis, tf.newaxis, tf.newaxis],
+                          tf.reverse(images, axis=[3]), images)
+    if shift_range:
+        transforms = get_translations(batch_size, height, width, shift_range)
+        transforms = tf.repeat(transforms, frames, axis=0)
+        flat_images = tf.reshape(images, tf.concat([[-1], shape[2:]], axis=0))
+        flat_images = tf.raw_ops.ImageProjectiveTransformV3(
+            images=flat_images,
+            transforms=transforms,
+            output_shape=shape[2:4],
+            fill_value=0.,
+            interpolation='BILINEAR',
+            fill_mode='NEAREST'
+        )
+        images = tf.reshape(flat_images, shape)
+    if not is_sequence:
+        images = images[:, 0]
+    return images
+
+
+
+def get_training_pipeline(dataset, samples_number, nbout, batch_size,
+                          shuffle=True, augment=False, cache_path='',
+                          rescale=1/255., one_hot=True):
+    """Adds cache, shuffle, batching, augmentation and prefetching to
+    the dataset of decoded uint8 samples.
+
+    Args:
+        dataset (obj): tf.data.Dataset of (images, label)
+        samples_number (int): Number of samples, size of shuffle buffer
+        nbout (int): Number of classes
+        batch_size (int): Batch size
+        shuffle (bool, optional): Shuffle every epoch. Defaults to True.
+        augment (bool, optional): Random flip and shift. Defaults to
+            False.
+        cache_path (str, optional): File of cache. Defaults to '' -
+            cache in memory. None - without cache.
+        rescale (float, optional): Defaults to 1/255.
+        one_hot (bool, optional): One-hot labels, otherwise class
+            indexes. Defaults to True.
+
+    Returns:
+        obj: tf.data.Dataset of (float images, labels)
+    """
+    if cache_path is not None:
+        # Decoded uint8 samples are cached, so decoding runs in the first
+        # epoch only
+        dataset = dataset.cache(cache_path)
+    if shuffle:
+        dataset = dataset.shuffle(max(samples_number, 1), reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size)
+
+    def prepare_batch(images, labels):
+        images = tf.cast(images, tf.float32) * rescale
+        if augment:
+            images = augment_batch(images)
+        if one_hot:
+            labels = tf.one_hot(labels, nbout)
+        return images, labels
+
+    dataset = dataset.map(prepare_batch, num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+
+def benchmark_pipeline(dataset, epochs=2, max_steps=None):
+    """Measures steps per second of the input pipeline without training.
+    The first epoch includes decoding and filling of cache.
+
+    Args:
+        dataset (obj): tf.data.Dataset of batches
+        epochs (int, optional): Defaults to 2.
+        max_steps (int, optional): Steps of every epoch. Defaults to
+            None - whole dataset.
+
+    Returns:
+        list: Steps per second of every epoch
+    """
+    steps_per_second = []
+    for _ in range(epochs):
+        epoch_dataset = dataset if max_steps is None else dataset.take(max_steps)
+        steps = 0
+        start_time = time.perf_counter()
+        for _ in epoch_dataset:
+            steps += 1
+        seconds = time.perf_counter() - start_time
+        steps_per_second.append(steps / max(seconds, 1e-9))
+    return steps_per_second
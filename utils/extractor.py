@@ -4,6 +4,7 @@ import os
 
 from utils import constants as c
 from utils import annotation_parser
+from utils import video_editor
 
 
 
@@ -19,6 +20,9 @@ class ExtractionTask:
             annotation (str): Annotation file
             overwrite (bool): Overwrite existing dataset or not
         """
+        self.filename = filename
+        # Key of the extraction in build manifest
+        self.build_key = filename
         self.source_path = os.path.join(import_path, filename)
         self.output_path = export_path
         self.annotation_path = os.path.join(import_path, annotation)
@@ -30,17 +34,31 @@ class ExtractionTask:
         self.base_class = c.BASE_CLASS
         self.class_overlay = c.CLASS_OVERLAY
         self.chunk_size = c.CHUNK_SIZE
+        self.frame_step = c.FRAME_STEP
+        self.border_frames_num = c.SKIP_FRAMES_NEAR_SWITCH_MARKER_SIZE
+        self.chunk_border_ratio = c.CHUNK_BORDER_RATIO
+        self.resolution = c.EXTRACTOR_RESOLUTION
+        self.resolutions = c.EXTRACTOR_RESOLUTIONS
         self.extend_with_reversed = c.ADD_REVERSED
+        self.augmentations = c.AUGMENTATIONS
+        self.augmentation_stride = c.AUGMENTATION_STRIDE
         self.target_attributes = c.TARGET_ATTRIBUTES
+        self.class_balance = video_editor.get_class_balance_settings()
         self.logger_skip_atributes = c.LOGGER_SKIP_ATTRIBUTES
 
-    def read_annotation(self):
+    def read_annotation(self, annotation_data=None):
         """Reads annotation from annotation files and add it as
         attributes to the current instance.
+
+        Args:
+            annotation_data (tuple, optional): Already parsed annotation
+                (metadata, tracks) of the same file. Defaults to None.
         """
+        if annotation_data is None:
+            annotation_data = \
+                annotation_parser.get_annotation(self.annotation_path)
         self.annotation_meta, \
-        self.annotation_tracks = \
-            annotation_parser.get_annotation(self.annotation_path)
+        self.annotation_tracks = annotation_data
         self.info = {
             **annotation_parser.get_metadata(self.annotation_meta),
             **annotation_parser.get_trackdata(self.annotation_tracks),
@@ -58,15 +76,15 @@ class ExtractionTask:
                 if attribute in long_attributes:
                     for info_attribute in value.keys():
                         if info_attribute == 'chunks':
-                            chunks_in_script = len(value[info_attribute])
-                            log_msg = \
-                                f"{attribute}: {info_attribute}: {chunks_in_script} chunks total"
+                            self.logger.debug("%s: %s: %d chunks total", attribute,
+                                              info_attribute, len(value[info_attribute]))
                         elif info_attribute == 'statistics':
                             stats = value[info_attribute].items()
                             for stat_name, stat_data in stats:
-                                log_msg = f"{attribute}: {stat_name}: {stat_data}"
+                                self.logger.debug("%s: %s: %s", attribute,
+                                                  stat_name, stat_data)
                         else:
-                            log_msg = f"{attribute}: {info_attribute}: {value[info_attribute]}"
-                        self.logger.debug(log_msg)
+                            self.logger.debug("%s: %s: %s", attribute,
+                                              info_attribute, value[info_attribute])
                 else:
-                    self.logger.debug(f"{attribute}: {value}")
+                    self.logger.debug("%s: %s", attribute, value)
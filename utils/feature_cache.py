@@ -0,0 +1,203 @@
+"""
+Module for cache of activations of the frozen part of pretrained
+backbones (MobileNet, EfficientNet). Backbone is split to:
+- frozen prefix, which is run once over frames of the tensor cache
+- trainable tail (the last layers), which is trained with the head
+
+Activations of the prefix are stored to memory-mapped float16 arrays
+'{cache}/{split}_features.npy' (N, NBFRAME, h, w, channels) with the
+same order of samples as the tensor cache, so labels are shared. Frozen
+layers are run in inference mode, as they are run by Keras when their
+'trainable' is False, but without random augmentation of frames.
+"""
+
+import os
+import json
+import numpy as np
+
+from utils import constants as c
+from utils import tensor_cache
+
+
+
+def find_cut_index(model, trainable):
+    """Finds the last frozen layer, which output is the only tensor of
+    the frozen prefix used by the tail. Residual connections move the
+    cut to earlier layers, so tail can be trained more than 'trainable'
+    layers.
+
+    Args:
+        model (obj): Functional keras model of the backbone
+        trainable (int): Number of the last trainable layers
+
+    Returns:
+        int: Index of the last frozen layer
+    """
+    layers = model.layers
+    producers = {id(layer.output): index for index, layer in enumerate(layers)}
+    for cut_index in range(len(layers) - trainable - 1, 0, -1):
+        cut_is_valid = True
+        for layer in layers[cut_index + 1:]:
+            inputs = layer.input if isinstance(layer.input, list) else [layer.input]
+            if any(producers[id(tensor)] < cut_index for tensor in inputs):
+                cut_is_valid = False
+                break
+        if cut_is_valid:
+            return cut_index
+    raise ValueError(f"Backbone '{model.name}' can not be split")
+
+
+
+def split_backbone(model, trainable):
+    """Splits backbone to frozen prefix and trainable tail. Tail shares
+    layers and weights with the backbone.
+
+    Args:
+        model (obj): Functional keras model of the backbone
+        trainable (int): Number of the last trainable layers
+
+    Returns:
+        tuple: Frozen prefix model and tail model
+    """
+    import keras
+
+    cut_index = find_cut_index(model, trainable)
+    cut_layer = model.layers[cut_index]
+    frozen = keras.Model(model.input, cut_layer.output, name=f'{model.name}_frozen')
+    tail_input = keras.Input(shape=cut_layer.output.shape[1:])
+    # Layers of the tail are called in graph order on the new input
+    tensors = {id(cut_layer.output): tail_input}
+    for layer in model.layers[cut_index + 1:]:
+        if isinstance(layer.input, list):
+            output = layer([tensors[id(tensor)] for tensor in layer.input])
+        else:
+            output = layer(tensors[id(layer.input)])
+        tensors[id(layer.output)] = output
+    tail = keras.Model(tail_input, tensors[id(model.output)], name=f'{model.name}_tail')
+    for layer in frozen.layers:
+        layer.trainable = False
+    for layer in tail.layers:
+        layer.trainable = True
+    return frozen, tail
+
+
+
+def get_features_path(cache_path, split):
+    """Returns path of features array of the split.
+
+    Args:
+        cache_path (str): Path to the feature cache directory
+        split (str): 'train' or 'test'
+
+    Returns:
+        str: Path to the array
+    """
+    return os.path.join(cache_path, f'{split}_features.npy')
+
+
+
+def write_features(frozen, frames, features_path, batch_size, rescale):
+    """Runs frozen prefix over all frames and writes activations batch
+    by batch.
+
+    Args:
+        frozen (obj): Frozen prefix model
+        frames (array): uint8 frames (N, NBFRAME, H, W, 3)
+        features_path (str): Path to the features array
+        batch_size (int): Frames of one prediction
+        rescale (float): Scale of frames, same as in training
+
+    Returns:
+        tuple: Shape of features of one frame
+    """
+    samples_number, nb_frames = frames.shape[:2]
+    feature_shape = tuple(frozen.output.shape[1:])
+    temp_path = f'{features_path}.tmp'
+    features = np.lib.format.open_memmap(
+        temp_path, mode='w+', dtype=c.FEATURE_CACHE_DTYPE,
+        shape=(samples_number, nb_frames) + feature_shape
+    )
+    samples_batch = max(batch_size // nb_frames, 1)
+    for start in range(0, samples_number, samples_batch):
+        end = min(start + samples_batch, samples_number)
+        batch = frames[start:end].astype('float32') * rescale
+        batch = batch.reshape((-1,) + batch.shape[2:])
+        activations = frozen.predict_on_batch(batch)
+        features[start:end] = activations.reshape((end - start, nb_frames) + feature_shape)
+    features.flush()
+    del features
+    os.replace(temp_path, features_path)
+    return feature_shape
+
+
+
+def build_feature_cache(frozen, backbone_name, tensor_cache_path, cache_path,
+                        splits=('train', 'test'), batch_size=c.FEATURE_CACHE_BATCH,
+                        rescale=1/255., rebuild=False):
+    """Builds cache of activations of the frozen prefix if it does not
+    exist or if backbone or tensor cache are changed.
+
+    Args:
+        frozen (obj): Frozen prefix model
+        backbone_name (str): Name of the backbone and its cut
+        tensor_cache_path (str): Path to the tensor cache directory
+        cache_path (str): Path to the feature cache directory
+        splits (tuple, optional): Defaults to ('train', 'test').
+        batch_size (int, optional): Frames of one prediction. Defaults to
+            FEATURE_CACHE_BATCH from constants.
+        rescale (float, optional): Scale of frames. Defaults to 1/255.
+        rebuild (bool, optional): Rebuild valid cache too. Defaults to
+            False.
+
+    Returns:
+        dict: Description of the cache
+    """
+    os.makedirs(cache_path, exist_ok=True)
+    meta_path = os.path.join(cache_path, c.FEATURE_CACHE_META_FILENAME)
+    meta = None
+    if os.path.isfile(meta_path) and not rebuild:
+        with open(meta_path, encoding='utf-8') as file:
+            meta = json.load(file)
+    frames_meta = tensor_cache.read_meta(tensor_cache_path)
+    assert frames_meta is not None, f"Tensor cache is not built: {tensor_cache_path}"
+    settings = {
+        'backbone': backbone_name,
+        'layer': frozen.layers[-1].name,
+        'rescale': rescale,
+        'frames': frames_meta['settings'],
+    }
+    if meta is None or meta['settings'] != settings:
+        meta = {'settings': settings, 'splits': {}}
+    for split in splits:
+        sources = frames_meta['splits'][split]['sources']
+        features_path = get_features_path(cache_path, split)
+        split_meta = meta['splits'].get(split)
+        if split_meta is not None and split_meta['sources'] == sources \
+                and os.path.isfile(features_path):
+            continue
+        frames, _ = tensor_cache.load_tensor_cache(tensor_cache_path, split)
+        feature_shape = write_features(frozen, frames, features_path, batch_size, rescale)
+        meta['splits'][split] = {'feature_shape': list(feature_shape), 'sources': sources}
+        print(f"Feature cache: {split}: {len(frames)} samples, features {feature_shape}")
+        with open(f'{meta_path}.tmp', 'w', encoding='utf-8') as file:
+            json.dump(meta, file)
+        os.replace(f'{meta_path}.tmp', meta_path)
+    return meta
+
+
+
+def load_feature_cache(cache_path, tensor_cache_path, split):
+    """Opens features of the split with labels of the tensor cache.
+
+    Args:
+        cache_path (str): Path to the feature cache directory
+        tensor_cache_path (str): Path to the tensor cache directory
+        split (str): 'train' or 'test'
+
+    Returns:
+        tuple: Features (N, NBFRAME, h, w, channels) and labels (N,)
+    """
+    features_path = get_features_path(cache_path, split)
+    assert os.path.isfile(features_path), f"Feature cache of '{split}' is not built: {cache_path}"
+    _, labels = tensor_cache.load_tensor_cache(tensor_cache_path, split)
+    return np.load(features_path, mmap_mode='r'), labels
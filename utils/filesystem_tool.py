@@ -6,21 +6,28 @@ Module for specific tasks with OS and filesystem, such as:
 """
 
 import os
+import sys
 import shutil
+import secrets
+import subprocess
 
 from utils import constants as c
 from utils import video_validator
 
 
 
-def create_dir(path, overwrite=False):
+def create_dir(path, overwrite=False, resume=False):
     """Creates new directory. If 'overwrite' is true - remove existing
-    directory and creates a new one. Otherwise - backups old directory.
+    directory and creates a new one. If 'resume' is true - existing
+    directory is kept as is to continue the build. Otherwise - backups
+    old directory.
 
     Args:
         path (str): Path to the new directory
         overwrite (bool, optional): Remove old directory, if exists
             already. Defaults to False.
+        resume (bool, optional): Keep old directory, if exists already.
+            Defaults to False.
 
     Returns:
         next_path
@@ -29,8 +36,11 @@ def create_dir(path, overwrite=False):
         os.mkdir(path)
 
     except FileExistsError:
-        if overwrite:
-            shutil.rmtree(path)
+        if resume:
+            pass
+
+        elif overwrite:
+            remove_dir_in_background(move_dir_to_trash(path))
             os.mkdir(path)
 
         else:
@@ -50,6 +60,156 @@ def create_dir(path, overwrite=False):
 
 
 
+def get_trash_path(path):
+    """Generates unique path for the directory which should be removed.
+    Trash directory is a sibling of the original one, so renaming is
+    atomic and does not copy any data.
+
+    Args:
+        path (str): Path to the directory
+
+    Returns:
+        str: Path to the trash directory
+    """
+    trash_path = \
+        f"{os.path.normpath(path)}{c.TRASH_DIR_SUFFIX}{secrets.token_hex(4)}"
+    return trash_path
+
+
+
+def move_dir_to_trash(path):
+    """Renames directory to the trash path. Directory can be removed
+    later without blocking the critical path.
+
+    Args:
+        path (str): Path to the directory
+
+    Returns:
+        str: Path to the trash directory
+    """
+    trash_path = get_trash_path(path)
+    os.rename(path, trash_path)
+    return trash_path
+
+
+
+def remove_dir_in_background(path):
+    """Removes directory in the detached process. Generator does not
+    wait for removing, so dataset with lots of small files does not
+    slow down start or finish of the job. If process is killed -
+    directory can be removed with 'cleanup_trash_dirs'.
+
+    Args:
+        path (str): Path to the directory
+
+    Returns:
+        subprocess.Popen: Process which removes directory
+    """
+    process_flags = {}
+    if os.name == 'nt':
+        process_flags['creationflags'] = subprocess.DETACHED_PROCESS
+    else:
+        process_flags['start_new_session'] = True
+    process = subprocess.Popen(
+        [
+            sys.executable, '-c',
+            'import shutil, sys; shutil.rmtree(sys.argv[1], ignore_errors=True)',
+            path,
+        ],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        **process_flags
+    )
+    return process
+
+
+
+def cleanup_trash_dirs(path):
+    """Removes all trash and staging directories left near the dataset
+    directory. Cleanup is synchronous and can be used as a separate
+    command.
+
+    Args:
+        path (str): Path to the dataset directory
+
+    Returns:
+        list: Removed directories
+    """
+    path = os.path.normpath(path)
+    parent_path = os.path.dirname(path) or os.curdir
+    dir_name = os.path.basename(path)
+    removed_dirs = []
+    for directory in os.scandir(parent_path):
+        is_trash = directory.name.startswith(f"{dir_name}{c.TRASH_DIR_SUFFIX}")
+        is_staging = (directory.name == f"{dir_name}{c.STAGING_DIR_SUFFIX}")
+        if directory.is_dir() and (is_trash or is_staging):
+            shutil.rmtree(directory.path, ignore_errors=True)
+            removed_dirs.append(directory.path)
+    return removed_dirs
+
+
+
+def get_staging_path(path):
+    """Returns path of the staging directory of the dataset.
+
+    Args:
+        path (str): Path to the dataset directory
+
+    Returns:
+        str: Path to the staging directory
+    """
+    return f"{os.path.normpath(path)}{c.STAGING_DIR_SUFFIX}"
+
+
+
+def create_staging_dir(path, resume=False):
+    """Creates fresh staging directory near the dataset directory.
+    Dataset is generated in staging directory and swapped into place
+    with 'swap_staging_dir' when done. Staging directory left from the
+    interrupted run is removed in background, or kept with its manifest
+    to continue the build if 'resume' is true.
+
+    Args:
+        path (str): Path to the dataset directory
+        resume (bool, optional): Keep staging directory of the
+            interrupted run. Defaults to False.
+
+    Returns:
+        str: Path to the staging directory
+    """
+    staging_path = get_staging_path(path)
+    if os.path.isdir(staging_path):
+        if resume:
+            return staging_path
+        remove_dir_in_background(move_dir_to_trash(staging_path))
+    os.mkdir(staging_path)
+    return staging_path
+
+
+
+def swap_staging_dir(staging_path, path):
+    """Moves staging directory to the dataset path. Old dataset is
+    renamed to the trash and removed in background. Both steps are
+    renames, so old dataset stays complete until the new one is ready.
+
+    Args:
+        staging_path (str): Path to the staging directory
+        path (str): Path to the dataset directory
+
+    Returns:
+        str: Path to the dataset directory
+    """
+    trash_path = None
+    if os.path.isdir(path):
+        trash_path = move_dir_to_trash(path)
+    os.rename(staging_path, path)
+    if trash_path is not None:
+        remove_dir_in_background(trash_path)
+    return path
+
+
+
 def extract_supported_filenames(filenames):
     """Yields video files with supported extention. Refer to constants
     to check or add more supported extentions.
@@ -0,0 +1,509 @@
+"""
+Module for streaming inference of trained models over full videos:
+- tracks are read from CVAT archive or from tracker output (MOT format)
+- video is decoded once, only frames with boxes
+- crops of every track are prepared by the same crop and letterbox as
+    in ChunkWriter and kept in the ring buffer of the track
+- windows of CHUNK_SIZE crops with FRAME_STEP spacing are collected
+    from all tracks and classified by batches
+
+Prediction of the window is assigned to its last frame, so every frame
+of the track gets prediction as soon as it is decoded. Predictions are
+written to CSV while video is decoded, memory does not depend on the
+length of the video.
+
+Incremental mode splits sequence model to per-frame encoder and temporal
+head. Ring buffers keep embeddings instead of crops, so every crop is
+encoded once and every window costs only the pass of the head, instead
+of encoding of all crops of the window.
+"""
+
+import os
+import csv
+import json
+import time
+import cv2
+import numpy as np
+
+from collections import OrderedDict, deque
+
+from utils import constants as c
+from utils import annotation_parser
+from utils import profiler
+from utils import video_writer
+
+
+
+def read_cvat_tracks(annotation_path):
+    """Reads boxes of tracks of target labels from CVAT archive.
+
+    Args:
+        annotation_path (str): Path to annotation archive
+
+    Returns:
+        OrderedDict: {track id: {frame: (ax, ay, bx, by)}}
+    """
+    _, tracks = annotation_parser.get_annotation(annotation_path)
+    if isinstance(tracks, dict):
+        tracks = [tracks]
+    track_boxes = OrderedDict()
+    for index, track in enumerate(tracks):
+        if track['@label'] not in c.TARGET_ATTRIBUTES:
+            continue
+        boxes = track['box']
+        if isinstance(boxes, dict):
+            boxes = [boxes]
+        track_boxes[int(track.get('@id', index))] = {
+            int(box['@frame']): tuple(
+                int(float(box[key])) for key in ('@xtl', '@ytl', '@xbr', '@ybr')
+            )
+            for box in boxes if box['@outside'] != '1'
+        }
+    return track_boxes
+
+
+
+def read_mot_tracks(tracks_path):
+    """Reads boxes of tracker output in MOTChallenge format:
+    'frame,id,left,top,width,height,...'. Frames are numbered from 1.
+
+    Args:
+        tracks_path (str): Path to tracker output
+
+    Returns:
+        OrderedDict: {track id: {frame: (ax, ay, bx, by)}}
+    """
+    track_boxes = OrderedDict()
+    with open(tracks_path, encoding='utf-8') as file:
+        for row in csv.reader(file):
+            if not row or row[0].startswith('#'):
+                continue
+            frame, track_id = int(float(row[0])) - 1, int(float(row[1]))
+            left, top, width, height = (float(value) for value in row[2:6])
+            track_boxes.setdefault(track_id, {})[frame] = (
+                int(left), int(top), int(left + width), int(top + height)
+            )
+    return track_boxes
+
+
+
+def read_tracks(tracks_path):
+    """Reads tracks from CVAT archive (.zip) or tracker output.
+
+    Args:
+        tracks_path (str): Path to annotation archive or tracker output
+
+    Returns:
+        OrderedDict: {track id: {frame: (ax, ay, bx, by)}}
+    """
+    if tracks_path.lower().endswith('.zip'):
+        return read_cvat_tracks(tracks_path)
+    return read_mot_tracks(tracks_path)
+
+
+
+def clip_box(coordinates, image_shape):
+    """Clips box to the frame. Trackers give boxes which cross the edge
+    of the frame for vehicles which enter or leave it.
+
+    Args:
+        coordinates (tuple): Box coordinates (ax, ay, bx, by)
+        image_shape (tuple): Shape of the frame (H, W, 3)
+
+    Returns:
+        tuple | None: Box coordinates inside the frame. None if box is
+            out of the frame
+    """
+    height, width = image_shape[:2]
+    ax, ay, bx, by = coordinates
+    ax, bx = max(ax, 0), min(bx, width)
+    ay, by = max(ay, 0), min(by, height)
+    if ax >= bx or ay >= by:
+        return None
+    return ax, ay, bx, by
+
+
+
+def get_frame_boxes(track_boxes):
+    """Groups boxes of all tracks by frames.
+
+    Args:
+        track_boxes (dict): {track id: {frame: coordinates}}
+
+    Returns:
+        dict: {frame: [(track id, coordinates), ...]}
+    """
+    frame_boxes = {}
+    for track_id, boxes in track_boxes.items():
+        for frame, coordinates in boxes.items():
+            frame_boxes.setdefault(frame, []).append((track_id, coordinates))
+    return frame_boxes
+
+
+
+def get_track_ends(track_boxes):
+    """Groups tracks by their last frames.
+
+    Args:
+        track_boxes (dict): {track id: {frame: coordinates}}
+
+    Returns:
+        dict: {frame: [track id, ...]}
+    """
+    track_ends = {}
+    for track_id, boxes in track_boxes.items():
+        if boxes:
+            track_ends.setdefault(max(boxes), []).append(track_id)
+    return track_ends
+
+
+
+class WindowBuffer:
+    def __init__(self, window_size, frame_step):
+        """Ring buffers of the last crops of every track. Ring keeps
+        crops of the span of the window, so window can end on every
+        frame.
+
+        Args:
+            window_size (int): Crops in window
+            frame_step (int): Frames between crops of window
+        """
+        self.window_size = window_size
+        self.frame_step = frame_step
+        self.span = (window_size - 1) * frame_step + 1
+        self.rings = {}
+
+
+    def add(self, track_id, frame, crop):
+        """Adds crop of the track. Frames of the track must be ascending.
+
+        Args:
+            track_id (int): Track
+            frame (int): Frame number
+            crop (array): Crop of the box
+        """
+        ring = self.rings.get(track_id)
+        if ring is None:
+            ring = self.rings[track_id] = deque(maxlen=self.span)
+        ring.append((frame, crop))
+
+
+    def get_window(self, track_id, frame):
+        """Returns window which ends on the frame.
+
+        Args:
+            track_id (int): Track
+            frame (int): The last frame of window
+
+        Returns:
+            array | None: Crops (window_size, H, W, 3). None if track
+                has no crops of some frames of the window
+        """
+        ring = self.rings.get(track_id)
+        # Frames are ascending, so full ring without gaps starts here
+        if ring is None or len(ring) < self.span or ring[0][0] != frame - self.span + 1:
+            return None
+        return np.stack([ring[index][1] for index in range(0, self.span, self.frame_step)])
+
+
+    def drop(self, track_id):
+        """Releases crops of the finished track.
+
+        Args:
+            track_id (int): Track
+        """
+        self.rings.pop(track_id, None)
+
+
+
+class StreamingClassifier:
+    def __init__(self, predict, input_shape, frame_step=c.FRAME_STEP,
+                 batch_size=c.INFERENCE_BATCH_SIZE, rescale=1/255.):
+        """Classifies windows of tracks by batches.
+
+        Args:
+            predict (callable): Takes float batch, returns probabilities
+            input_shape (tuple): Input of model without batch dimension.
+                (frames, H, W, 3) for sequence model, (H, W, 3) for image
+                model
+            frame_step (int, optional): Frames between crops of window.
+                Defaults to FRAME_STEP from constants.
+            batch_size (int, optional): Windows of one prediction.
+                Defaults to INFERENCE_BATCH_SIZE from constants.
+            rescale (float, optional): Scale of crops, same as in
+                training. Defaults to 1/255.
+        """
+        self.predict = predict
+        self.is_sequence = len(input_shape) == 4
+        window_size = input_shape[0] if self.is_sequence else 1
+        self.resolution = (int(input_shape[-2]), int(input_shape[-3]))
+        self.buffer = WindowBuffer(window_size, frame_step if self.is_sequence else 1)
+        self.batch_size = batch_size
+        self.rescale = rescale
+        self.pending = []
+        self.predictions = []
+        self.crops_counter = 0
+        self.encoded_counter = 0
+        self.windows_counter = 0
+        self.batches_counter = 0
+
+
+    def add_frame(self, frame, image, boxes):
+        """Adds crops of all boxes of the frame and classifies ready
+        windows when batch is full.
+
+        Args:
+            frame (int): Frame number
+            image (array | None): Decoded frame
+            boxes (list): Tuples (track id, coordinates)
+        """
+        for track_id, coordinates in boxes:
+            if image is not None:
+                coordinates = clip_box(coordinates, image.shape)
+                if coordinates is None:
+                    # Empty crop, window of the track waits for new crops
+                    continue
+            with profiler.stage('crop_resize'):
+                crop = video_writer.crop_box(image, coordinates, self.resolution)
+                # Models are trained on RGB frames
+                crop = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
+            self.crops_counter += 1
+            self.buffer.add(track_id, frame, crop)
+            window = self.buffer.get_window(track_id, frame)
+            if window is not None:
+                self.pending.append(
+                    (track_id, frame, window if self.is_sequence else window[0])
+                )
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+
+    def end_tracks(self, track_ids):
+        """Releases buffers of finished tracks.
+
+        Args:
+            track_ids (list): Finished tracks
+        """
+        for track_id in track_ids:
+            self.buffer.drop(track_id)
+
+
+    def flush(self):
+        """Classifies all pending windows.
+        """
+        if not self.pending:
+            return
+        batch = np.stack([window for _, _, window in self.pending]).astype('float32')
+        batch *= self.rescale
+        with profiler.stage('inference'):
+            probabilities = np.asarray(self.predict(batch))
+        for (track_id, frame, _), track_probabilities in zip(self.pending, probabilities):
+            self.predictions.append((track_id, frame, track_probabilities))
+        # Model encodes every crop of the window
+        self.encoded_counter += len(self.pending) * self.buffer.window_size
+        self.windows_counter += len(self.pending)
+        self.batches_counter += 1
+        self.pending = []
+
+
+    def pop_predictions(self):
+        """Returns predictions made since the last call.
+
+        Returns:
+            list: Tuples (track id, frame, probabilities)
+        """
+        predictions, self.predictions = self.predictions, []
+        return predictions
+
+
+
+class IncrementalClassifier(StreamingClassifier):
+    def __init__(self, encode, predict_head, input_shape, frame_step=c.FRAME_STEP,
+                 batch_size=c.INFERENCE_BATCH_SIZE, rescale=1/255.):
+        """Classifies windows of tracks from cached embeddings of crops.
+        Crops are encoded by batches, embeddings are added to ring
+        buffers of tracks and ready windows are classified by the head.
+
+        Args:
+            encode (callable): Takes float batch of crops, returns
+                embeddings
+            predict_head (callable): Takes batch of windows of
+                embeddings, returns probabilities
+            input_shape (tuple): Input of the whole sequence model
+                without batch dimension (frames, H, W, 3)
+            frame_step (int, optional): Frames between crops of window.
+                Defaults to FRAME_STEP from constants.
+            batch_size (int, optional): Crops of one encoder pass.
+                Defaults to INFERENCE_BATCH_SIZE from constants.
+            rescale (float, optional): Scale of crops, same as in
+                training. Defaults to 1/255.
+        """
+        assert len(input_shape) == 4, "Incremental mode needs sequence model"
+        super().__init__(predict_head, input_shape, frame_step, batch_size, rescale)
+        self.encode = encode
+        self.ended_tracks = []
+
+
+    def add_frame(self, frame, image, boxes):
+        """Adds crops of all boxes of the frame and encodes them when
+        batch is full.
+
+        Args:
+            frame (int): Frame number
+            image (array | None): Decoded frame
+            boxes (list): Tuples (track id, coordinates)
+        """
+        for track_id, coordinates in boxes:
+            if image is not None:
+                coordinates = clip_box(coordinates, image.shape)
+                if coordinates is None:
+                    # Empty crop, window of the track waits for new crops
+                    continue
+            with profiler.stage('crop_resize'):
+                crop = video_writer.crop_box(image, coordinates, self.resolution)
+                crop = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
+            self.crops_counter += 1
+            self.pending.append((track_id, frame, crop))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+
+    def end_tracks(self, track_ids):
+        """Releases buffers of finished tracks after their pending crops
+        are encoded.
+
+        Args:
+            track_ids (list): Finished tracks
+        """
+        self.ended_tracks.extend(track_ids)
+
+
+    def flush(self):
+        """Encodes pending crops and classifies windows which became
+        ready.
+        """
+        if not self.pending:
+            return
+        batch = np.stack([crop for _, _, crop in self.pending]).astype('float32')
+        batch *= self.rescale
+        with profiler.stage('encoder'):
+            embeddings = np.asarray(self.encode(batch))
+        windows = []
+        # Crops are pending in order of frames, so rings stay ascending
+        for (track_id, frame, _), embedding in zip(self.pending, embeddings):
+            self.buffer.add(track_id, frame, embedding)
+            window = self.buffer.get_window(track_id, frame)
+            if window is not None:
+                windows.append((track_id, frame, window))
+        self.encoded_counter += len(self.pending)
+        self.pending = []
+        for track_id in self.ended_tracks:
+            self.buffer.drop(track_id)
+        self.ended_tracks = []
+        if not windows:
+            return
+        with profiler.stage('inference'):
+            probabilities = np.asarray(self.predict(np.stack([window for _, _, window in windows])))
+        for (track_id, frame, _), track_probabilities in zip(windows, probabilities):
+            self.predictions.append((track_id, frame, track_probabilities))
+        self.windows_counter += len(windows)
+        self.batches_counter += 1
+
+
+
+def split_action_model(model):
+    """Splits sequence model with TimeDistributed encoder as the first
+    layer to per-frame encoder and temporal head. Both parts share
+    layers and weights with the model.
+
+    Args:
+        model (obj): Keras Sequential model, e.g. 'action_model'
+
+    Returns:
+        tuple: Encoder model and head model
+    """
+    import keras
+
+    first_layer = model.layers[0]
+    assert isinstance(first_layer, keras.layers.TimeDistributed), \
+        "Model must start with TimeDistributed encoder"
+    encoder = first_layer.layer
+    frames = model.input_shape[1]
+    embedding_shape = tuple(encoder.output_shape[1:])
+    head = keras.Sequential(
+        [keras.Input(shape=(frames,) + embedding_shape)] + model.layers[1:]
+    )
+    return encoder, head
+
+
+
+def write_predictions(writer, predictions, classes):
+    """Writes predictions to CSV.
+
+    Args:
+        writer (obj): csv.writer
+        predictions (list): Tuples (track id, frame, probabilities)
+        classes (list): Class names in order of model outputs
+    """
+    for track_id, frame, probabilities in predictions:
+        writer.writerow(
+            [track_id, frame, classes[int(np.argmax(probabilities))]]
+            + [f'{probability:.5f}' for probability in probabilities]
+        )
+
+
+
+def run_inference(video_path, tracks_path, classifier, output_path, classes):
+    """Decodes video once and classifies windows of all tracks.
+
+    Args:
+        video_path (str): Path to the source video
+        tracks_path (str): Path to CVAT archive or tracker output
+        classifier (obj): StreamingClassifier instance
+        output_path (str): Directory of predictions and report
+        classes (list): Class names in order of model outputs
+
+    Returns:
+        OrderedDict: Throughput report
+    """
+    os.makedirs(output_path, exist_ok=True)
+    track_boxes = read_tracks(tracks_path)
+    frame_boxes = get_frame_boxes(track_boxes)
+    track_ends = get_track_ends(track_boxes)
+    inference_profiler = profiler.StageProfiler()
+    predictions_path = os.path.join(output_path, c.INFERENCE_PREDICTIONS_FILENAME)
+    capture = cv2.VideoCapture(video_path)
+    decoded_frames = 0
+    start_time = time.perf_counter()
+    with profiler.collect(inference_profiler), \
+            open(predictions_path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['track', 'frame', 'class'] + [f'prob_{name}' for name in classes])
+        for frame, image in video_writer.read_frames(capture, frame_boxes.keys()):
+            decoded_frames += 1
+            classifier.add_frame(frame, image, frame_boxes[frame])
+            classifier.end_tracks(track_ends.get(frame, []))
+            write_predictions(writer, classifier.pop_predictions(), classes)
+        classifier.flush()
+        write_predictions(writer, classifier.pop_predictions(), classes)
+    capture.release()
+    seconds = time.perf_counter() - start_time
+
+    report = OrderedDict()
+    report['video'] = video_path
+    report['tracks'] = tracks_path
+    report['tracks_number'] = len(track_boxes)
+    report['decoded_frames'] = decoded_frames
+    report['crops'] = classifier.crops_counter
+    report['encoded_crops'] = classifier.encoded_counter
+    report['windows'] = classifier.windows_counter
+    report['batches'] = classifier.batches_counter
+    report['seconds'] = seconds
+    report['frames_per_second'] = decoded_frames / max(seconds, 1e-9)
+    report['windows_per_second'] = classifier.windows_counter / max(seconds, 1e-9)
+    report['stages'] = inference_profiler.get_stats()
+    report['predictions'] = predictions_path
+    with open(os.path.join(output_path, c.INFERENCE_REPORT_FILENAME), 'w',
+              encoding='utf-8') as file:
+        json.dump(report, file, indent=4)
+    return report
@@ -1,27 +1,134 @@
 """
 Module for logging simplicity.
 Can be used same as vanilla logging module.
+
+Records of the main process and of all worker processes are put to one
+queue by 'QueueHandler' and written to the log file by the listener
+thread of the main process, so workers are not blocked by file writing
+and records of every process are aggregated in one file with the name
+of the process. When debug is disabled, logger has no handlers and
+level guards skip formatting of messages.
 """
 
+import atexit
 import logging
-import secrets
+import logging.handlers
+import multiprocessing
 from typing_extensions import OrderedDict
 
 from utils import constants as c
 
 
+# Queue of log records and its listener of the current run. None if
+# debug is disabled
+log_queue = None
+log_listener = None
+
+
 
 def get_logger():
-    logger_id = secrets.token_urlsafe(16)
-    logging.basicConfig(
-        format='%(asctime)s | %(name)s | %(levelname)s | %(message)s',
-        filename=c.LOGGER_FILENAME,
-        encoding='utf-8',
-        level=logging.DEBUG
-    )
-    logger = logging.getLogger(logger_id)
+    """Returns logger of the generator. Logger is configured by
+    'start_logging' in the main process and by 'init_worker' in worker
+    processes.
+
+    Returns:
+        obj: logging.Logger instance
+    """
+    return logging.getLogger(c.LOGGER_NAME)
+
+
+
+def configure_logger(queue, level):
+    """Sends records of the generator logger of the current process to
+    the queue.
+
+    Args:
+        queue (obj | None): Queue of log records. None disables logging
+        level (int): Logging level
+    """
+    logger = get_logger()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    # Records are not passed to root logger and its default handlers
+    logger.propagate = False
+    if queue is None:
+        logger.addHandler(logging.NullHandler())
+        logger.setLevel(logging.CRITICAL)
+    else:
+        logger.addHandler(logging.handlers.QueueHandler(queue))
+        logger.setLevel(level)
+
+
+
+def start_logging(debug, filename=c.LOGGER_FILENAME):
+    """Starts listener thread which writes records of all processes to
+    the log file. Listener is stopped at exit of the main process, after
+    remaining records are written.
+
+    Args:
+        debug (bool): Enable debug log writing
+        filename (str, optional): Path to the log file. Defaults to
+            LOGGER_FILENAME from constants.
 
-    return logger
+    Returns:
+        obj: Logger of the generator
+    """
+    global log_queue, log_listener
+    stop_logging()
+    if not debug:
+        configure_logger(None, logging.CRITICAL)
+        return get_logger()
+    log_queue = multiprocessing.Queue(-1)
+    file_handler = logging.FileHandler(filename, encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter(c.LOGGER_FORMAT))
+    log_listener = logging.handlers.QueueListener(log_queue, file_handler)
+    log_listener.start()
+    configure_logger(log_queue, logging.DEBUG)
+    # Registered after the queue, so listener is stopped before
+    # multiprocessing finalizes the queue at exit
+    atexit.register(stop_logging)
+    return get_logger()
+
+
+
+def stop_logging():
+    """Writes remaining records and stops listener thread.
+    """
+    global log_queue, log_listener
+    if log_listener is None:
+        return
+    log_listener.stop()
+    for handler in log_listener.handlers:
+        handler.close()
+    configure_logger(None, logging.CRITICAL)
+    log_queue = None
+    log_listener = None
+
+
+
+def init_worker(queue, level):
+    """Initializer of worker processes. Configures logger of the worker
+    to send records to the queue of the main process.
+
+    Args:
+        queue (obj | None): Queue of log records
+        level (int): Logging level
+    """
+    configure_logger(queue, level)
+
+
+
+def get_pool_settings():
+    """Returns initializer of process pool, which connects loggers of
+    workers to the listener of the main process.
+
+    Returns:
+        dict: 'initializer' and 'initargs' for ProcessPoolExecutor
+    """
+    return {
+        'initializer': init_worker,
+        'initargs': (log_queue, get_logger().getEffectiveLevel()),
+    }
 
 
 
@@ -35,6 +142,16 @@ def log_writer_report(logger, writer_report):
     for name, value in writer_report.items():
         if name == 'Broken chunks list' and len(value) > 0:
             for record in value:
-                logger.debug(f"Report: {name}: {record}")
+                logger.debug("Report: %s: %s", name, record)
+        elif name == 'Written chunks list':
+            # Every written chunk is already logged by writer
+            logger.debug("Report: %s: %d chunks", name, len(value))
+        elif name == 'Stage timings':
+            for stage, timings in value.items():
+                logger.debug("Report: %s: %s: %d calls, %.3f s",
+                             name, stage, timings['count'], timings['total_seconds'])
+        elif name == 'Stage memory':
+            for stage, peaks in value.items():
+                logger.debug("Report: %s: %s: %s", name, stage, peaks)
         else:
-            logger.debug(f"Report: {name}: {value}")
+            logger.debug("Report: %s: %s", name, value)
@@ -0,0 +1,325 @@
+"""
+Module for the build manifest of the dataset. Manifest is a SQLite
+database in the root of the dataset directory. It records for every
+video:
+- hash of the annotation archive
+- hash of the script settings
+- extraction status ('started' or 'done')
+- chunk files produced from the video
+- statistics of the script
+
+Manifest allows to rerun the generator and process only videos with
+changed inputs or settings and resume interrupted ones.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+
+from utils import constants as c
+
+
+
+def get_manifest_path(output_path):
+    """Returns path to the manifest file in dataset directory.
+
+    Args:
+        output_path (str): Path to the dataset directory
+
+    Returns:
+        str: Path to the manifest database
+    """
+    return os.path.join(output_path, c.MANIFEST_FILENAME)
+
+
+
+def get_file_hash(path):
+    """Calculates SHA-256 hash of the file. File is read by blocks, so
+    big archives do not need to be loaded to the memory.
+
+    Args:
+        path (str): Path to the file
+
+    Returns:
+        str: Hex digest of the file content
+    """
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(c.MANIFEST_HASH_BLOCK_SIZE), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+
+def get_settings_hash(settings):
+    """Calculates hash of script settings. Settings are serialized with
+    sorted keys, so the order of the records does not change the hash.
+
+    Args:
+        settings (dict): Script settings
+
+    Returns:
+        str: Hex digest of the settings
+    """
+    settings_dump = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha256(settings_dump.encode('utf-8')).hexdigest()
+
+
+
+def get_chunk_name_pattern(source_names, class_name):
+    """Creates pattern of chunk file names of the videos in the class
+    subdirectory. Name is matched entirely, so chunks of another video
+    with the same name prefix are not matched:
+    {source}_{label}_{type}_{class}_tr{track}_seq{chunk}_fr{frame}
+    [_{suffix}][.tmp].{ext}
+
+    Args:
+        source_names (iterable): Source video names from annotation
+        class_name (str): Name of the class subdirectory
+
+    Returns:
+        obj: Compiled pattern
+    """
+    sources = '|'.join(re.escape(name) for name in sorted(source_names))
+    labels = '|'.join(re.escape(label) for label in c.TARGET_ATTRIBUTES)
+    return re.compile(
+        rf"(?:{sources})_(?:{labels})_[^_]+_{re.escape(class_name)}_"
+        rf"tr\d{{4}}_seq\d{{4}}_fr\d{{6}}(?:_[^_.]+)?"
+        rf"(?:\.{re.escape(c.TEMP_CHUNK_SUFFIX)})?\.[^.]+"
+    )
+
+
+
+def remove_partial_files(output_path, source_names):
+    """Removes all chunks and temporary files of the videos from class
+    subdirectories, including ones of every output resolution. Used for
+    interrupted extractions, where the list of produced chunks was not
+    recorded. Dataset directory is walked once for all videos.
+
+    Args:
+        output_path (str): Path to the dataset directory
+        source_names (iterable): Source video names from annotation
+
+    Returns:
+        int: Number of removed files
+    """
+    removed_files = 0
+    source_names = set(source_names)
+    if not source_names or not os.path.isdir(output_path):
+        return removed_files
+    for dir_path, _, files in os.walk(output_path):
+        if dir_path == output_path:
+            continue
+        pattern = get_chunk_name_pattern(source_names, os.path.basename(dir_path))
+        for file in files:
+            if pattern.fullmatch(file):
+                try:
+                    os.remove(os.path.join(dir_path, file))
+                    removed_files += 1
+                except OSError:
+                    pass
+    return removed_files
+
+
+
+class BuildManifest:
+    def __init__(self, output_path):
+        """Manifest of the dataset build. Opens existing database or
+        creates a new one in the dataset directory.
+
+        Args:
+            output_path (str): Path to the dataset directory
+        """
+        self.output_path = output_path
+        self.manifest_path = get_manifest_path(output_path)
+        self.connection = sqlite3.connect(self.manifest_path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.__create_tables()
+
+
+    def __create_tables(self):
+        """Creates tables for videos and chunks if not exist.
+        """
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS videos ('
+                'video TEXT PRIMARY KEY, '
+                'source_name TEXT, '
+                'annotation_hash TEXT, '
+                'settings_hash TEXT, '
+                'settings TEXT, '
+                'status TEXT, '
+                'statistics TEXT, '
+                'updated REAL)'
+            )
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS chunks ('
+                'video TEXT, '
+                'path TEXT, '
+                'PRIMARY KEY (video, path))'
+            )
+
+
+    def is_up_to_date(self, video, annotation_hash, settings_hash) -> bool:
+        """Checks if video was fully processed with the same annotation
+        and settings.
+
+        Args:
+            video (str): Video file name
+            annotation_hash (str): Hash of annotation archive
+            settings_hash (str): Hash of script settings
+
+        Returns:
+            bool: True if video can be skipped, else - False
+        """
+        record = self.connection.execute(
+            'SELECT annotation_hash, settings_hash, status '
+            'FROM videos WHERE video = ?',
+            (video,)
+        ).fetchone()
+        video_is_up_to_date = (
+            record is not None
+            and record[0] == annotation_hash
+            and record[1] == settings_hash
+            and record[2] == c.MANIFEST_STATUS_DONE
+        )
+        return video_is_up_to_date
+
+
+    def start_video(self, video, source_name, annotation_hash, settings) -> bool:
+        """Marks video extraction as started. Removes recorded chunks of
+        previous builds of the video, so outdated chunks are never mixed
+        with the new ones. Chunks of interrupted extraction are not
+        recorded and must be removed with 'remove_partial_files'.
+
+        Args:
+            video (str): Video file name
+            source_name (str): Source video name from annotation
+            annotation_hash (str): Hash of annotation archive
+            settings (dict): Script settings
+
+        Returns:
+            bool: True if previous extraction of the video was
+                interrupted, else - False
+        """
+        record = self.connection.execute(
+            'SELECT status FROM videos WHERE video = ?', (video,)
+        ).fetchone()
+        self.remove_video_chunks(video)
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    video,
+                    source_name,
+                    annotation_hash,
+                    get_settings_hash(settings),
+                    json.dumps(settings, sort_keys=True, default=str),
+                    c.MANIFEST_STATUS_STARTED,
+                    None,
+                    time.time(),
+                )
+            )
+        return record is not None and record[0] == c.MANIFEST_STATUS_STARTED
+
+
+    def add_chunks(self, video, chunk_paths):
+        """Records chunks of the finished sub-task of the video, so they
+        are removed exactly if the video is interrupted later.
+
+        Args:
+            video (str): Video file name
+            chunk_paths (list): Paths of written chunks
+        """
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO chunks VALUES (?, ?)',
+                [(video, os.path.relpath(path, self.output_path))
+                 for path in chunk_paths]
+            )
+
+
+    def finish_video(self, video, chunk_paths, statistics):
+        """Records produced chunks and marks video extraction as done.
+
+        Args:
+            video (str): Video file name
+            chunk_paths (list): Paths of all written chunks
+            statistics (dict): Statistics of the script
+        """
+        self.add_chunks(video, chunk_paths)
+        with self.connection:
+            self.connection.execute(
+                'UPDATE videos SET status = ?, statistics = ?, updated = ? '
+                'WHERE video = ?',
+                (
+                    c.MANIFEST_STATUS_DONE,
+                    json.dumps(statistics, default=str),
+                    time.time(),
+                    video,
+                )
+            )
+
+
+    def remove_video_chunks(self, video):
+        """Removes recorded chunk files of the video from disk and from
+        the manifest.
+
+        Args:
+            video (str): Video file name
+        """
+        for chunk_path in self.get_video_chunks(video):
+            try:
+                os.remove(os.path.join(self.output_path, chunk_path))
+            except OSError:
+                pass
+        with self.connection:
+            self.connection.execute(
+                'DELETE FROM chunks WHERE video = ?', (video,)
+            )
+
+
+    def get_video_chunks(self, video):
+        """Returns recorded chunks of the video.
+
+        Args:
+            video (str): Video file name
+
+        Returns:
+            list: Chunk paths relative to the dataset directory
+        """
+        records = self.connection.execute(
+            'SELECT path FROM chunks WHERE video = ?', (video,)
+        ).fetchall()
+        return [record[0] for record in records]
+
+
+    def get_videos(self):
+        """Returns records of all videos in manifest.
+
+        Returns:
+            list: Dicts with video name, source name, status and
+                statistics
+        """
+        records = self.connection.execute(
+            'SELECT video, source_name, status, statistics FROM videos'
+        ).fetchall()
+        videos = []
+        for video, source_name, status, statistics in records:
+            videos.append({
+                'video':video,
+                'source_name':source_name,
+                'status':status,
+                'statistics':json.loads(statistics) if statistics else {},
+            })
+        return videos
+
+
+    def close(self):
+        """Closes connection to the database.
+        """
+        self.connection.close()
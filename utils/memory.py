@@ -0,0 +1,228 @@
+"""
+Module for memory budget of generation. Memory of writing and planning
+tasks is estimated from scripts and annotations:
+- worker process itself
+- decoded frames of the source
+- crops of chunks in progress. In the shared stream every chunk keeps
+    its crops until the last frame of the chunk is decoded
+- parsed annotation of the track analysis
+
+Scheduler submits tasks to workers only while estimated memory of
+running tasks and current memory of the main process fit the budget.
+Shared stream of the source, which does not fit the budget, is split to
+separate tasks of every script, so crops are not cached across scripts.
+
+Also contains sampling of resident memory (RSS) of the process, which is
+used by stage profiler.
+"""
+
+import os
+import sys
+import tracemalloc
+
+from utils import constants as c
+from utils import augmentation
+
+
+# Page size for reading of resident memory from '/proc'
+try:
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    PAGE_SIZE = None
+
+
+
+def get_rss_bytes():
+    """Reads current resident memory of the process. Supported on Linux
+    only.
+
+    Returns:
+        int | None: Bytes. None if it can not be read
+    """
+    if PAGE_SIZE is None:
+        return None
+    try:
+        with open('/proc/self/statm', encoding='ascii') as file:
+            return int(file.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+
+def get_peak_rss_bytes(children=False):
+    """Reads peak resident memory of the process or of its finished
+    child processes (the largest one).
+
+    Args:
+        children (bool, optional): Peak of child processes. Defaults to
+            False.
+
+    Returns:
+        int | None: Bytes. None if it is not supported
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS - bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+
+def start_tracing(trace_memory):
+    """Starts tracing of python allocations in the current process.
+
+    Args:
+        trace_memory (bool): Enable tracemalloc
+    """
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+
+def get_crop_bytes(script):
+    """Calculates memory of crops of one frame of the chunk: crop of the
+    largest resolution, smaller levels and augmented copies.
+
+    Args:
+        script (dict): Script from video editor
+
+    Returns:
+        int: Bytes
+    """
+    settings = script['script_settings']
+    resolutions = settings.get('resolutions', [c.EXTRACTOR_RESOLUTION])
+    level_bytes = sum(width * height * 3 for width, height in resolutions)
+    copies = 1 + len(settings.get('augmentations', []))
+    return level_bytes * copies
+
+
+
+def get_chunk_frames_number(script, chunk):
+    """Returns number of frames which writer reads for the chunk.
+
+    Args:
+        script (dict): Script from video editor
+        chunk (dict): Chunk from script
+
+    Returns:
+        int: Frames number
+    """
+    mode = script['script_settings']['mode']
+    if mode == 'difference':
+        return min(len(chunk['sequence']), 2)
+    extra_frames = augmentation.get_extra_frames(
+        chunk, script['script_settings']['augmentations'], mode
+    )
+    return len(chunk['sequence']) + len(extra_frames)
+
+
+
+def get_pending_chunks_bytes(scripts):
+    """Calculates peak memory of crops of chunks in progress in the shared
+    stream. Chunk is in progress from its first to its last frame.
+
+    Args:
+        scripts (list): Scripts of the shared stream
+
+    Returns:
+        int: Bytes
+    """
+    events = []
+    for script in scripts:
+        crop_bytes = get_crop_bytes(script)
+        for chunk in script['chunks']:
+            frames = list(chunk['sequence'].keys()) + list(chunk.get('stride_sequence', {}))
+            chunk_bytes = crop_bytes * get_chunk_frames_number(script, chunk)
+            events.append((min(frames), 0, chunk_bytes))
+            events.append((max(frames), 1, -chunk_bytes))
+    # Chunk is released after its last frame, so starts go first
+    events.sort()
+    pending_bytes = 0
+    peak_bytes = 0
+    for _, _, chunk_bytes in events:
+        pending_bytes += chunk_bytes
+        peak_bytes = max(peak_bytes, pending_bytes)
+    return peak_bytes
+
+
+
+def get_frame_bytes(extraction):
+    """Calculates memory of decoded frames of the source.
+
+    Args:
+        extraction (obj): ExtractionTask instance
+
+    Returns:
+        int: Bytes
+    """
+    frame_bytes = int(extraction.info['video_width']) \
+        * int(extraction.info['video_height']) * 3
+    return frame_bytes * c.MEMORY_DECODE_BUFFER_FRAMES
+
+
+
+def get_write_memory(extractions, shared_stream):
+    """Estimates memory of the worker which writes chunks of extractions
+    of the same source.
+
+    Args:
+        extractions (list): ExtractionTask instances with scripts
+        shared_stream (bool): Scripts are written from one decoded stream
+
+    Returns:
+        int: Bytes
+    """
+    memory = c.MEMORY_WORKER_BASE_BYTES + get_frame_bytes(extractions[0])
+    if shared_stream:
+        memory += get_pending_chunks_bytes(
+            [extraction.script for extraction in extractions]
+        )
+    else:
+        # Writer reads and writes one chunk at once
+        memory += max(
+            (get_crop_bytes(extraction.script)
+             * get_chunk_frames_number(extraction.script, chunk)
+             for extraction in extractions
+             for chunk in extraction.script['chunks']),
+            default=0
+        )
+    return memory
+
+
+
+def get_plan_memory(extraction):
+    """Estimates memory of the worker which analyzes tracks of the
+    extraction. Annotation is kept in the main process and its copy is
+    sent to the worker.
+
+    Args:
+        extraction (obj): ExtractionTask instance with annotation
+
+    Returns:
+        int: Bytes
+    """
+    boxes_number = sum(extraction.info['tracks_size'].values())
+    return c.MEMORY_WORKER_BASE_BYTES + boxes_number * c.MEMORY_ANNOTATION_BOX_BYTES
+
+
+
+def fits_budget(max_memory, running_memory, task_memory, running_tasks):
+    """Checks if one more task can be started. The first task is always
+    started, so generation can not stall.
+
+    Args:
+        max_memory (int | None): Budget in bytes. None - unlimited
+        running_memory (int): Estimated memory of running tasks
+        task_memory (int): Estimated memory of the task
+        running_tasks (int): Number of running tasks
+
+    Returns:
+        bool: True if task can be started
+    """
+    if max_memory is None or running_tasks == 0:
+        return True
+    main_memory = get_rss_bytes() or 0
+    return (main_memory + running_memory + task_memory) <= max_memory
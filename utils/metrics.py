@@ -0,0 +1,384 @@
+"""
+Module for live throughput metrics of long generation runs. Metrics are
+collected in the main process from statistics of scripts
+('get_chunks_stats') and reports of writer tasks ('ChunkWriter.get_report'):
+- frames decoded, chunks written and bytes written per second
+- queue depths of writing tasks
+- broken chunks rate
+- planned and written chunks of every class
+- progress and ETA of every video and of the whole run
+
+Metrics are available from 'GenerationMetrics.get_metrics' and are
+periodically flushed to the Prometheus textfile, to the JSONL stream or
+both.
+"""
+
+import os
+import json
+import time
+
+from collections import OrderedDict
+
+from utils import constants as c
+
+
+
+class GenerationMetrics:
+    def __init__(self, output_path=None, formats=c.METRICS_FORMATS,
+                 interval=c.METRICS_INTERVAL, show_progress=False):
+        """Collector of live generation metrics.
+
+        Args:
+            output_path (str, optional): Directory of metrics files.
+                Defaults to None - metrics are not written.
+            formats (iterable, optional): 'prometheus' and / or 'jsonl'.
+                Defaults to METRICS_FORMATS from constants.
+            interval (float, optional): Minimal seconds between flushes.
+                Defaults to METRICS_INTERVAL from constants.
+            show_progress (bool, optional): Print progress and ETA on
+                every flush. Defaults to False.
+        """
+        for metrics_format in formats:
+            assert metrics_format in ('prometheus', 'jsonl'), \
+                f"Unknown metrics format: {metrics_format}"
+        self.output_path = output_path
+        self.formats = tuple(formats) if output_path is not None else ()
+        self.interval = interval
+        self.show_progress = show_progress
+        self.start_time = time.time()
+        self.last_flush_time = None
+        self.last_task_time = None
+        self.frames_decoded = 0
+        self.chunks_written = 0
+        self.augmented_chunks_written = 0
+        self.broken_chunks = 0
+        self.chunks_processed = 0
+        self.bytes_written = 0
+        self.tasks_total = 0
+        self.tasks_done = 0
+        self.workers = 1
+        self.planned_classes = OrderedDict()
+        self.written_classes = OrderedDict()
+        self.videos = OrderedDict()
+
+
+    def start_videos(self, statistics, tasks_total, workers):
+        """Registers videos which will be written.
+
+        Args:
+            statistics (dict): Script statistics of every video key
+                from 'get_chunks_stats'
+            tasks_total (int): Number of writing tasks
+            workers (int): Number of worker processes
+        """
+        # Throughput is measured from the start of writing
+        if self.tasks_total == 0:
+            self.start_time = time.time()
+        for key, video_statistics in statistics.items():
+            classes = video_statistics.get('classes', {})
+            self.videos[key] = {
+                'chunks_planned': sum(classes.values()),
+                'chunks_done': 0,
+                'finished': False,
+            }
+            for class_name, chunks_number in classes.items():
+                self.planned_classes[class_name] = \
+                    self.planned_classes.get(class_name, 0) + chunks_number
+        self.tasks_total += tasks_total
+        self.workers = workers
+        self.flush(force=True)
+
+
+    def add_report(self, key, writer_report):
+        """Adds report of the finished writing task of the video.
+
+        Args:
+            key (str): Key of the video in manifest
+            writer_report (OrderedDict): Report of ChunkWriter
+        """
+        self.frames_decoded += writer_report.get('Decoded frames total', 0)
+        self.chunks_written += writer_report['Valid chunks total']
+        self.augmented_chunks_written += writer_report['Augmented chunks total']
+        self.broken_chunks += writer_report['Broken chunks total']
+        self.chunks_processed += writer_report.get('Processed chunks total', 0)
+        self.bytes_written += writer_report.get('Written bytes total', 0)
+        for class_name, chunks_number in writer_report.get('Classes', {}).items():
+            self.written_classes[class_name] = \
+                self.written_classes.get(class_name, 0) + chunks_number
+        video = self.videos.setdefault(
+            key, {'chunks_planned': 0, 'chunks_done': 0, 'finished': False}
+        )
+        # Broken chunks are done too, they are not retried
+        video['chunks_done'] += writer_report.get('Processed chunks total', 0)
+
+
+    def finish_video(self, key):
+        """Marks video as finished.
+
+        Args:
+            key (str): Key of the video in manifest
+        """
+        if key in self.videos:
+            self.videos[key]['finished'] = True
+
+
+    def finish_task(self):
+        """Counts finished writing task and flushes metrics if interval
+        is passed.
+        """
+        self.tasks_done += 1
+        self.last_task_time = time.time()
+        self.flush()
+
+
+    def finish(self):
+        """Flushes final metrics of the run, if they were not flushed
+        after the last task.
+        """
+        flushed_after_last_task = self.last_task_time is None \
+            or self.last_flush_time >= self.last_task_time
+        if not flushed_after_last_task:
+            self.flush(force=True)
+
+
+    def get_metrics(self):
+        """Calculates current metrics.
+
+        Returns:
+            OrderedDict: Counters, rates, queue depths, classes and
+                progress of every video
+        """
+        elapsed_seconds = max(time.time() - self.start_time, 1e-9)
+        chunks_planned = sum(video['chunks_planned'] for video in self.videos.values())
+        chunks_done = sum(
+            min(video['chunks_done'], video['chunks_planned'])
+            for video in self.videos.values()
+        )
+        chunks_per_second = chunks_done / elapsed_seconds
+        tasks_pending = self.tasks_total - self.tasks_done
+        tasks_running = min(self.workers, tasks_pending)
+        metrics = OrderedDict()
+        metrics['timestamp'] = time.time()
+        metrics['elapsed_seconds'] = elapsed_seconds
+        metrics['frames_decoded'] = self.frames_decoded
+        metrics['chunks_written'] = self.chunks_written
+        metrics['augmented_chunks_written'] = self.augmented_chunks_written
+        metrics['broken_chunks'] = self.broken_chunks
+        metrics['bytes_written'] = self.bytes_written
+        metrics['frames_decoded_per_second'] = self.frames_decoded / elapsed_seconds
+        metrics['chunks_written_per_second'] = \
+            (self.chunks_written + self.augmented_chunks_written) / elapsed_seconds
+        metrics['bytes_written_per_second'] = self.bytes_written / elapsed_seconds
+        # Rate of original chunks of script, every output level of
+        # broken chunk is in the list of broken files
+        metrics['broken_chunks_rate'] = \
+            (self.chunks_processed - self.chunks_written) / max(self.chunks_processed, 1)
+        metrics['tasks_total'] = self.tasks_total
+        metrics['tasks_done'] = self.tasks_done
+        metrics['tasks_running'] = tasks_running
+        metrics['tasks_queued'] = tasks_pending - tasks_running
+        metrics['videos_total'] = len(self.videos)
+        metrics['videos_done'] = sum(video['finished'] for video in self.videos.values())
+        metrics['chunks_planned'] = chunks_planned
+        metrics['progress'] = chunks_done / chunks_planned if chunks_planned else 1.0
+        metrics['eta_seconds'] = get_eta(chunks_planned - chunks_done, chunks_per_second)
+        metrics['classes_planned'] = OrderedDict(self.planned_classes)
+        metrics['classes_written'] = OrderedDict(self.written_classes)
+        metrics['videos'] = OrderedDict()
+        for key, video in self.videos.items():
+            chunks_left = max(video['chunks_planned'] - video['chunks_done'], 0)
+            video_metrics = OrderedDict()
+            video_metrics['chunks_planned'] = video['chunks_planned']
+            video_metrics['chunks_done'] = video['chunks_planned'] - chunks_left
+            video_metrics['progress'] = 1.0
+            if video['chunks_planned'] and not video['finished']:
+                video_metrics['progress'] = \
+                    video_metrics['chunks_done'] / video['chunks_planned']
+            # Video shares throughput with other ones, so its ETA is an
+            # estimate at the current throughput of the whole run
+            video_metrics['eta_seconds'] = 0.0 if video['finished'] \
+                else get_eta(chunks_left, chunks_per_second)
+            metrics['videos'][key] = video_metrics
+        return metrics
+
+
+    def flush(self, force=False):
+        """Writes metrics to files and prints progress if interval is
+        passed since the last flush.
+
+        Args:
+            force (bool, optional): Flush regardless of interval.
+                Defaults to False.
+
+        Returns:
+            bool: True if metrics were flushed
+        """
+        now = time.time()
+        interval_passed = self.last_flush_time is None \
+            or (now - self.last_flush_time) >= self.interval
+        if not (force or interval_passed):
+            return False
+        self.last_flush_time = now
+        if not self.formats and not self.show_progress:
+            return False
+        metrics = self.get_metrics()
+        if 'prometheus' in self.formats:
+            write_prometheus_textfile(
+                os.path.join(self.output_path, c.METRICS_PROMETHEUS_FILENAME),
+                metrics
+            )
+        if 'jsonl' in self.formats:
+            with open(os.path.join(self.output_path, c.METRICS_JSONL_FILENAME),
+                      'a', encoding='utf-8') as file:
+                file.write(json.dumps(metrics) + '\n')
+        if self.show_progress:
+            print_progress(metrics)
+        return True
+
+
+
+def get_eta(chunks_left, chunks_per_second):
+    """Estimates remaining time.
+
+    Args:
+        chunks_left (int): Chunks which are not written yet
+        chunks_per_second (float): Current throughput
+
+    Returns:
+        float | None: Seconds. None if throughput is unknown yet
+    """
+    if chunks_left <= 0:
+        return 0.0
+    if chunks_per_second <= 0:
+        return None
+    return chunks_left / chunks_per_second
+
+
+
+def get_prometheus_lines(metrics):
+    """Converts metrics to the Prometheus text exposition format.
+
+    Args:
+        metrics (dict): Metrics from 'GenerationMetrics.get_metrics'
+
+    Returns:
+        list: Lines of the textfile
+    """
+    prefix = c.METRICS_PREFIX
+    lines = []
+
+    def add_metric(name, metric_type, help_text, samples):
+        """Subtask. Adds metric with its samples.
+
+        Args:
+            name (str): Metric name without prefix
+            metric_type (str): 'counter' or 'gauge'
+            help_text (str): Description of the metric
+            samples (list): Tuples (labels dict, value)
+        """
+        lines.append(f"# HELP {prefix}_{name} {help_text}")
+        lines.append(f"# TYPE {prefix}_{name} {metric_type}")
+        for labels, value in samples:
+            labels_text = ','.join(
+                f"{label}={json.dumps(str(label_value))}"
+                for label, label_value in labels.items()
+            )
+            labels_text = f"{{{labels_text}}}" if labels_text else ''
+            value = 'NaN' if value is None else value
+            lines.append(f"{prefix}_{name}{labels_text} {value}")
+
+    counters = (
+        ('frames_decoded', 'Frames decoded from sources'),
+        ('chunks_written', 'Original chunks written'),
+        ('augmented_chunks_written', 'Augmented chunks written'),
+        ('broken_chunks', 'Chunk files removed after failed validation'),
+        ('bytes_written', 'Bytes of written chunks'),
+    )
+    for name, help_text in counters:
+        add_metric(f"{name}_total", 'counter', help_text, [({}, metrics[name])])
+    gauges = (
+        ('frames_decoded_per_second', 'Average decoded frames per second'),
+        ('chunks_written_per_second', 'Average written chunks per second'),
+        ('bytes_written_per_second', 'Average written bytes per second'),
+        ('broken_chunks_rate', 'Share of broken chunks'),
+        ('tasks_queued', 'Writing tasks waiting for worker'),
+        ('tasks_running', 'Writing tasks in progress'),
+        ('tasks_done', 'Finished writing tasks'),
+        ('videos_total', 'Videos in the run'),
+        ('videos_done', 'Finished videos'),
+        ('progress', 'Share of planned chunks which are done'),
+        ('eta_seconds', 'Estimated seconds to the end of the run'),
+    )
+    for name, help_text in gauges:
+        add_metric(name, 'gauge', help_text, [({}, metrics[name])])
+    add_metric('class_chunks_planned', 'gauge', 'Planned chunks of class', [
+        ({'class': class_name}, value)
+        for class_name, value in metrics['classes_planned'].items()
+    ])
+    add_metric('class_chunks_written', 'gauge', 'Written chunks of class', [
+        ({'class': class_name}, value)
+        for class_name, value in metrics['classes_written'].items()
+    ])
+    add_metric('video_progress', 'gauge', 'Share of planned chunks of video which are done', [
+        ({'video': key}, video['progress'])
+        for key, video in metrics['videos'].items()
+    ])
+    add_metric('video_eta_seconds', 'gauge', 'Estimated seconds to the end of video', [
+        ({'video': key}, video['eta_seconds'])
+        for key, video in metrics['videos'].items()
+    ])
+    return lines
+
+
+
+def write_prometheus_textfile(textfile_path, metrics):
+    """Writes metrics to the textfile of Prometheus node exporter. File
+    is replaced atomically, so exporter never reads partial file.
+
+    Args:
+        textfile_path (str): Path to the '.prom' file
+        metrics (dict): Metrics from 'GenerationMetrics.get_metrics'
+    """
+    temp_path = f"{textfile_path}.{c.TEMP_CHUNK_SUFFIX}"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        file.write('\n'.join(get_prometheus_lines(metrics)) + '\n')
+    os.replace(temp_path, textfile_path)
+
+
+
+def format_seconds(seconds):
+    """Formats duration for progress output.
+
+    Args:
+        seconds (float | None): Duration
+
+    Returns:
+        str: 'H:MM:SS' or '?' if duration is unknown
+    """
+    if seconds is None:
+        return '?'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+
+def print_progress(metrics):
+    """Prints overall progress and progress of unfinished videos.
+
+    Args:
+        metrics (dict): Metrics from 'GenerationMetrics.get_metrics'
+    """
+    print(f"PROGRESS: {metrics['progress'] * 100:5.1f}% "
+          f"videos {metrics['videos_done']}/{metrics['videos_total']} "
+          f"tasks queued {metrics['tasks_queued']} running {metrics['tasks_running']} "
+          f"| {metrics['frames_decoded_per_second']:.1f} frames/s "
+          f"{metrics['chunks_written_per_second']:.1f} chunks/s "
+          f"{metrics['bytes_written_per_second'] / 2 ** 20:.2f} MiB/s "
+          f"| broken {metrics['broken_chunks_rate'] * 100:.1f}% "
+          f"| ETA {format_seconds(metrics['eta_seconds'])}")
+    for key, video in metrics['videos'].items():
+        if 0 < video['progress'] < 1:
+            print(f"    {key}: {video['progress'] * 100:5.1f}% "
+                  f"{video['chunks_done']}/{video['chunks_planned']} chunks "
+                  f"| ETA {format_seconds(video['eta_seconds'])}")
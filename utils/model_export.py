@@ -0,0 +1,314 @@
+"""
+Module for export of trained keras models to TFLite (and optionally
+ONNX) with post-training quantization:
+- float32 - plain conversion
+- float16 - weights in float16
+- int8 - weights and activations in int8, ranges are calibrated on a
+    representative sample of the training split. Operations without int8
+    kernels stay in float
+
+Every exported model is benchmarked on CPU against the keras model on
+the test split: latency, throughput, size, accuracy and agreement of
+predicted classes with the keras model.
+"""
+
+import os
+import glob
+import time
+import cv2
+import numpy as np
+
+from collections import OrderedDict
+
+from utils import constants as c
+from utils import tensor_cache
+
+
+
+def load_samples(dataset_path, split, input_shape, classes, limit=None, seed=0):
+    """Reads samples of the split in format of the model input: videos
+    for sequence models, images for image models. RGB uint8.
+
+    Args:
+        dataset_path (str): Path to the dataset with 'train' and 'test'
+        split (str): 'train' or 'test'
+        input_shape (tuple): Input of model without batch dimension
+        classes (list): Class names in order of model outputs
+        limit (int, optional): Random subset of samples. Defaults to
+            None - all samples.
+        seed (int, optional): Seed of subset. Defaults to 0.
+
+    Returns:
+        tuple: Samples array and labels array
+    """
+    is_sequence = len(input_shape) == 4
+    size = (int(input_shape[-2]), int(input_shape[-3]))
+    if is_sequence:
+        files = tensor_cache.get_split_videos(dataset_path, split, classes)
+    else:
+        files = [
+            (path, class_index)
+            for class_index, class_name in enumerate(classes)
+            for path in sorted(glob.glob(os.path.join(dataset_path, split, class_name, '*')))
+            if path.lower().endswith(c.IMAGE_EXTENSIONS)
+        ]
+    if limit is not None and limit < len(files):
+        indexes = np.random.RandomState(seed).choice(len(files), limit, replace=False)
+        files = [files[index] for index in sorted(indexes)]
+    samples = []
+    labels = []
+    for path, class_index in files:
+        if is_sequence:
+            sample = tensor_cache.read_video_frames(path, int(input_shape[0]), size)
+        else:
+            sample = cv2.imread(path)
+            if sample is not None:
+                sample = cv2.cvtColor(cv2.resize(sample, size), cv2.COLOR_BGR2RGB)
+        if sample is not None:
+            samples.append(sample)
+            labels.append(class_index)
+    assert samples, f"No samples of '{split}' in {dataset_path}"
+    return np.stack(samples), np.array(labels)
+
+
+
+def convert_tflite(model, quantization, calibration_samples=None, rescale=1/255.):
+    """Converts keras model to TFLite.
+
+    Args:
+        model (obj): Keras model
+        quantization (str): 'float32', 'float16' or 'int8'
+        calibration_samples (array, optional): uint8 samples for int8
+            calibration. Defaults to None.
+        rescale (float, optional): Scale of samples, same as in
+            training. Defaults to 1/255.
+
+    Returns:
+        bytes: TFLite flatbuffer
+    """
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    # TimeDistributed and LSTM may need TF ops without TFLite kernels
+    converter.target_spec.supported_ops = [
+        tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS
+    ]
+    if quantization == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        assert calibration_samples is not None, "int8 needs calibration samples"
+
+        def representative_dataset():
+            for sample in calibration_samples:
+                yield [sample[np.newaxis].astype('float32') * rescale]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS_INT8,
+            tf.lite.OpsSet.TFLITE_BUILTINS,
+            tf.lite.OpsSet.SELECT_TF_OPS,
+        ]
+    return converter.convert()
+
+
+
+class TFLiteModel:
+    def __init__(self, model_path, threads=None):
+        """Runs TFLite model with batches of any size. Quantized inputs
+        and outputs are converted from and to float.
+
+        Args:
+            model_path (str): Path to .tflite model
+            threads (int, optional): CPU threads. Defaults to None - all.
+        """
+        import tensorflow as tf
+
+        self.interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=threads)
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()[0]
+        self.output_details = self.interpreter.get_output_details()[0]
+        self.batch_size = int(self.input_details['shape'][0])
+
+
+    def predict(self, batch):
+        """Runs inference of the batch.
+
+        Args:
+            batch (array): Float batch
+
+        Returns:
+            array: Float outputs
+        """
+        if len(batch) != self.batch_size:
+            self.interpreter.resize_tensor_input(
+                self.input_details['index'], (len(batch),) + batch.shape[1:]
+            )
+            self.interpreter.allocate_tensors()
+            self.input_details = self.interpreter.get_input_details()[0]
+            self.output_details = self.interpreter.get_output_details()[0]
+            self.batch_size = len(batch)
+        scale, zero_point = self.input_details['quantization']
+        if scale:
+            batch = np.round(batch / scale + zero_point)
+        self.interpreter.set_tensor(
+            self.input_details['index'], batch.astype(self.input_details['dtype'])
+        )
+        self.interpreter.invoke()
+        outputs = self.interpreter.get_tensor(self.output_details['index'])
+        scale, zero_point = self.output_details['quantization']
+        if scale:
+            outputs = (outputs.astype('float32') - zero_point) * scale
+        return outputs
+
+
+
+def convert_onnx(model, output_path):
+    """Converts keras model to ONNX. tf2onnx must be installed
+    separately.
+
+    Args:
+        model (obj): Keras model
+        output_path (str): Path to .onnx model
+    """
+    import tensorflow as tf
+    import tf2onnx
+
+    signature = [tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32, name='input')]
+    tf2onnx.convert.from_keras(model, input_signature=signature,
+                               opset=c.EXPORT_ONNX_OPSET, output_path=output_path)
+
+
+
+class ONNXModel:
+    def __init__(self, model_path):
+        """Runs ONNX model on CPU. onnxruntime must be installed
+        separately.
+
+        Args:
+            model_path (str): Path to .onnx model
+        """
+        import onnxruntime
+
+        self.session = onnxruntime.InferenceSession(
+            model_path, providers=['CPUExecutionProvider']
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+
+    def predict(self, batch):
+        """Runs inference of the batch.
+
+        Args:
+            batch (array): Float batch
+
+        Returns:
+            array: Float outputs
+        """
+        return self.session.run(None, {self.input_name: batch.astype('float32')})[0]
+
+
+
+def predict_all(predict, samples, batch_size, rescale):
+    """Predicts all samples by batches.
+
+    Args:
+        predict (callable): Takes float batch, returns probabilities
+        samples (array): uint8 samples
+        batch_size (int): Batch size
+        rescale (float): Scale of samples
+
+    Returns:
+        array: Probabilities of all samples
+    """
+    outputs = []
+    for start in range(0, len(samples), batch_size):
+        batch = samples[start:start + batch_size].astype('float32') * rescale
+        outputs.append(np.asarray(predict(batch)))
+    return np.concatenate(outputs)
+
+
+
+def measure_predict(predict, samples, batch_size, rescale, runs=c.MODEL_PROFILE_RUNS,
+                    warmup=c.MODEL_PROFILE_WARMUP):
+    """Measures latency of prediction of the batch.
+
+    Args:
+        predict (callable): Takes float batch, returns probabilities
+        samples (array): uint8 samples, the first batch is used
+        batch_size (int): Batch size
+        rescale (float): Scale of samples
+        runs (int, optional): Measured runs. Defaults to
+            MODEL_PROFILE_RUNS from constants.
+        warmup (int, optional): Runs before measuring. Defaults to
+            MODEL_PROFILE_WARMUP from constants.
+
+    Returns:
+        OrderedDict: Mean and p95 latency in ms and samples per second
+    """
+    indexes = np.arange(batch_size) % len(samples)
+    batch = samples[indexes].astype('float32') * rescale
+    for _ in range(warmup):
+        predict(batch)
+    durations = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        predict(batch)
+        durations.append(time.perf_counter() - start_time)
+    latency = OrderedDict()
+    latency['batch_size'] = batch_size
+    latency['mean_ms'] = float(np.mean(durations)) * 1000
+    latency['p95_ms'] = float(np.percentile(durations, 95)) * 1000
+    latency['samples_per_second'] = batch_size / max(float(np.mean(durations)), 1e-9)
+    return latency
+
+
+
+def benchmark_model(name, predict, size_bytes, test_samples, test_labels,
+                    reference_classes, batch_size, rescale):
+    """Benchmarks exported model on the test split.
+
+    Args:
+        name (str): Name of the model in report
+        predict (callable): Takes float batch, returns probabilities
+        size_bytes (int): Size of the model file
+        test_samples (array): uint8 samples of the test split
+        test_labels (array): Labels of the test split
+        reference_classes (array | None): Classes predicted by keras
+            model. None for keras model itself
+        batch_size (int): Batch of throughput measurement
+        rescale (float): Scale of samples
+
+    Returns:
+        tuple: OrderedDict report and predicted classes
+    """
+    predicted = predict_all(predict, test_samples, batch_size, rescale).argmax(axis=1)
+    report = OrderedDict()
+    report['model'] = name
+    report['size_bytes'] = size_bytes
+    report['latency'] = measure_predict(predict, test_samples, 1, rescale)
+    report['throughput'] = measure_predict(predict, test_samples, batch_size, rescale)
+    report['accuracy'] = float(np.mean(predicted == test_labels))
+    if reference_classes is not None:
+        report['agreement'] = float(np.mean(predicted == reference_classes))
+    return report, predicted
+
+
+
+def get_file_size(path):
+    """Returns size of the model file or of all files of the model
+    directory.
+
+    Args:
+        path (str): Path to file or directory
+
+    Returns:
+        int: Bytes
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, file))
+        for root, _, files in os.walk(path) for file in files
+    )
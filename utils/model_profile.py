@@ -0,0 +1,127 @@
+"""
+Module for cost report of keras models, so models can be compared by
+latency budget next to accuracy:
+- number of parameters (all and trainable)
+- FLOPs of one sample, counted by TF profiler on the frozen graph
+- CPU latency of one sample and throughput of batch
+"""
+
+import time
+import numpy as np
+import tensorflow as tf
+
+from collections import OrderedDict
+
+from utils import constants as c
+
+
+
+def count_flops(model, input_shape):
+    """Counts floating point operations of inference of one sample.
+    Multiply-add is counted as 2 operations.
+
+    Args:
+        model (obj): Keras model
+        input_shape (tuple): Shape of one sample
+
+    Returns:
+        int | None: FLOPs. None if graph can not be profiled
+    """
+    from tensorflow.python.framework.convert_to_constants import \
+        convert_variables_to_constants_v2
+
+    try:
+        function = tf.function(lambda inputs: model(inputs, training=False))
+        concrete = function.get_concrete_function(
+            tf.TensorSpec((1,) + tuple(input_shape), tf.float32)
+        )
+        graph = convert_variables_to_constants_v2(concrete).graph
+        options = tf.compat.v1.profiler.ProfileOptionBuilder.float_operation()
+        options['output'] = 'none'
+        profile = tf.compat.v1.profiler.profile(
+            graph=graph, run_meta=tf.compat.v1.RunMetadata(), cmd='op', options=options
+        )
+        return profile.total_float_ops
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+
+def measure_latency(model, input_shape, batch_size=1, runs=c.MODEL_PROFILE_RUNS,
+                    warmup=c.MODEL_PROFILE_WARMUP):
+    """Measures CPU latency of inference of the batch.
+
+    Args:
+        model (obj): Keras model
+        input_shape (tuple): Shape of one sample
+        batch_size (int, optional): Defaults to 1.
+        runs (int, optional): Measured runs. Defaults to
+            MODEL_PROFILE_RUNS from constants.
+        warmup (int, optional): Runs before measuring. Defaults to
+            MODEL_PROFILE_WARMUP from constants.
+
+    Returns:
+        OrderedDict: Mean and p95 latency in ms and samples per second
+    """
+    inputs = tf.constant(
+        np.random.random((batch_size,) + tuple(input_shape)).astype('float32')
+    )
+    with tf.device('/CPU:0'):
+        function = tf.function(lambda batch: model(batch, training=False))
+        for _ in range(warmup):
+            function(inputs)
+        durations = []
+        for _ in range(runs):
+            start_time = time.perf_counter()
+            function(inputs).numpy()
+            durations.append(time.perf_counter() - start_time)
+    latency = OrderedDict()
+    latency['batch_size'] = batch_size
+    latency['mean_ms'] = float(np.mean(durations)) * 1000
+    latency['p95_ms'] = float(np.percentile(durations, 95)) * 1000
+    latency['samples_per_second'] = batch_size / max(float(np.mean(durations)), 1e-9)
+    return latency
+
+
+
+def get_model_report(model, input_shape, name=None, batch_size=c.MODEL_PROFILE_BATCH):
+    """Collects parameters, FLOPs and CPU latency of the model.
+
+    Args:
+        model (obj): Keras model
+        input_shape (tuple): Shape of one sample
+        name (str, optional): Name in report. Defaults to model name.
+        batch_size (int, optional): Batch of throughput measurement.
+            Defaults to MODEL_PROFILE_BATCH from constants.
+
+    Returns:
+        OrderedDict: Report of the model
+    """
+    report = OrderedDict()
+    report['model'] = name or model.name
+    report['input_shape'] = list(input_shape)
+    report['params'] = int(model.count_params())
+    report['trainable_params'] = int(sum(
+        np.prod(weight.shape) for weight in model.trainable_weights
+    ))
+    report['flops'] = count_flops(model, input_shape)
+    report['latency'] = measure_latency(model, input_shape, batch_size=1)
+    report['throughput'] = measure_latency(model, input_shape, batch_size=batch_size)
+    return report
+
+
+
+def print_model_report(report):
+    """Prints one line of the model report.
+
+    Args:
+        report (dict): Report from 'get_model_report'
+    """
+    flops = 'n/a' if report['flops'] is None else f"{report['flops'] / 1e9:8.3f}"
+    accuracy = report.get('accuracy')
+    accuracy = 'n/a' if accuracy is None else f"{accuracy:.3f}"
+    print(f"{report['model']:<16} params: {report['params']:>11,} "
+          f"GFLOPs: {flops} "
+          f"latency: {report['latency']['mean_ms']:8.2f} ms "
+          f"throughput: {report['throughput']['samples_per_second']:8.1f} samples/s "
+          f"accuracy: {accuracy}")
@@ -0,0 +1,384 @@
+"""
+Module for dry-run planning of dataset generation. Runs only annotation
+parsing and track analysis and reports what the job will do:
+- chunks per class and augmented chunks
+- unique frames, total frame reads, seeks and decoded frames, counted
+    for the access pattern of the writer: every read of the own task is
+    positioned, shared decoded stream of several modes of the same source
+    is decoded once in ascending order
+- expected output bytes
+- time estimate from a short decode benchmark of each source
+"""
+
+import os
+import time
+import random
+import cv2
+import numpy as np
+
+from collections import OrderedDict
+
+from utils import constants as c
+from utils import extractor
+from utils import augmentation
+from utils import video_editor
+from utils import scheduler
+from utils import filesystem_tool as fs
+
+
+
+def get_frame_reads(chunks, mode, augmentations=()):
+    """Collects frames which writer reads from the source for every
+    chunk. Difference mode reads only the first and the last frame of
+    the sequence. Strided frames out of the chunk are read with it.
+
+    Args:
+        chunks (tuple): Chunks from script
+        mode (str): 'sequence', 'singleshot' or 'difference'
+        augmentations (iterable, optional): Augmentation names from
+            script settings. Defaults to ().
+
+    Returns:
+        list: Frame numbers in order of reading
+    """
+    frame_reads = []
+    for chunk in chunks:
+        frames = list(chunk['sequence'].keys())
+        if mode == 'difference':
+            frames = [frames[0], frames[-1]]
+        frames += [
+            frame for frame, _ in
+            augmentation.get_extra_frames(chunk, augmentations, mode)
+        ]
+        frame_reads += frames
+    return frame_reads
+
+
+
+def get_stream_reads(frames):
+    """Counts seeks and decoded frames of the shared decoded stream. Frames
+    are decoded in ascending order as in 'video_writer.read_frames': short
+    gaps are decoded with 'grab', long gaps are skipped with seek.
+
+    Args:
+        frames (iterable): Frame numbers needed by all scripts of the
+            source
+
+    Returns:
+        tuple: Number of seeks and number of decoded frames
+    """
+    seeks = 0
+    decoded_frames = 0
+    position = 0
+    for frame in sorted(set(frames)):
+        if frame < position or (frame - position) > c.STREAM_MAX_GRAB_GAP:
+            seeks += 1
+            position = frame
+        decoded_frames += frame - position + 1
+        position = frame + 1
+    return seeks, decoded_frames
+
+
+
+def get_output_bytes(chunks_number, mode, chunk_size, resolutions):
+    """Estimates size of the output dataset. Every written image is an
+    MJPG/JPG frame with compression ratio from constants. Every chunk is
+    written once per output resolution.
+
+    Args:
+        chunks_number (int): Number of chunks in script
+        mode (str): 'sequence', 'singleshot' or 'difference'
+        chunk_size (int): Frames in sequence chunk
+        resolutions (list): Width and heights of output levels in pixels
+
+    Returns:
+        int: Expected bytes
+    """
+    images_in_chunk = chunk_size if mode == 'sequence' else 1
+    output_bytes = 0
+    for resolution in resolutions:
+        image_bytes = resolution[0] * resolution[1] * 3 * c.PLAN_JPEG_COMPRESSION_RATIO
+        chunk_bytes = (images_in_chunk * image_bytes) + c.PLAN_CHUNK_OVERHEAD_BYTES
+        output_bytes += chunks_number * chunk_bytes
+    return int(output_bytes)
+
+
+
+def benchmark_source(source_path, resolutions):
+    """Short benchmark of the source video. Measures cost of sequential
+    decoding, seek with decoding and JPG encoding of the output image
+    with all levels of the output pyramid.
+
+    Args:
+        source_path (str): Path to the source video
+        resolutions (list): Width and heights of output levels in
+            pixels, the largest one first
+
+    Returns:
+        dict: Seconds per decoded frame, per seek and per encoded image
+    """
+    capture = cv2.VideoCapture(source_path)
+    frames_total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    decoded_frames = 0
+    start_time = time.perf_counter()
+    for _ in range(c.PLAN_BENCHMARK_FRAMES):
+        status, image = capture.read()
+        if not status:
+            break
+        decoded_frames += 1
+    decode_time = (time.perf_counter() - start_time) / max(decoded_frames, 1)
+
+    random_generator = random.Random(0)
+    seek_frames = [
+        random_generator.randrange(max(frames_total, 1))
+        for _ in range(c.PLAN_BENCHMARK_SEEKS)
+    ]
+    start_time = time.perf_counter()
+    for frame in seek_frames:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, frame)
+        capture.read()
+    seek_time = (time.perf_counter() - start_time) / max(len(seek_frames), 1)
+    capture.release()
+
+    image = np.zeros((resolutions[0][1], resolutions[0][0], 3), dtype=np.uint8)
+    start_time = time.perf_counter()
+    for _ in range(c.PLAN_BENCHMARK_ENCODES):
+        cv2.imencode('.jpg', image)
+        for resolution in resolutions[1:]:
+            cv2.imencode('.jpg', cv2.resize(image, resolution,
+                                            interpolation=cv2.INTER_AREA))
+    encode_time = (time.perf_counter() - start_time) / c.PLAN_BENCHMARK_ENCODES
+
+    benchmark = {
+        'decode_seconds': decode_time,
+        'seek_seconds': seek_time,
+        'encode_seconds': encode_time,
+    }
+    return benchmark
+
+
+
+def plan_extraction(extraction, script, benchmark=None, stream_reads=None):
+    """Plans one extraction task.
+
+    Args:
+        extraction (obj): ExtractionTask instance
+        script (dict): Script of the extraction
+        benchmark (dict, optional): Benchmark of the source from
+            'benchmark_source'. Defaults to None - time is not
+            estimated.
+        stream_reads (tuple, optional): Seeks and decoded frames of the
+            shared decoded stream recorded by this extraction. Defaults
+            to None - extraction is written by its own tasks, which
+            position capture before every read.
+
+    Returns:
+        OrderedDict: Plan of the video
+    """
+    mode = extraction.mode
+    frame_reads = get_frame_reads(
+        script['chunks'], mode, script['script_settings']['augmentations']
+    )
+    chunks_number = len(script['chunks'])
+    # Augmented chunks are derived from decoded crops, strided frames
+    # out of the chunk are counted in frame reads
+    augmented_chunks_number = sum(
+        len(augmentation.get_chunk_augmentations(
+            chunk, script['script_settings']['augmentations'], mode
+        ))
+        for chunk in script['chunks']
+    )
+    images_number = chunks_number + augmented_chunks_number
+    if mode == 'sequence':
+        images_number *= extraction.chunk_size
+    if stream_reads is None:
+        stream_reads = (len(frame_reads), len(frame_reads))
+
+    plan = OrderedDict()
+    plan['chunks_total'] = chunks_number
+    plan['classes'] = dict(script['statistics'].get('classes', {}))
+    plan['augmented_chunks'] = augmented_chunks_number
+    plan['unique_frames'] = len(set(frame_reads))
+    plan['frame_reads'] = len(frame_reads)
+    plan['seeks'], plan['decoded_frames'] = stream_reads
+    plan['output_bytes'] = get_output_bytes(
+        chunks_number + augmented_chunks_number,
+        mode,
+        extraction.chunk_size,
+        script['script_settings']['resolutions']
+    )
+    plan['estimated_seconds'] = None
+    if benchmark is not None:
+        # Seek cost includes decoding of the frame after positioning
+        plan['estimated_seconds'] = (
+            plan['seeks'] * benchmark['seek_seconds']
+            + (plan['decoded_frames'] - plan['seeks']) * benchmark['decode_seconds']
+            + images_number * benchmark['encode_seconds']
+        )
+    return plan
+
+
+
+def plan_dataset(video_path, variants, allow_class_mixing, logger,
+                 run_benchmark=True, class_balance=None, resolutions=None,
+                 max_memory=None):
+    """Runs planning for every supported video in directory. Does not
+    create any output. If class balancing is enabled - plans are made
+    for balanced scripts of every variant.
+
+    Extractions of several variants of the same source are planned with
+    the shared decoded stream, if it fits the memory budget as in the
+    scheduler. Seeks and decoded frames of the stream are recorded by the
+    first variant, as the writer does.
+
+    Args:
+        video_path (str): Path to the video files and annotation
+            directory
+        variants (list): Tuples (variant name, mode, script settings)
+            as in dataset generator. Name is None for the single mode
+        allow_class_mixing (bool): Allow frames with mixed signals
+        logger (obj): logging class object
+        run_benchmark (bool, optional): Benchmark sources to estimate
+            time. Defaults to True.
+        class_balance (dict, optional): Class balancing settings.
+            Defaults to None - settings from constants.
+        resolutions (list, optional): Output resolutions. Defaults to
+            None - resolutions from constants.
+        max_memory (int, optional): Memory budget of shared stream in
+            bytes. Defaults to None - MAX_MEMORY from constants.
+
+    Returns:
+        OrderedDict: Plans per video ('{variant}/{video}' for variants)
+            and 'total' record
+    """
+    if class_balance is None:
+        class_balance = video_editor.get_class_balance_settings()
+    if max_memory is None:
+        max_memory = c.MAX_MEMORY
+    extractions = OrderedDict()
+    plans = OrderedDict()
+    supported_files = fs.extract_video_from_path(video_path)
+    for file, annotation in supported_files.items():
+        annotation_data = None
+        for variant_name, variant_mode, script_overrides in variants:
+            extraction = extractor.ExtractionTask(
+                video_path,
+                None,
+                file,
+                annotation,
+                False,
+                variant_mode,
+                logger,
+                allow_class_mixing
+            )
+            extraction.class_balance = class_balance
+            extraction.variant = variant_name
+            if resolutions is not None:
+                extraction.resolutions = resolutions
+            if script_overrides is not None:
+                for setting, value in script_overrides.items():
+                    setattr(extraction, setting, value)
+            extraction.read_annotation(annotation_data)
+            annotation_data = \
+                (extraction.annotation_meta, extraction.annotation_tracks)
+            if fs.supported_labels_check(extraction):
+                extraction.script = video_editor.get_script(extraction)
+                key = file if variant_name is None else f"{variant_name}/{file}"
+                extractions[key] = extraction
+    if class_balance['enabled'] and extractions:
+        # Classes of different variants are not comparable
+        for variant_name, _, _ in variants:
+            video_editor.balance_scripts(
+                {key: extraction.script for key, extraction in extractions.items()
+                 if extraction.variant == variant_name},
+                class_balance
+            )
+    sources = OrderedDict()
+    for key, extraction in extractions.items():
+        sources.setdefault(extraction.source_path, []).append((key, extraction))
+    for source_path, source_extractions in sources.items():
+        written_extractions = [
+            extraction for _, extraction in source_extractions
+            if len(extraction.script['chunks']) > 0
+        ]
+        benchmark = None
+        if run_benchmark and written_extractions:
+            benchmark = benchmark_source(
+                source_path,
+                written_extractions[0].script['script_settings']['resolutions']
+            )
+        stream_reads = {}
+        if scheduler.get_shared_stream_memory(written_extractions, max_memory) is not None:
+            frames = set()
+            for extraction in written_extractions:
+                frames.update(get_frame_reads(
+                    extraction.script['chunks'],
+                    extraction.mode,
+                    extraction.script['script_settings']['augmentations']
+                ))
+            for extraction in written_extractions:
+                stream_reads[id(extraction)] = (0, 0)
+            stream_reads[id(written_extractions[0])] = get_stream_reads(frames)
+        for key, extraction in source_extractions:
+            plans[key] = plan_extraction(
+                extraction,
+                extraction.script,
+                benchmark,
+                stream_reads.get(id(extraction))
+            )
+    plans['total'] = get_total_plan(plans.values())
+    return plans
+
+
+
+def get_total_plan(plans):
+    """Sums plans of all videos.
+
+    Args:
+        plans (iterable): Plans of videos
+
+    Returns:
+        OrderedDict: Total plan
+    """
+    total = OrderedDict()
+    total['chunks_total'] = 0
+    total['classes'] = {}
+    total['augmented_chunks'] = 0
+    total['unique_frames'] = 0
+    total['frame_reads'] = 0
+    total['seeks'] = 0
+    total['decoded_frames'] = 0
+    total['output_bytes'] = 0
+    total['estimated_seconds'] = 0.0
+    for plan in plans:
+        for key in ('chunks_total', 'augmented_chunks', 'unique_frames',
+                    'frame_reads', 'seeks', 'decoded_frames', 'output_bytes'):
+            total[key] += plan[key]
+        for class_name, chunks_number in plan['classes'].items():
+            total['classes'][class_name] = \
+                total['classes'].get(class_name, 0) + chunks_number
+        if plan['estimated_seconds'] is not None:
+            total['estimated_seconds'] += plan['estimated_seconds']
+    return total
+
+
+
+def print_plan(plans):
+    """Prints plans in human readable format.
+
+    Args:
+        plans (OrderedDict): Plans from 'plan_dataset'
+    """
+    for name, plan in plans.items():
+        print(f"{name}:")
+        print(f"  chunks: {plan['chunks_total']}")
+        for class_name, chunks_number in plan['classes'].items():
+            print(f"    {class_name}: {chunks_number}")
+        print(f"  augmented chunks: {plan['augmented_chunks']}")
+        print(f"  unique frames to decode: {plan['unique_frames']}")
+        print(f"  total frame reads: {plan['frame_reads']}")
+        print(f"  estimated seeks: {plan['seeks']}")
+        print(f"  decoded frames: {plan['decoded_frames']}")
+        print(f"  expected output: {plan['output_bytes'] / 1024 ** 2:.1f} MB")
+        if plan['estimated_seconds'] is not None:
+            print(f"  estimated time: {plan['estimated_seconds']:.1f} s")
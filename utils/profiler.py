@@ -0,0 +1,373 @@
+"""
+Module for stage-level profiling of dataset generation. Every stage of
+the pipeline is measured with 'stage' context manager of the active
+profiler of the process:
+- zip_read, xml_parse - annotation reading
+- track_analyzer, generate_sequences - script planning
+- seek, decode - reading of the source
+- crop_resize, alignment, augmentation, encode, validate - writing
+- filesystem - creation, renaming and removing of files
+
+Timings are collected per video, also in worker processes, and written
+to the JSON report next to the dataset with counts, total and max time
+and p50/p95/p99 of every stage. Stage keeps running count, total and max
+and a fixed reservoir of durations for percentiles, so memory of the
+profiler does not grow with the number of frames.
+
+Peak of python allocations is measured for every stage if tracemalloc
+is started. Resident memory of the process is sampled once per written
+chunk and once per planned video ('sample_memory') and is assigned to
+the stages run since the previous sample. Report shows the peaks by
+stage.
+"""
+
+import os
+import json
+import time
+import random
+import contextlib
+import tracemalloc
+import numpy as np
+
+from collections import OrderedDict
+
+from utils import constants as c
+from utils import memory
+
+
+# Active profiler of the current process
+active_profiler = None
+
+
+
+class StageProfiler:
+    def __init__(self, timings=None, memory_peaks=None):
+        """Collector of stage durations and memory peaks.
+
+        Args:
+            timings (dict, optional): Durations of stages from
+                'get_timings' of another profiler. Defaults to None.
+            memory_peaks (dict, optional): Memory peaks of stages from
+                'get_memory_peaks' of another profiler. Defaults to
+                None.
+        """
+        self.timings = OrderedDict()
+        self.memory_peaks = OrderedDict()
+        # Stages run since the last sample of resident memory
+        self.unsampled_stages = set()
+        self.random = random.Random(0)
+        if timings is not None:
+            self.merge(timings)
+        if memory_peaks is not None:
+            self.merge_memory_peaks(memory_peaks)
+
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Measures duration of the code block as the stage.
+
+        Args:
+            name (str): Name of the stage
+        """
+        is_tracing = tracemalloc.is_tracing()
+        if is_tracing:
+            tracemalloc.reset_peak()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start_time)
+            if c.ENABLE_MEMORY_SAMPLING:
+                traced_bytes = tracemalloc.get_traced_memory()[1] if is_tracing else None
+                self.add_memory(name, None, traced_bytes)
+                self.unsampled_stages.add(name)
+
+
+    def add(self, name, seconds):
+        """Adds measured duration of the stage. Duration replaces random
+        record of the full reservoir with probability of reservoir
+        sampling.
+
+        Args:
+            name (str): Name of the stage
+            seconds (float): Duration
+        """
+        stage_timings = self.timings.get(name)
+        if stage_timings is None:
+            stage_timings = self.timings[name] = {
+                'count': 0, 'total_seconds': 0., 'max_seconds': 0., 'samples': []
+            }
+        stage_timings['count'] += 1
+        stage_timings['total_seconds'] += seconds
+        stage_timings['max_seconds'] = max(stage_timings['max_seconds'], seconds)
+        samples = stage_timings['samples']
+        if len(samples) < c.PROFILER_RESERVOIR_SIZE:
+            samples.append(seconds)
+        else:
+            index = self.random.randrange(stage_timings['count'])
+            if index < c.PROFILER_RESERVOIR_SIZE:
+                samples[index] = seconds
+
+
+    def sample_memory(self):
+        """Samples resident memory of the process for stages run since
+        the previous sample.
+        """
+        if not self.unsampled_stages:
+            return
+        rss_bytes = memory.get_rss_bytes()
+        for name in self.unsampled_stages:
+            self.add_memory(name, rss_bytes)
+        self.unsampled_stages.clear()
+
+
+    def add_memory(self, name, rss_bytes, traced_bytes=None):
+        """Updates memory peaks of the stage.
+
+        Args:
+            name (str): Name of the stage
+            rss_bytes (int | None): Resident memory of the process
+            traced_bytes (int | None, optional): Peak of python
+                allocations during the stage. Defaults to None.
+        """
+        peaks = self.memory_peaks.setdefault(
+            name, {'rss_peak_bytes': None, 'traced_peak_bytes': None}
+        )
+        for key, value in (('rss_peak_bytes', rss_bytes),
+                           ('traced_peak_bytes', traced_bytes)):
+            if value is not None:
+                peaks[key] = value if peaks[key] is None else max(peaks[key], value)
+
+
+    def merge(self, timings):
+        """Adds durations from another profiler. Reservoirs are merged
+        proportionally to the counts of durations they represent.
+
+        Args:
+            timings (dict): Durations of stages from 'get_timings'
+        """
+        for name, other in timings.items():
+            stage_timings = self.timings.get(name)
+            if stage_timings is None:
+                self.timings[name] = {
+                    key: list(value) if key == 'samples' else value
+                    for key, value in other.items()
+                }
+                continue
+            count = stage_timings['count'] + other['count']
+            samples = stage_timings['samples'] + other['samples']
+            if len(samples) > c.PROFILER_RESERVOIR_SIZE:
+                own_quota = round(
+                    c.PROFILER_RESERVOIR_SIZE * stage_timings['count'] / count
+                )
+                own_quota = min(own_quota, len(stage_timings['samples']))
+                other_quota = min(c.PROFILER_RESERVOIR_SIZE - own_quota, len(other['samples']))
+                samples = self.random.sample(stage_timings['samples'], own_quota) \
+                    + self.random.sample(other['samples'], other_quota)
+            stage_timings['count'] = count
+            stage_timings['total_seconds'] += other['total_seconds']
+            stage_timings['max_seconds'] = max(stage_timings['max_seconds'], other['max_seconds'])
+            stage_timings['samples'] = samples
+
+
+    def merge_memory_peaks(self, memory_peaks):
+        """Adds memory peaks from another profiler.
+
+        Args:
+            memory_peaks (dict): Peaks of stages from 'get_memory_peaks'
+        """
+        for name, peaks in memory_peaks.items():
+            self.add_memory(name, peaks['rss_peak_bytes'], peaks['traced_peak_bytes'])
+
+
+    def get_timings(self):
+        """Returns running statistics and reservoirs of durations of
+        stages. Used to pass timings from worker processes.
+
+        Returns:
+            dict: Count, total and max seconds and sampled durations of
+                every stage
+        """
+        return {
+            name: {key: list(value) if key == 'samples' else value
+                   for key, value in stage_timings.items()}
+            for name, stage_timings in self.timings.items()
+        }
+
+
+    def get_memory_peaks(self):
+        """Returns memory peaks of stages. Used to pass peaks from
+        worker processes. Stages run since the last sample are sampled.
+
+        Returns:
+            dict: Resident and traced peak bytes of every stage
+        """
+        self.sample_memory()
+        return {name: dict(peaks) for name, peaks in self.memory_peaks.items()}
+
+
+    def get_stats(self):
+        """Calculates statistics of every stage.
+
+        Returns:
+            OrderedDict: Count, total, mean, max and p50/p95/p99 seconds
+                and memory peaks of every stage
+        """
+        self.sample_memory()
+        stats = OrderedDict()
+        for name, stage_timings in self.timings.items():
+            percentiles = np.percentile(stage_timings['samples'], c.PROFILER_PERCENTILES)
+            stage_stats = OrderedDict()
+            stage_stats['count'] = stage_timings['count']
+            stage_stats['total_seconds'] = float(stage_timings['total_seconds'])
+            stage_stats['mean_seconds'] = \
+                float(stage_timings['total_seconds'] / stage_timings['count'])
+            stage_stats['max_seconds'] = float(stage_timings['max_seconds'])
+            for percentile, value in zip(c.PROFILER_PERCENTILES, percentiles):
+                stage_stats[f"p{percentile}_seconds"] = float(value)
+            stage_stats.update(self.memory_peaks.get(name, {}))
+            stats[name] = stage_stats
+        return stats
+
+
+
+def set_profiler(profiler):
+    """Sets active profiler of the process.
+
+    Args:
+        profiler (obj | None): StageProfiler instance. None disables
+            profiling
+
+    Returns:
+        obj | None: Previous active profiler
+    """
+    global active_profiler
+    previous_profiler = active_profiler
+    active_profiler = profiler
+    return previous_profiler
+
+
+
+def stage(name):
+    """Measures code block as the stage of the active profiler. Does
+    nothing if there is no active profiler.
+
+    Args:
+        name (str): Name of the stage
+
+    Returns:
+        obj: Context manager
+    """
+    if active_profiler is None:
+        return contextlib.nullcontext()
+    return active_profiler.stage(name)
+
+
+
+def sample_memory():
+    """Samples resident memory for the stages of the active profiler.
+    Does nothing if there is no active profiler.
+    """
+    if active_profiler is not None:
+        active_profiler.sample_memory()
+
+
+
+@contextlib.contextmanager
+def collect(profiler):
+    """Activates profiler for the code block and restores previous one
+    after it.
+
+    Args:
+        profiler (obj | None): StageProfiler instance
+    """
+    previous_profiler = set_profiler(profiler)
+    try:
+        yield profiler
+    finally:
+        set_profiler(previous_profiler)
+
+
+
+def get_new_profiler():
+    """Creates profiler if stage profiling is enabled.
+
+    Returns:
+        obj | None: StageProfiler instance or None
+    """
+    if c.ENABLE_STAGE_PROFILER:
+        return StageProfiler()
+    return None
+
+
+
+def write_report(output_path, video_profilers, wall_seconds, settings=None):
+    """Writes JSON report with stage statistics of every video and of
+    the whole generation.
+
+    Args:
+        output_path (str): Path to the dataset directory
+        video_profilers (dict): StageProfiler of every video key
+        wall_seconds (float): Duration of the whole generation
+        settings (dict, optional): Run settings to add to the report.
+            Defaults to None.
+
+    Returns:
+        str: Path to the report
+    """
+    overall = StageProfiler()
+    for video_profiler in video_profilers.values():
+        overall.merge(video_profiler.get_timings())
+        overall.merge_memory_peaks(video_profiler.get_memory_peaks())
+    report = OrderedDict()
+    report['created'] = time.time()
+    report['wall_seconds'] = wall_seconds
+    report['settings'] = settings or {}
+    report['memory'] = OrderedDict()
+    report['memory']['main_rss_peak_bytes'] = memory.get_peak_rss_bytes()
+    report['memory']['worker_rss_peak_bytes'] = memory.get_peak_rss_bytes(children=True)
+    report['overall'] = overall.get_stats()
+    report['videos'] = OrderedDict(
+        (video, video_profiler.get_stats())
+        for video, video_profiler in video_profilers.items()
+    )
+    report_path = os.path.join(output_path, c.PROFILER_REPORT_FILENAME)
+    with open(report_path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=4, default=str)
+    return report_path
+
+
+
+def run_with_capture(profiler_name, output_path, function, *args, **kwargs):
+    """Runs function under cProfile or pyinstrument and saves capture to
+    the dataset directory. Only the main process is captured.
+
+    Args:
+        profiler_name (str): 'cprofile' or 'pyinstrument'
+        output_path (str): Path to the dataset directory
+        function (callable): Function to run
+
+    Returns:
+        str: Path to the capture file
+    """
+    if profiler_name == 'cprofile':
+        import cProfile
+        capture = cProfile.Profile()
+        capture.runcall(function, *args, **kwargs)
+        capture_path = os.path.join(output_path, c.PROFILER_CPROFILE_FILENAME)
+        capture.dump_stats(capture_path)
+    elif profiler_name == 'pyinstrument':
+        # Optional dependency, is needed only for this capture
+        from pyinstrument import Profiler
+        capture = Profiler()
+        capture.start()
+        try:
+            function(*args, **kwargs)
+        finally:
+            capture.stop()
+        capture_path = os.path.join(output_path, c.PROFILER_PYINSTRUMENT_FILENAME)
+        with open(capture_path, 'w', encoding='utf-8') as file:
+            file.write(capture.output_html())
+    else:
+        raise ValueError(f"Unknown profiler: {profiler_name}")
+    return capture_path
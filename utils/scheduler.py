@@ -0,0 +1,428 @@
+"""
+Scheduler of chunk writing tasks. Videos are ordered by predicted cost
+and dispatched longest first. Large videos are split into sub-tasks, so
+idle workers take the rest of the big video from the shared queue
+instead of waiting for one worker to finish it.
+
+With memory budget tasks are submitted to workers only while their
+estimated memory fits the budget, so parallelism is throttled instead
+of running out of memory.
+"""
+
+import tracemalloc
+import concurrent.futures
+
+from collections import OrderedDict
+
+from utils import constants as c
+from utils import logging_tool
+from utils import video_editor
+from utils import profiler
+from utils import memory
+from utils import video_writer
+
+
+
+def get_video_cost(extraction):
+    """Predicts cost of writing chunks of the video. Cost is based on
+    number of frames writer reads for all chunks from the script and
+    number of annotated boxes of all tracks.
+
+    Args:
+        extraction (obj): ExtractionTask instance with script
+
+    Returns:
+        float: Predicted cost in conventional units
+    """
+    boxes_number = sum(extraction.info['tracks_size'].values())
+    frame_reads = sum(len(chunk['sequence']) for chunk in extraction.script['chunks'])
+    cost = (boxes_number * c.SCHEDULER_BOX_COST) \
+        + (frame_reads * c.SCHEDULER_FRAME_READ_COST)
+    return cost
+
+
+
+def init_worker(log_settings, trace_memory):
+    """Initializer of worker processes. Connects logger of the worker
+    to the main process and starts tracing of memory.
+
+    Args:
+        log_settings (tuple): Arguments of 'logging_tool.init_worker'
+        trace_memory (bool): Start tracemalloc in worker
+    """
+    logging_tool.init_worker(*log_settings)
+    memory.start_tracing(trace_memory)
+
+
+
+def get_pool_settings():
+    """Returns initializer of process pool. Workers trace memory if
+    the main process does.
+
+    Returns:
+        dict: 'initializer' and 'initargs' for ProcessPoolExecutor
+    """
+    return {
+        'initializer': init_worker,
+        'initargs': (
+            logging_tool.get_pool_settings()['initargs'],
+            tracemalloc.is_tracing(),
+        ),
+    }
+
+
+
+def run_in_pool(function, items, workers, on_done, estimates=None,
+                max_memory=None, interval=None, on_wait=None):
+    """Runs function for every item in the process pool. Items are
+    submitted in the given order while number of running items is less
+    than number of workers and their estimated memory fits the budget.
+
+    Args:
+        function (callable): Function of one item. Must be picklable
+        items (list): Arguments of function
+        workers (int): Number of worker processes
+        on_done (callable): Callback with (item index, result) in the
+            main process
+        estimates (list, optional): Estimated memory of every item in
+            bytes. Defaults to None - memory is not limited.
+        max_memory (int, optional): Budget in bytes. Defaults to None.
+        interval (float, optional): Seconds between calls of 'on_wait'
+            while workers are busy. Defaults to None.
+        on_wait (callable, optional): Callback without arguments.
+            Defaults to None.
+    """
+    if estimates is None:
+        estimates = [0] * len(items)
+    next_index = 0
+    running = {}
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, **get_pool_settings()) as executor:
+        while next_index < len(items) or running:
+            while next_index < len(items) and len(running) < workers and \
+                    memory.fits_budget(max_memory,
+                                       sum(estimates[index] for index in running.values()),
+                                       estimates[next_index],
+                                       len(running)):
+                future = executor.submit(function, items[next_index])
+                running[future] = next_index
+                next_index += 1
+            done, _ = concurrent.futures.wait(
+                running,
+                timeout=interval,
+                return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                on_done(running.pop(future), future.result())
+            if on_wait is not None:
+                on_wait()
+
+
+
+def plan_script(extraction):
+    """Creates script of extraction. Runs in worker process, so stage
+    timings and memory peaks are returned with script.
+
+    Args:
+        extraction (obj): ExtractionTask instance with annotation
+
+    Returns:
+        tuple: (script, stage timings, stage memory peaks)
+    """
+    script_profiler = profiler.get_new_profiler()
+    with profiler.collect(script_profiler):
+        script = video_editor.get_script(extraction)
+    if script_profiler is None:
+        return script, {}, {}
+    return script, script_profiler.get_timings(), script_profiler.get_memory_peaks()
+
+
+
+def plan_scripts(extractions, workers, max_memory=None):
+    """Creates scripts of extractions. With several workers track
+    analysis of all extractions runs in the process pool.
+
+    Args:
+        extractions (list): ExtractionTask instances with annotation
+        workers (int): Number of worker processes
+        max_memory (int, optional): Memory budget in bytes. Defaults to
+            None - unlimited.
+
+    Returns:
+        list: Tuples (script, stage timings, stage memory peaks) in
+            order of extractions
+    """
+    if workers <= 1 or len(extractions) <= 1:
+        return [plan_script(extraction) for extraction in extractions]
+    results = [None] * len(extractions)
+
+    def collect_script(index, result):
+        """Subtask. Stores script of the extraction.
+
+        Args:
+            index (int): Index of extraction
+            result (tuple): Result of 'plan_script'
+        """
+        results[index] = result
+
+    run_in_pool(
+        plan_script,
+        extractions,
+        workers,
+        collect_script,
+        [memory.get_plan_memory(extraction) for extraction in extractions],
+        max_memory
+    )
+    return results
+
+
+
+def split_script(script, max_chunks):
+    """Splits script to several scripts with limited number of chunks.
+    Every part keeps offset of its first chunk, so chunk numbers in file
+    names are the same as without splitting.
+
+    Args:
+        script (dict): Script from video editor
+        max_chunks (int): Maximum number of chunks in one part
+
+    Returns:
+        list: Tuples (chunk_offset, script_part)
+    """
+    parts = []
+    chunks = script['chunks']
+    for chunk_offset in range(0, len(chunks), max_chunks):
+        script_part = dict(script)
+        script_part['chunks'] = chunks[chunk_offset:chunk_offset + max_chunks]
+        parts.append((chunk_offset, script_part))
+    return parts
+
+
+
+def get_shared_stream_memory(extractions, max_memory=None):
+    """Estimates memory of the shared decoded stream of extractions of
+    the same source. Stream is used for several extractions, if it fits
+    the memory budget.
+
+    Args:
+        extractions (list): ExtractionTask instances with scripts
+        max_memory (int, optional): Memory budget in bytes. Defaults to
+            None - unlimited.
+
+    Returns:
+        int | None: Bytes. None if every extraction is written by its
+            own tasks
+    """
+    if len(extractions) < 2:
+        return None
+    shared_stream_memory = memory.get_write_memory(extractions, True)
+    if max_memory is not None and shared_stream_memory > max_memory:
+        return None
+    return shared_stream_memory
+
+
+
+def get_tasks(extractions, max_memory=None):
+    """Creates writing tasks from extractions and sorts them from the
+    longest to the shortest one. Extractions of the same source (e.g.
+    several generator modes) are written by one task with the shared
+    decoded stream, so the source is decoded once. If the shared stream
+    does not fit the memory budget, every extraction is written by its
+    own tasks.
+
+    Args:
+        extractions (list): ExtractionTask instances with scripts
+        max_memory (int, optional): Memory budget in bytes. Defaults to
+            None - unlimited.
+
+    Returns:
+        list: Task dicts ordered by cost with estimated memory
+    """
+    sources = OrderedDict()
+    for extraction in extractions:
+        sources.setdefault(extraction.source_path, []).append(extraction)
+    tasks = []
+    for source, source_extractions in sources.items():
+        shared_stream_memory = get_shared_stream_memory(source_extractions, max_memory)
+        if shared_stream_memory is not None:
+            tasks.append({
+                'source':source,
+                'parts':[
+                    {
+                        'key':extraction.build_key,
+                        'output':extraction.output_path,
+                        'script':extraction.script,
+                        'chunk_offset':0,
+                    }
+                    for extraction in source_extractions
+                ],
+                'cost':sum(get_video_cost(extraction)
+                           for extraction in source_extractions),
+                'memory':shared_stream_memory,
+            })
+            continue
+        for extraction in source_extractions:
+            video_cost = get_video_cost(extraction)
+            video_memory = memory.get_write_memory([extraction], False)
+            chunks_number = len(extraction.script['chunks'])
+            for chunk_offset, script_part in \
+                    split_script(extraction.script, c.SCHEDULER_MAX_CHUNKS_PER_TASK):
+                tasks.append({
+                    'source':source,
+                    'parts':[{
+                        'key':extraction.build_key,
+                        'output':extraction.output_path,
+                        'script':script_part,
+                        'chunk_offset':chunk_offset,
+                    }],
+                    'cost':video_cost * len(script_part['chunks']) / chunks_number,
+                    'memory':video_memory,
+                })
+    tasks.sort(key=lambda task: (
+        -task['cost'],
+        task['parts'][0]['key'],
+        task['parts'][0]['chunk_offset'],
+    ))
+    return tasks
+
+
+
+def write_task(task, logger=None):
+    """Writes chunks of the task. Runs in worker process, so logger of
+    the worker is used, if it is not passed. Worker logger sends records
+    to the listener of the main process.
+
+    Args:
+        task (dict): Task from 'get_tasks'
+        logger (obj, optional): logging class object. Defaults to None.
+
+    Returns:
+        list: Tuples (part key, writer report)
+    """
+    if logger is None:
+        logger = logging_tool.get_logger()
+    if len(task['parts']) > 1:
+        return video_writer.start_writing_shared_stream(
+            source=task['source'],
+            parts=task['parts'],
+            logger=logger,
+        )
+    part = task['parts'][0]
+    writer_report = video_writer.start_writing_video_chunks(
+        source=task['source'],
+        output=part['output'],
+        script=part['script'],
+        logger=logger,
+        chunk_offset=part['chunk_offset'],
+    )
+    return [(part['key'], writer_report)]
+
+
+
+def merge_reports(reports):
+    """Merges reports of sub-tasks of one video.
+
+    Args:
+        reports (list): Writer reports
+
+    Returns:
+        OrderedDict: Writer report of the video
+    """
+    report = OrderedDict()
+    report['Valid chunks total'] = 0
+    report['Augmented chunks total'] = 0
+    report['Broken chunks total'] = 0
+    report['Processed chunks total'] = 0
+    report['Decoded frames total'] = 0
+    report['Written bytes total'] = 0
+    report['Classes'] = OrderedDict()
+    report['Broken chunks list'] = []
+    report['Written chunks list'] = []
+    stage_profiler = profiler.StageProfiler()
+    for task_report in reports:
+        report['Valid chunks total'] += task_report['Valid chunks total']
+        report['Augmented chunks total'] += task_report['Augmented chunks total']
+        report['Broken chunks total'] += task_report['Broken chunks total']
+        report['Processed chunks total'] += task_report['Processed chunks total']
+        report['Decoded frames total'] += task_report['Decoded frames total']
+        report['Written bytes total'] += task_report['Written bytes total']
+        for class_name, chunks_number in task_report['Classes'].items():
+            report['Classes'][class_name] = \
+                report['Classes'].get(class_name, 0) + chunks_number
+        report['Broken chunks list'] += task_report['Broken chunks list']
+        report['Written chunks list'] += task_report['Written chunks list']
+        stage_profiler.merge(task_report['Stage timings'])
+        stage_profiler.merge_memory_peaks(task_report['Stage memory'])
+    report['Stage timings'] = stage_profiler.get_timings()
+    report['Stage memory'] = stage_profiler.get_memory_peaks()
+    return report
+
+
+
+def run_tasks(tasks, workers, on_video_done, logger=None, metrics=None,
+              max_memory=None, on_task_done=None):
+    """Runs tasks in the given order. With several workers tasks are
+    submitted to the process pool longest first and every idle worker
+    takes the next task from the shared queue. Callback is called in the
+    main process when all sub-tasks of the video are finished.
+
+    Reports of finished sub-tasks are added to live metrics, which are
+    flushed also while workers are busy. With memory budget the next task
+    waits until estimated memory of running tasks allows to start it.
+
+    Args:
+        tasks (list): Tasks from 'get_tasks'
+        workers (int): Number of worker processes
+        on_video_done (callable): Callback with (video key,
+            writer_report)
+        logger (obj, optional): logging class object for the serial
+            mode. Defaults to None.
+        metrics (obj, optional): GenerationMetrics instance. Defaults
+            to None.
+        max_memory (int, optional): Memory budget in bytes. Defaults to
+            None - unlimited.
+        on_task_done (callable, optional): Callback with (video key,
+            writer_report) of every finished sub-task. Defaults to None.
+    """
+    tasks_left = OrderedDict()
+    for task in tasks:
+        for part in task['parts']:
+            tasks_left[part['key']] = tasks_left.get(part['key'], 0) + 1
+    video_reports = {video: [] for video in tasks_left}
+
+    def collect_reports(task_reports):
+        """Subtask. Collects reports and finishes video if it was the
+        last sub-task.
+
+        Args:
+            task_reports (list): Tuples (video key, writer report)
+        """
+        for video, writer_report in task_reports:
+            video_reports[video].append(writer_report)
+            tasks_left[video] -= 1
+            if on_task_done is not None:
+                on_task_done(video, writer_report)
+            if metrics is not None:
+                metrics.add_report(video, writer_report)
+            if tasks_left[video] == 0:
+                on_video_done(video, merge_reports(video_reports.pop(video)))
+                if metrics is not None:
+                    metrics.finish_video(video)
+        if metrics is not None:
+            metrics.finish_task()
+
+    if workers <= 1:
+        for task in tasks:
+            collect_reports(write_task(task, logger))
+        return
+
+    run_in_pool(
+        write_task,
+        tasks,
+        workers,
+        lambda index, task_reports: collect_reports(task_reports),
+        [task['memory'] for task in tasks],
+        max_memory,
+        interval=metrics.interval if metrics is not None else None,
+        on_wait=metrics.flush if metrics is not None else None
+    )
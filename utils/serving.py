@@ -0,0 +1,451 @@
+"""
+Module for local inference service of trained models with dynamic
+micro-batching:
+- clients send crops of the track (one for image model, CHUNK_SIZE for
+    sequence model) to 'POST /predict' as base64 encoded images
+- crops are prepared by the same letterbox as in ChunkWriter
+- requests are gathered to micro-batch until it is full or until the
+    first request waited 'max_latency' seconds
+- batches are run by one model instance in the service thread or by
+    model instances of worker processes
+- latency histograms and batch sizes are exposed by 'GET /metrics' in
+    Prometheus text format
+
+Request: {"track": 7, "frames": ["<base64 jpeg>", ...]}
+Response: {"track": 7, "class": "brake_activation",
+           "probabilities": {"brake_activation": 0.91, ...},
+           "batch_size": 12, "latency_ms": 8.4}
+"""
+
+import json
+import time
+import queue
+import base64
+import threading
+import concurrent.futures
+import cv2
+import numpy as np
+
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils import constants as c
+from utils import video_writer
+
+
+# Model of the worker process
+worker_model = None
+
+
+
+def load_model(model_path):
+    """Loads keras model or TFLite model (.tflite).
+
+    Args:
+        model_path (str): Path to the model
+
+    Returns:
+        tuple: Prediction function, input shape without batch dimension
+            and number of outputs
+    """
+    if model_path.lower().endswith('.tflite'):
+        from utils import model_export
+
+        model = model_export.TFLiteModel(model_path)
+        input_shape = tuple(int(size) for size in model.input_details['shape'][1:])
+        outputs_number = int(model.output_details['shape'][-1])
+        return model.predict, input_shape, outputs_number
+    import keras
+
+    model = keras.models.load_model(model_path)
+    return model.predict_on_batch, tuple(model.input_shape[1:]), model.output_shape[-1]
+
+
+
+def init_model_worker(model_path):
+    """Initializer of worker processes. Loads one model instance.
+
+    Args:
+        model_path (str): Path to the model
+    """
+    global worker_model
+    worker_model = load_model(model_path)
+
+
+
+def get_worker_model_info():
+    """Returns input shape and number of outputs of the worker model.
+
+    Returns:
+        tuple: Input shape and number of outputs
+    """
+    return worker_model[1], worker_model[2]
+
+
+
+def predict_in_worker(batch):
+    """Runs batch by the model of the worker process.
+
+    Args:
+        batch (array): Float batch
+
+    Returns:
+        array: Probabilities
+    """
+    return np.asarray(worker_model[0](batch))
+
+
+
+class Histogram:
+    def __init__(self, buckets):
+        """Cumulative histogram of observed values in Prometheus style.
+
+        Args:
+            buckets (tuple): Upper bounds of buckets
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.
+        self.count = 0
+        self.lock = threading.Lock()
+
+
+    def observe(self, value):
+        """Adds value to the histogram.
+
+        Args:
+            value (float): Observed value
+        """
+        with self.lock:
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+    def get_lines(self, name, help_text):
+        """Converts histogram to the Prometheus text exposition format.
+
+        Args:
+            name (str): Metric name with prefix
+            help_text (str): Description of the metric
+
+        Returns:
+            list: Lines of the metric
+        """
+        with self.lock:
+            lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for bound, count in zip(self.buckets, self.counts):
+                lines.append(f'{name}_bucket{{le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{le="+Inf"}} {self.count}')
+            lines.append(f"{name}_sum {self.sum}")
+            lines.append(f"{name}_count {self.count}")
+        return lines
+
+
+
+class ServingMetrics:
+    def __init__(self):
+        """Latency histograms, batch sizes and counters of the service.
+        """
+        latency_buckets = tuple(value / 1000 for value in c.SERVING_LATENCY_BUCKETS_MS)
+        self.request_latency = Histogram(latency_buckets)
+        self.queue_wait = Histogram(latency_buckets)
+        self.inference_latency = Histogram(latency_buckets)
+        self.batch_size = Histogram(c.SERVING_BATCH_BUCKETS)
+        self.requests_counter = 0
+        self.errors_counter = 0
+        self.lock = threading.Lock()
+
+
+    def add_request(self, is_error=False):
+        """Counts finished request.
+
+        Args:
+            is_error (bool, optional): Request failed. Defaults to False.
+        """
+        with self.lock:
+            self.requests_counter += 1
+            self.errors_counter += int(is_error)
+
+
+    def get_prometheus_lines(self):
+        """Converts metrics to the Prometheus text exposition format.
+
+        Returns:
+            list: Lines of metrics
+        """
+        prefix = c.SERVING_METRICS_PREFIX
+        lines = []
+        for name, help_text, value in (
+                ('requests_total', 'Finished prediction requests', self.requests_counter),
+                ('errors_total', 'Failed prediction requests', self.errors_counter)):
+            lines.extend([f"# HELP {prefix}_{name} {help_text}",
+                          f"# TYPE {prefix}_{name} counter",
+                          f"{prefix}_{name} {value}"])
+        lines.extend(self.request_latency.get_lines(
+            f"{prefix}_request_latency_seconds", 'Latency of request from arrival to result'))
+        lines.extend(self.queue_wait.get_lines(
+            f"{prefix}_queue_wait_seconds", 'Wait of request for its micro-batch'))
+        lines.extend(self.inference_latency.get_lines(
+            f"{prefix}_inference_seconds", 'Inference of micro-batch'))
+        lines.extend(self.batch_size.get_lines(
+            f"{prefix}_batch_size", 'Requests in micro-batch'))
+        return lines
+
+
+
+class MicroBatcher:
+    def __init__(self, run_batch, max_batch_size=c.SERVING_MAX_BATCH_SIZE,
+                 max_latency=c.SERVING_MAX_LATENCY_MS / 1000, concurrency=1,
+                 metrics=None):
+        """Gathers requests to micro-batches. Batch is sent when it is
+        full or when its first request waited 'max_latency'. Not more
+        than 'concurrency' batches run at once, so requests which come
+        while model is busy are gathered to the next batch.
+
+        Args:
+            run_batch (callable): Takes float batch, returns Future of
+                probabilities
+            max_batch_size (int, optional): Defaults to
+                SERVING_MAX_BATCH_SIZE from constants.
+            max_latency (float, optional): Seconds of batching. Defaults
+                to SERVING_MAX_LATENCY_MS from constants.
+            concurrency (int, optional): Batches run at once, number of
+                model instances. Defaults to 1.
+            metrics (obj, optional): ServingMetrics instance. Defaults to
+                None - new one.
+        """
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.metrics = metrics if metrics is not None else ServingMetrics()
+        self.requests = queue.Queue()
+        self.slots = threading.Semaphore(concurrency)
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+
+    def submit(self, sample):
+        """Adds sample to the next micro-batch.
+
+        Args:
+            sample (array): Float sample in format of model input
+
+        Returns:
+            obj: Future of (probabilities, batch size)
+        """
+        future = concurrent.futures.Future()
+        self.requests.put((sample, future, time.perf_counter()))
+        return future
+
+
+    def stop(self):
+        """Sends pending requests and stops batching thread.
+        """
+        self.requests.put(None)
+        self.thread.join()
+
+
+    def __run(self):
+        is_running = True
+        while is_running:
+            request = self.requests.get()
+            if request is None:
+                break
+            # Slot is taken before gathering, so requests which came while
+            # model was busy are already queued and form a full batch
+            self.slots.acquire()
+            batch = [request]
+            deadline = request[2] + self.max_latency
+            while len(batch) < self.max_batch_size:
+                try:
+                    # Queued requests are taken without waiting for deadline
+                    request = self.requests.get_nowait()
+                except queue.Empty:
+                    timeout = deadline - time.perf_counter()
+                    if timeout <= 0:
+                        break
+                    try:
+                        request = self.requests.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                if request is None:
+                    is_running = False
+                    break
+                batch.append(request)
+            self.__send_batch(batch)
+
+
+    def __send_batch(self, batch):
+        """Runs micro-batch and resolves futures of its requests.
+
+        Args:
+            batch (list): Tuples (sample, future, arrival time)
+        """
+        sent_time = time.perf_counter()
+        for _, _, arrival_time in batch:
+            self.metrics.queue_wait.observe(sent_time - arrival_time)
+        self.metrics.batch_size.observe(len(batch))
+        try:
+            batch_future = self.run_batch(np.stack([sample for sample, _, _ in batch]))
+        except Exception as error:
+            self.slots.release()
+            for _, future, _ in batch:
+                future.set_exception(error)
+            return
+
+        def resolve(batch_future):
+            self.slots.release()
+            finish_time = time.perf_counter()
+            self.metrics.inference_latency.observe(finish_time - sent_time)
+            error = batch_future.exception()
+            for index, (_, future, arrival_time) in enumerate(batch):
+                self.metrics.request_latency.observe(finish_time - arrival_time)
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result((batch_future.result()[index], len(batch)))
+
+        batch_future.add_done_callback(resolve)
+
+
+
+def get_batch_runner(model_path, processes=0):
+    """Creates executor of batches: one model instance in the service
+    thread, or model instance in every worker process.
+
+    Args:
+        model_path (str): Path to the model
+        processes (int, optional): Worker processes. Defaults to 0 - the
+            model is run in the service process.
+
+    Returns:
+        tuple: Function which takes batch and returns Future, input
+            shape, number of outputs and executor
+    """
+    if processes > 0:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            processes, initializer=init_model_worker, initargs=(model_path,)
+        )
+        input_shape, outputs_number = executor.submit(get_worker_model_info).result()
+        return (lambda batch: executor.submit(predict_in_worker, batch),
+                input_shape, outputs_number, executor)
+    predict, input_shape, outputs_number = load_model(model_path)
+    # One thread keeps one model instance busy, batcher keeps gathering
+    executor = concurrent.futures.ThreadPoolExecutor(1)
+    return (lambda batch: executor.submit(lambda: np.asarray(predict(batch)))), \
+        input_shape, outputs_number, executor
+
+
+
+def decode_sample(frames, input_shape, rescale):
+    """Decodes crops of the request and prepares them by the letterbox
+    of ChunkWriter.
+
+    Args:
+        frames (list): Base64 encoded images
+        input_shape (tuple): Input of model without batch dimension
+        rescale (float): Scale of crops, same as in training
+
+    Returns:
+        array: Float sample in format of model input
+    """
+    is_sequence = len(input_shape) == 4
+    frames_number = int(input_shape[0]) if is_sequence else 1
+    resolution = (int(input_shape[-2]), int(input_shape[-3]))
+    if not isinstance(frames, list) or len(frames) != frames_number:
+        raise ValueError(f"Expected {frames_number} frames")
+    crops = []
+    for frame in frames:
+        buffer = np.frombuffer(base64.b64decode(frame), np.uint8)
+        try:
+            # Empty buffer is not decoded to None, cv2 raises error
+            image = cv2.imdecode(buffer, cv2.IMREAD_COLOR) if buffer.size else None
+        except cv2.error:
+            image = None
+        if image is None:
+            raise ValueError("Frame can not be decoded")
+        crop = video_writer.resize_image_with_fill(image, resolution)
+        crops.append(cv2.cvtColor(crop, cv2.COLOR_BGR2RGB))
+    sample = np.stack(crops) if is_sequence else crops[0]
+    return sample.astype('float32') * rescale
+
+
+
+def create_server(host, port, batcher, input_shape, classes, rescale):
+    """Creates HTTP server of the service. Every connection is handled
+    by its own thread, which waits for result of its micro-batch.
+
+    Args:
+        host (str): Host
+        port (int): Port
+        batcher (obj): MicroBatcher instance
+        input_shape (tuple): Input of model without batch dimension
+        classes (list): Class names in order of model outputs
+        rescale (float): Scale of crops
+
+    Returns:
+        obj: ThreadingHTTPServer
+    """
+    metrics = batcher.metrics
+
+    class PredictionHandler(BaseHTTPRequestHandler):
+        def send_body(self, status, body, content_type='application/json'):
+            data = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                self.send_body(200, '\n'.join(metrics.get_prometheus_lines()) + '\n',
+                               'text/plain; version=0.0.4')
+            elif self.path == '/health':
+                self.send_body(200, json.dumps({'status': 'ok'}))
+            else:
+                self.send_body(404, json.dumps({'error': 'Not found'}))
+
+
+        def do_POST(self):
+            if self.path != '/predict':
+                self.send_body(404, json.dumps({'error': 'Not found'}))
+                return
+            start_time = time.perf_counter()
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length))
+                sample = decode_sample(request.get('frames'), input_shape, rescale)
+            except (ValueError, TypeError, AttributeError, KeyError) as error:
+                metrics.add_request(is_error=True)
+                self.send_body(400, json.dumps({'error': str(error)}))
+                return
+            try:
+                probabilities, batch_size = batcher.submit(sample).result()
+            except Exception as error:
+                metrics.add_request(is_error=True)
+                self.send_body(500, json.dumps({'error': str(error)}))
+                return
+            metrics.add_request()
+            response = OrderedDict()
+            response['track'] = request.get('track')
+            response['class'] = classes[int(np.argmax(probabilities))]
+            response['probabilities'] = OrderedDict(
+                (name, float(probability)) for name, probability in zip(classes, probabilities)
+            )
+            response['batch_size'] = batch_size
+            response['latency_ms'] = (time.perf_counter() - start_time) * 1000
+            self.send_body(200, json.dumps(response))
+
+
+        def log_message(self, format, *args):
+            # Access log of every request is too verbose for the service
+            pass
+
+    server = ThreadingHTTPServer((host, port), PredictionHandler)
+    server.daemon_threads = True
+    return server
@@ -0,0 +1,168 @@
+"""
+Module for deterministic sharding of the input videos between several
+nodes with shared storage:
+- Estimating work of the video from annotation
+- Balanced partition of videos
+- Output prefix of the shard
+- Merging of shard manifests to one dataset index
+"""
+
+import os
+import re
+import json
+
+from collections import OrderedDict
+
+from utils import constants as c
+from utils import annotation_parser
+from utils import manifest_tool
+
+
+
+def estimate_video_work(annotation_path):
+    """Estimates work of the video as number of annotated boxes inside
+    of the frame. Every box is a frame which can be decoded by writer.
+
+    Args:
+        annotation_path (str): Path to annotation archive
+
+    Returns:
+        int: Estimated number of frames to decode
+    """
+    _, tracks = annotation_parser.get_annotation(annotation_path)
+    if isinstance(tracks, dict):
+        tracks = [tracks]
+    work = 0
+    for track in tracks:
+        boxes = track['box']
+        if isinstance(boxes, dict):
+            boxes = [boxes]
+        work += sum(1 for box in boxes if box['@outside'] != '1')
+    return work
+
+
+
+def get_shards(works, num_shards):
+    """Partitions videos between shards. Videos are sorted by work from
+    the biggest one (name is used for equal works) and every next video
+    is added to the shard with the least work. Result does not depend on
+    the order of input records.
+
+    Args:
+        works (dict): Where: key - video name, value - estimated work
+        num_shards (int): Number of shards
+
+    Returns:
+        list: Sorted video names of every shard
+    """
+    shards = [[] for _ in range(num_shards)]
+    shard_works = [0] * num_shards
+    for video, work in sorted(works.items(), key=lambda item: (-item[1], item[0])):
+        shard_index = min(range(num_shards), key=lambda idx: (shard_works[idx], idx))
+        shards[shard_index].append(video)
+        shard_works[shard_index] += work
+    return [sorted(shard) for shard in shards]
+
+
+
+def get_shard_files(video_path, supported_files, shard_index, num_shards):
+    """Filters supported files for the shard.
+
+    Args:
+        video_path (str): Path to the video files and annotation
+            directory
+        supported_files (dict): Where: key - video name, value -
+            annotation name
+        shard_index (int): Index of the current shard
+        num_shards (int): Number of shards
+
+    Returns:
+        dict: Supported files of the shard
+    """
+    assert 0 <= shard_index < num_shards, "Wrong shard index"
+    works = {
+        file: estimate_video_work(os.path.join(video_path, annotation))
+        for file, annotation in supported_files.items()
+    }
+    shard_videos = get_shards(works, num_shards)[shard_index]
+    shard_files = OrderedDict(
+        (file, supported_files[file]) for file in shard_videos
+    )
+    return shard_files
+
+
+
+def get_shard_output_path(output_path, shard_index, num_shards):
+    """Generates output directory of the shard inside of the dataset
+    directory, so shards never write to the same files.
+
+    Args:
+        output_path (str): Path to the dataset directory
+        shard_index (int): Index of the current shard
+        num_shards (int): Number of shards
+
+    Returns:
+        str: Path to the shard directory
+    """
+    shard_name = \
+        f"{c.SHARD_DIR_PREFIX}{str.zfill(str(shard_index), 3)}" \
+        f"_of_{str.zfill(str(num_shards), 3)}"
+    return os.path.join(output_path, shard_name)
+
+
+
+def merge_shards(output_path):
+    """Combines manifests and statistics of all shards in the dataset
+    directory to one dataset index file.
+
+    Args:
+        output_path (str): Path to the dataset directory
+
+    Returns:
+        OrderedDict: Dataset index
+    """
+    index = OrderedDict()
+    index['shards'] = []
+    index['videos'] = OrderedDict()
+    index['classes'] = OrderedDict()
+    index['chunks_total'] = 0
+    # Staging and trash directories of shards have the same prefix
+    shard_pattern = re.compile(rf"{re.escape(c.SHARD_DIR_PREFIX)}(\d+)_of_(\d+)")
+    shard_dirs = []
+    shard_numbers = set()
+    for directory in os.scandir(output_path):
+        match = shard_pattern.fullmatch(directory.name)
+        if directory.is_dir() and match is not None:
+            shard_index, num_shards = int(match.group(1)), int(match.group(2))
+            assert shard_index < num_shards, f"Wrong shard index: {directory.name}"
+            shard_dirs.append(directory.path)
+            shard_numbers.add(num_shards)
+    assert len(shard_numbers) <= 1, \
+        f"Shards of different numbers of shards in {output_path}: {sorted(shard_numbers)}"
+    shard_dirs.sort()
+    for shard_dir in shard_dirs:
+        if not os.path.isfile(manifest_tool.get_manifest_path(shard_dir)):
+            continue
+        shard_name = os.path.basename(shard_dir)
+        index['shards'].append(shard_name)
+        manifest = manifest_tool.BuildManifest(shard_dir)
+        for video in manifest.get_videos():
+            chunks = [
+                os.path.join(shard_name, chunk_path)
+                for chunk_path in manifest.get_video_chunks(video['video'])
+            ]
+            index['videos'][video['video']] = {
+                'shard':shard_name,
+                'status':video['status'],
+                'statistics':video['statistics'],
+                'chunks':chunks,
+            }
+            index['chunks_total'] += len(chunks)
+            for class_name, chunks_number in \
+                    video['statistics'].get('classes', {}).items():
+                index['classes'][class_name] = \
+                    index['classes'].get(class_name, 0) + chunks_number
+        manifest.close()
+    with open(os.path.join(output_path, c.DATASET_INDEX_FILENAME), 'w') as file:
+        json.dump(index, file, indent=2)
+    return index
@@ -0,0 +1,156 @@
+"""
+Module for parameter sweep of script settings. Sweep generates one
+dataset per configuration of track analyzer settings to
+'{output}/{config_name}'. Annotations are parsed once per video, scripts
+of all configurations are planned in parallel and frames needed by all
+configurations are decoded once by the shared stream of the writer.
+After the run comparative statistics of the configurations are written
+to the CSV table in the output directory.
+"""
+
+import os
+import csv
+import itertools
+
+from collections import OrderedDict
+
+from utils import constants as c
+
+
+
+def get_default_settings():
+    """Returns values of sweep settings from constants.
+
+    Returns:
+        dict: Default value of every sweep setting
+    """
+    return {
+        'chunk_size': c.CHUNK_SIZE,
+        'frame_step': c.FRAME_STEP,
+        'border_frames_num': c.SKIP_FRAMES_NEAR_SWITCH_MARKER_SIZE,
+        'chunk_border_ratio': c.CHUNK_BORDER_RATIO,
+    }
+
+
+
+def get_sweep_configs(grid):
+    """Generates all combinations of sweep settings.
+
+    Args:
+        grid (list): Tuples (setting name, list of values)
+
+    Returns:
+        list: OrderedDicts with settings of every configuration
+    """
+    settings = OrderedDict()
+    for setting, values in grid:
+        assert setting in c.SWEEP_SETTINGS, f"Unknown sweep setting: {setting}"
+        settings.setdefault(setting, [])
+        settings[setting] += [value for value in values
+                              if value not in settings[setting]]
+    configs = []
+    for values in itertools.product(*settings.values()):
+        config = OrderedDict(zip(settings.keys(), values))
+        if 'chunk_size' in config:
+            assert (config['chunk_size'] % 2) != 0, 'Chunk size must be odd!'
+        configs.append(config)
+    return configs
+
+
+
+def get_config_name(config):
+    """Generates name of the configuration. Name is used as dataset
+    subdirectory.
+
+    Args:
+        config (dict): Settings of the configuration
+
+    Returns:
+        str: Name. ex.: 'chunk_size-5_frame_step-3'
+    """
+    return '_'.join(f"{setting}-{value}" for setting, value in config.items())
+
+
+
+def get_sweep_stats(configs, manifest):
+    """Collects statistics of every configuration from the build
+    manifest.
+
+    Args:
+        configs (list): Settings of configurations
+        manifest (obj): BuildManifest instance of the sweep
+
+    Returns:
+        list: OrderedDict row for every configuration
+    """
+    videos = manifest.get_videos()
+    classes = sorted({
+        class_name
+        for video in videos
+        for class_name in video['statistics'].get('classes', {})
+    })
+    default_settings = get_default_settings()
+    rows = []
+    for config in configs:
+        config_name = get_config_name(config)
+        row = OrderedDict()
+        row['config'] = config_name
+        for setting in c.SWEEP_SETTINGS:
+            row[setting] = config.get(setting, default_settings[setting])
+        row['videos'] = 0
+        row['chunks_total'] = 0
+        row['files_written'] = 0
+        for class_name in classes:
+            row[class_name] = 0
+        for video in videos:
+            if not video['video'].startswith(f"{config_name}/"):
+                continue
+            row['videos'] += 1
+            row['files_written'] += len(manifest.get_video_chunks(video['video']))
+            for class_name, chunks_number in \
+                    video['statistics'].get('classes', {}).items():
+                row['chunks_total'] += chunks_number
+                row[class_name] += chunks_number
+        rows.append(row)
+    return rows
+
+
+
+def write_sweep_stats(output_path, rows):
+    """Writes comparative statistics of configurations to CSV table.
+
+    Args:
+        output_path (str): Path to the sweep output directory
+        rows (list): Rows from 'get_sweep_stats'
+
+    Returns:
+        str: Path to the table
+    """
+    stats_path = os.path.join(output_path, c.SWEEP_STATS_FILENAME)
+    with open(stats_path, 'w', newline='', encoding='utf-8') as file:
+        if rows:
+            writer = csv.DictWriter(file, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+    return stats_path
+
+
+
+def print_sweep_stats(rows):
+    """Prints comparative statistics of configurations.
+
+    Args:
+        rows (list): Rows from 'get_sweep_stats'
+    """
+    if not rows:
+        return
+    columns = list(rows[0].keys())
+    widths = [
+        max(len(str(column)), *(len(str(row[column])) for row in rows))
+        for column in columns
+    ]
+    print('  '.join(str(column).ljust(width)
+                    for column, width in zip(columns, widths)))
+    for row in rows:
+        print('  '.join(str(row[column]).ljust(width)
+                        for column, width in zip(columns, widths)))
@@ -0,0 +1,243 @@
+"""
+Module for pre-decoded tensor cache of the sequence dataset for LSTM
+training. AVI chunks of 'train' and 'test' directories are decoded once
+to memory-mapped uint8 arrays:
+- '{cache}/{split}_frames.npy' - RGB frames (N, NBFRAME, H, W, 3)
+- '{cache}/{split}_labels.npy' - class indexes (N,)
+- '{cache}/tensor_cache.json' - classes, shape and source files
+
+Training reads batches from the arrays without decoding, pages of the
+arrays are loaded by OS on demand and shared between epochs and runs.
+Cache is rebuilt only if source files or settings are changed.
+"""
+
+import os
+import glob
+import json
+import cv2
+import numpy as np
+
+from collections import OrderedDict
+
+from utils import constants as c
+
+
+
+def get_split_videos(input_path, split, classes):
+    """Lists videos of the split in the same order as glob patterns of
+    the training script.
+
+    Args:
+        input_path (str): Path to the dataset with 'train' and 'test'
+        split (str): 'train' or 'test'
+        classes (list): Sorted class names
+
+    Returns:
+        list: Tuples (path, class index)
+    """
+    videos = []
+    for class_index, class_name in enumerate(classes):
+        pattern = os.path.join(input_path, split, class_name, f'*.{c.OUTPUT_EXTENTION}')
+        videos.extend(
+            (path, class_index) for path in sorted(glob.glob(pattern))
+        )
+    return videos
+
+
+
+def get_sources(videos):
+    """Describes source files for validation of the cache.
+
+    Args:
+        videos (list): Tuples (path, class index)
+
+    Returns:
+        list: [path, class index, size, modification time] of every file
+    """
+    sources = []
+    for path, class_index in videos:
+        stat = os.stat(path)
+        sources.append([path, class_index, stat.st_size, int(stat.st_mtime)])
+    return sources
+
+
+
+def read_video_frames(path, nb_frames, size):
+    """Decodes video and takes frames evenly from the whole video, same
+    as VideoFrameGenerator.
+
+    Args:
+        path (str): Path to the video
+        nb_frames (int): Number of frames of the sample
+        size (tuple): Width and height of frames
+
+    Returns:
+        array | None: RGB frames (nb_frames, H, W, 3). None if the video
+            has less frames than needed
+    """
+    video = cv2.VideoCapture(path)
+    frames = []
+    try:
+        while True:
+            grabbed, frame = video.read()
+            if not grabbed:
+                break
+            frames.append(frame)
+    finally:
+        video.release()
+    if len(frames) < nb_frames:
+        return None
+    indexes = np.linspace(0, len(frames) - 1, nb_frames).round().astype(int)
+    sample = np.empty((nb_frames, size[1], size[0], 3), dtype=np.uint8)
+    for sample_index, frame_index in enumerate(indexes):
+        frame = cv2.resize(frames[frame_index], size, interpolation=cv2.INTER_AREA)
+        sample[sample_index] = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    return sample
+
+
+
+def get_cache_paths(cache_path, split):
+    """Returns paths of arrays of the split.
+
+    Args:
+        cache_path (str): Path to the cache directory
+        split (str): 'train' or 'test'
+
+    Returns:
+        tuple: Paths of frames and labels arrays
+    """
+    return (
+        os.path.join(cache_path, f'{split}_frames.npy'),
+        os.path.join(cache_path, f'{split}_labels.npy'),
+    )
+
+
+
+def read_meta(cache_path):
+    """Reads description of the cache.
+
+    Args:
+        cache_path (str): Path to the cache directory
+
+    Returns:
+        dict | None: Description. None if cache does not exist
+    """
+    meta_path = os.path.join(cache_path, c.TENSOR_CACHE_META_FILENAME)
+    if not os.path.isfile(meta_path):
+        return None
+    with open(meta_path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+
+def write_split(videos, cache_path, split, nb_frames, size):
+    """Decodes videos of the split to memory-mapped arrays. Videos are
+    written one by one, so memory does not depend on the dataset size.
+    Broken videos are skipped.
+
+    Args:
+        videos (list): Tuples (path, class index)
+        cache_path (str): Path to the cache directory
+        split (str): 'train' or 'test'
+        nb_frames (int): Number of frames of the sample
+        size (tuple): Width and height of frames
+
+    Returns:
+        tuple: Number of written samples and paths of skipped videos
+    """
+    frames_path, labels_path = get_cache_paths(cache_path, split)
+    temp_path = f'{frames_path}.tmp'
+    shape = (len(videos), nb_frames, size[1], size[0], 3)
+    frames = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.uint8, shape=shape)
+    labels = []
+    skipped = []
+    for path, class_index in videos:
+        sample = read_video_frames(path, nb_frames, size)
+        if sample is None:
+            skipped.append(path)
+            continue
+        frames[len(labels)] = sample
+        labels.append(class_index)
+    frames.flush()
+    if skipped:
+        # Array is shrunk to written samples
+        shrink_path = f'{frames_path}.shrink.tmp'
+        shrunk = np.lib.format.open_memmap(
+            shrink_path, mode='w+', dtype=np.uint8,
+            shape=(len(labels),) + shape[1:]
+        )
+        for start in range(0, len(labels), c.TENSOR_CACHE_COPY_BATCH):
+            end = min(start + c.TENSOR_CACHE_COPY_BATCH, len(labels))
+            shrunk[start:end] = frames[start:end]
+        shrunk.flush()
+        del shrunk
+    # Mapped files must be closed before replacing on Windows
+    del frames
+    if skipped:
+        os.replace(shrink_path, temp_path)
+    os.replace(temp_path, frames_path)
+    np.save(labels_path, np.array(labels, dtype=np.int64))
+    return len(labels), skipped
+
+
+
+def build_tensor_cache(input_path, cache_path, classes, nb_frames, size,
+                       splits=('train', 'test'), rebuild=False):
+    """Builds cache of the dataset if it does not exist or is outdated.
+
+    Args:
+        input_path (str): Path to the dataset with 'train' and 'test'
+        cache_path (str): Path to the cache directory
+        classes (list): Sorted class names
+        nb_frames (int): Number of frames of the sample
+        size (tuple): Width and height of frames
+        splits (tuple, optional): Splits of the dataset. Defaults to
+            ('train', 'test').
+        rebuild (bool, optional): Rebuild valid cache too. Defaults to
+            False.
+
+    Returns:
+        dict: Description of the cache
+    """
+    os.makedirs(cache_path, exist_ok=True)
+    meta = read_meta(cache_path)
+    settings = {'classes': list(classes), 'nb_frames': nb_frames, 'size': list(size)}
+    if meta is None or rebuild or meta['settings'] != settings:
+        meta = {'settings': settings, 'splits': {}}
+    for split in splits:
+        videos = get_split_videos(input_path, split, classes)
+        sources = get_sources(videos)
+        split_meta = meta['splits'].get(split)
+        if split_meta is not None and split_meta['sources'] == sources \
+                and all(os.path.isfile(path) for path in get_cache_paths(cache_path, split)):
+            continue
+        samples, skipped = write_split(videos, cache_path, split, nb_frames, size)
+        meta['splits'][split] = OrderedDict([
+            ('samples', samples),
+            ('skipped', skipped),
+            ('sources', sources),
+        ])
+        print(f"Tensor cache: {split}: {samples} samples, {len(skipped)} skipped")
+        # Description is updated after every split, so interrupted build
+        # keeps finished splits
+        meta_path = os.path.join(cache_path, c.TENSOR_CACHE_META_FILENAME)
+        with open(f'{meta_path}.tmp', 'w', encoding='utf-8') as file:
+            json.dump(meta, file)
+        os.replace(f'{meta_path}.tmp', meta_path)
+    return meta
+
+
+
+def load_tensor_cache(cache_path, split):
+    """Opens arrays of the split. Frames are memory-mapped read-only.
+
+    Args:
+        cache_path (str): Path to the cache directory
+        split (str): 'train' or 'test'
+
+    Returns:
+        tuple: Frames (N, NBFRAME, H, W, 3) and labels (N,) arrays
+    """
+    frames_path, labels_path = get_cache_paths(cache_path, split)
+    assert os.path.isfile(frames_path), f"Tensor cache of '{split}' is not built: {cache_path}"
+    return np.load(frames_path, mmap_mode='r'), np.load(labels_path)
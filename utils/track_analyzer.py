@@ -20,7 +20,9 @@ class TrackAnalyzer:
 
         - Initialize class:
             - track - Track data from annotation parser
-            - settings - Script settings from video editor
+            - settings - Script settings from video editor. Chunk size,
+                frame step, border frames number and chunk border ratio
+                are read from settings, missing ones - from constants
             - labels - Labels info from extraction task
             - frames_total - Frames number in video
             - allow_class_mixing - bool
@@ -31,10 +33,15 @@ class TrackAnalyzer:
         """
         self.track_data = track
         self.allow_class_mixing = allow_class_mixing
-        self.overlay_policy = c.CLASS_OVERLAY
-        self.chunk_size = c.CHUNK_SIZE
-        self.is_depleted = False
         self.settings = settings
+        self.overlay_policy = settings.get('classes_overlay', c.CLASS_OVERLAY)
+        self.chunk_size = settings.get('chunk_size', c.CHUNK_SIZE)
+        self.frame_step = settings.get('frame_step', c.FRAME_STEP)
+        self.border_frames_num = \
+            settings.get('border_frames_num', c.SKIP_FRAMES_NEAR_SWITCH_MARKER_SIZE)
+        self.chunk_border_ratio = \
+            settings.get('chunk_border_ratio', c.CHUNK_BORDER_RATIO)
+        self.is_depleted = False
         self.labels = labels
         self.last_frame = 0
         self.first_frame = int(frames_total)
@@ -45,7 +52,6 @@ class TrackAnalyzer:
         self.activation_name = c.ACTIVATION_NAME
         self.deactivation_name = c.DEACTIVATION_NAME
         self.static_name = c.STATIC_NAME
-        self.border_frames_num = c.SKIP_FRAMES_NEAR_SWITCH_MARKER_SIZE
         self.dynamic_types = (self.activation_name, self.deactivation_name)
         self.static_types = (self.static_name)
         self.sequences = OrderedDict()
@@ -63,11 +69,11 @@ class TrackAnalyzer:
 
     def generate_sequences(self, extend_with_reversed):
         """Initialize process of sequence yielding from existing
-        markers.
+        markers. Augmented sequences are derived by writer.
 
         Args:
-            - extend_with_reversed (book): Experimental. Enables adding
-                reversed sequences to augment and extend dataset.
+            - extend_with_reversed (book): Experimental. Legacy order of
+                deactivation sequences, their frames are reversed.
         """
         if self.mode == 'singleshot':
             self.__add_singleshot_sequences_from_attributes()
@@ -110,11 +116,10 @@ class TrackAnalyzer:
         return total_chunk_count
 
 
-    @staticmethod
-    def __get_slice_size_for_chunk() -> int:
+    def __get_slice_size_for_chunk(self) -> int:
         """Calculates number of frames, which should be used to generate
         chunks of target size and spaces between subframes.
-        It uses constants from settings.
+        It uses chunk size and frame step of the instance.
 
         Requires chunk size and step between each frame. For example:
         - 5 frames with step 5 returns 21 as a result
@@ -124,12 +129,11 @@ class TrackAnalyzer:
         Returns:
             - int: Number of frames in chunk
         """
-        slice_size = ((c.CHUNK_SIZE - 1) * c.FRAME_STEP) + 1
+        slice_size = ((self.chunk_size - 1) * self.frame_step) + 1
         return slice_size
 
 
-    @staticmethod
-    def __get_side_size_for_chunk() -> int:
+    def __get_side_size_for_chunk(self) -> int:
         """This method is used to get slice size for slicing range of
         frames. For example, if chunk is generated from 21 frames, it
         returns 10. To slice 10 from left and 10 from right, so there
@@ -138,7 +142,7 @@ class TrackAnalyzer:
         Returns:
             - int: Number of frames to trim from left and right
         """
-        slice_size = int(((c.CHUNK_SIZE - 1) / 2) * c.FRAME_STEP)
+        slice_size = int(((self.chunk_size - 1) / 2) * self.frame_step)
         return slice_size
 
 
@@ -414,8 +418,8 @@ class TrackAnalyzer:
         sequences.
 
         Args:
-            - extend_with_reversed (book): Experimental. Enables adding
-                reversed sequences to augment and extend dataset.
+            - extend_with_reversed (book): Experimental. Legacy order of
+                deactivation sequences, their frames are reversed.
         """
         target_marker_types = self.__merge_marker_types(
             self.dynamic_types,
@@ -462,8 +466,8 @@ class TrackAnalyzer:
             - frame (int): Frame number
             - marker_type (str): Dynamic or static type
             - attribute (str): Attribute name for the sequence
-            - extend_with_reversed (book): Experimental. Enables adding
-                reversed sequences to augment and extend dataset.
+            - extend_with_reversed (book): Experimental. Legacy order of
+                deactivation sequences, their frames are reversed.
 
         Returns:
             tuple: Sequence(class, type, frames((num, coordinates),...))
@@ -496,10 +500,10 @@ class TrackAnalyzer:
         return new_sequence
 
 
-    @staticmethod
-    def __get_chunk_indexes(frame) -> list:
+    def __get_chunk_indexes(self, frame) -> list:
         """Constructs keyframes list from center frame index. Adds
-        frames from the left and from the right. Uses global constants.
+        frames from the left and from the right. Uses chunk size and
+        frame step of the instance.
 
         Example for CHUNK_SIZE=5 - list of 5 frames, where central frame
         is predefined by call method.
@@ -523,11 +527,11 @@ class TrackAnalyzer:
             left = []
             right = []
             for i in range(1, steps + 1):
-                left.append(frame + (c.FRAME_STEP * -i))
-                right.append(frame + (c.FRAME_STEP * i))
+                left.append(frame + (self.frame_step * -i))
+                right.append(frame + (self.frame_step * i))
             return sorted(left), sorted(right)
 
-        added_size = c.CHUNK_SIZE - 1
+        added_size = self.chunk_size - 1
         steps = int(added_size / 2)
         left, right = get_shifts(frame, steps)
         frames = left + [frame] + right
@@ -683,8 +687,8 @@ class TrackAnalyzer:
             attribute (str): Name of the attribute
             sequence_type (str): 'dynamic_{marker}' or 'static'
             sequence_indexes (list): All keyframes of the sequence
-            extend_with_reversed (bool): Experimental. Add reversed
-                sequence for signal deactivation and add it as an activation
+            extend_with_reversed (bool): Experimental. Legacy order of
+                deactivation sequence, its frames are reversed
             marker_type (str): Type of marker. ex.: 'activation'
 
         Returns:
@@ -795,7 +799,7 @@ class TrackAnalyzer:
             target_value='true'
         )
         interval_has_enough_frames_for_slicing = \
-            (interval_size >= (self.frames_in_chunk * c.CHUNK_BORDER_RATIO))
+            (interval_size >= (self.frames_in_chunk * self.chunk_border_ratio))
         if interval_has_enough_frames_for_slicing:
             interval_frames, interval_size = \
                 self.__get_interval_slice(interval_frames)
@@ -821,7 +825,7 @@ class TrackAnalyzer:
         To avoid this behaviour we decrease usable frames in static
         sequences and as a result get more stable and accurate classes.
 
-        Uses ratio coefficent to change slice size from constants.
+        Uses ratio coefficent of the instance to change slice size.
 
         Args:
             interval_frames (list): All frames in interval
@@ -829,7 +833,7 @@ class TrackAnalyzer:
         Returns:
             tuple: (all sliced frames, size of the resulting interval)
         """
-        cut_size = (self.__get_side_size_for_chunk() * c.CHUNK_BORDER_RATIO)
+        cut_size = (self.__get_side_size_for_chunk() * self.chunk_border_ratio)
         interval_frames = interval_frames[cut_size:-cut_size]
         interval_size = len(interval_frames)
         return interval_frames, interval_size
@@ -4,7 +4,12 @@ Contains class TrackAnalyzer which generates script for video chunks
 extractions. Each chunk contains data of source, lable, class and
 attributes.
 """
+import random
+
 from collections import OrderedDict
+from utils import constants as c
+from utils import profiler
+from utils import augmentation
 from utils.track_analyzer import TrackAnalyzer
 
 
@@ -69,10 +74,12 @@ def get_chunks(tracks, settings, labels, frames_total, allow_class_mixing):
     """
     chunks = []
     for track in tracks:
-        analyst = TrackAnalyzer(track, settings, labels, frames_total, allow_class_mixing)
-        analyst.generate_sequences(
-            extend_with_reversed=settings['extend_with_reversed']
-        )
+        with profiler.stage('track_analyzer'):
+            analyst = TrackAnalyzer(track, settings, labels, frames_total, allow_class_mixing)
+        with profiler.stage('generate_sequences'):
+            analyst.generate_sequences(
+                extend_with_reversed=settings['extend_with_reversed']
+            )
         #print(f'Frames in track: {list(analyst.track_frames.keys())}')
         #print(f'Mixed signals frames: {analyst.frames_with_mix_classes}')
         #print(f'Border signals frames: {analyst.frames_near_border}')
@@ -92,6 +99,16 @@ def get_chunks(tracks, settings, labels, frames_total, allow_class_mixing):
                         'type':sequence_type,
                         'sequence':sequence_frames,
                     }
+                    if 'stride' in settings['augmentations'] \
+                            and settings['mode'] == 'sequence':
+                        stride_sequence = augmentation.get_stride_sequence(
+                            sequence_frames,
+                            analyst.track_frames,
+                            settings['augmentation_stride'],
+                            analyst.frames_to_skip
+                        )
+                        if stride_sequence is not None:
+                            new_chunk['stride_sequence'] = stride_sequence
                     chunks.append(new_chunk)
                 else:
                     pass
@@ -99,6 +116,28 @@ def get_chunks(tracks, settings, labels, frames_total, allow_class_mixing):
 
 
 
+def get_pyramid_levels(resolutions):
+    """Sorts output resolutions from the largest to the smallest one
+    and removes duplicates.
+
+    Args:
+        resolutions (iterable): Width and heights of output levels
+
+    Returns:
+        list: Unique resolutions, the largest one first
+    """
+    levels = sorted(
+        {tuple(resolution) for resolution in resolutions},
+        key=lambda resolution: (resolution[0] * resolution[1], resolution),
+        reverse=True
+    )
+    assert len(levels) > 0, "At least one output resolution is needed"
+    for width, height in levels:
+        assert width > 0 and height > 0, "Wrong output resolution"
+    return levels
+
+
+
 def read_script_settings(extraction):
     """Reads CONSTANTS and generate settings for script.
 
@@ -108,10 +147,20 @@ def read_script_settings(extraction):
     settings = {}
     labels_and_attributes = {key:value for (key,value) in extraction.target_attributes.items()}
     settings['extend_with_reversed'] = extraction.extend_with_reversed
+    settings['augmentations'] = list(extraction.augmentations)
+    settings['augmentation_stride'] = extraction.augmentation_stride
     settings['classes_overlay'] = extraction.class_overlay
     settings['target_attributes'] = labels_and_attributes
     settings['chunk_size'] = extraction.chunk_size
+    settings['frame_step'] = extraction.frame_step
+    settings['border_frames_num'] = extraction.border_frames_num
+    settings['chunk_border_ratio'] = extraction.chunk_border_ratio
+    settings['resolutions'] = get_pyramid_levels(extraction.resolutions)
+    # The largest level is cropped from source, the others are downscaled
+    settings['resolution'] = settings['resolutions'][0]
+    settings['allow_class_mixing'] = extraction.allow_class_mixing
     settings['base_class'] = extraction.base_class
+    settings['class_balance'] = extraction.class_balance
     settings['mode'] = extraction.mode
 
     return settings
@@ -145,3 +194,163 @@ def get_script(extraction):
     script['statistics'] = get_chunks_stats(script['chunks'])
 
     return script
+
+
+
+def get_class_balance_settings(enabled=None, caps=None, ratios=None,
+                               strata=None, seed=None):
+    """Creates settings of class balancing. Missing values are taken
+    from constants.
+
+    Args:
+        enabled (bool, optional): Balance classes. Defaults to None.
+        caps (dict, optional): Maximum chunks of class. Defaults to
+            None.
+        ratios (dict, optional): Relative weights of classes. Defaults
+            to None.
+        strata (str, optional): 'video_track', 'video' or 'none'.
+            Defaults to None.
+        seed (int, optional): Seed of sampling. Defaults to None.
+
+    Returns:
+        dict: Class balancing settings
+    """
+    class_balance = {
+        'enabled':c.CLASS_BALANCED if enabled is None else enabled,
+        'caps':dict(c.CLASS_BALANCE_CAPS if caps is None else caps),
+        'ratios':dict(c.CLASS_BALANCE_RATIOS if ratios is None else ratios),
+        'strata':c.CLASS_BALANCE_STRATA if strata is None else strata,
+        'seed':c.CLASS_BALANCE_SEED if seed is None else seed,
+    }
+    return class_balance
+
+
+
+def get_class_targets(class_counts, caps, ratios):
+    """Calculates number of chunks to keep for every class. Ratio
+    targets are applied first: the rarest class according to its ratio
+    defines the number of chunks for the others. If no ratios are set -
+    all classes are balanced to the rarest one. Caps limit the result.
+
+    Args:
+        class_counts (dict): Available chunks of every class
+        caps (dict): Maximum chunks of class. Empty for no caps.
+        ratios (dict): Relative weights of classes. Empty for equal
+            weights.
+
+    Returns:
+        dict: Target number of chunks of every class
+    """
+    if not ratios:
+        ratios = {class_name: 1 for class_name in class_counts}
+    weighted_classes = [
+        class_name for class_name in class_counts
+        if ratios.get(class_name, 0) > 0
+    ]
+    targets = dict(class_counts)
+    if weighted_classes:
+        base = min(
+            class_counts[class_name] / ratios[class_name]
+            for class_name in weighted_classes
+        )
+        for class_name in weighted_classes:
+            targets[class_name] = int(base * ratios[class_name])
+    for class_name, cap in caps.items():
+        if class_name in targets:
+            targets[class_name] = min(targets[class_name], cap)
+    return targets
+
+
+
+def get_stratified_sample(strata, target, rng):
+    """Samples chunks from strata proportionally to the strata size.
+    Remainders are distributed by the largest fraction, so the sample
+    has exactly target size.
+
+    Args:
+        strata (dict): Where: key - stratum, value - list of chunk ids
+        target (int): Number of chunks to select
+        rng (random.Random): Seeded random generator
+
+    Returns:
+        list: Selected chunk ids
+    """
+    total = sum(len(ids) for ids in strata.values())
+    if target >= total:
+        return [chunk_id for ids in strata.values() for chunk_id in ids]
+    quotas = {}
+    fractions = []
+    for stratum, ids in strata.items():
+        exact_quota = target * len(ids) / total
+        quotas[stratum] = int(exact_quota)
+        fractions.append((exact_quota - quotas[stratum], stratum))
+    fractions.sort(key=lambda item: (-item[0], str(item[1])))
+    for _, stratum in fractions[:target - sum(quotas.values())]:
+        quotas[stratum] += 1
+    selected = []
+    for stratum, ids in strata.items():
+        selected += rng.sample(ids, quotas[stratum])
+    return selected
+
+
+
+def get_stratum(video, chunk, strata_policy):
+    """Returns stratum of the chunk according to the policy.
+
+    Args:
+        video (str): Video name
+        chunk (dict): Chunk from script
+        strata_policy (str): 'video_track', 'video' or 'none'
+
+    Returns:
+        tuple: Stratum key
+    """
+    if strata_policy == 'video_track':
+        return (video, chunk['track'])
+    elif strata_policy == 'video':
+        return (video,)
+    return ()
+
+
+
+def balance_scripts(scripts, class_balance):
+    """Balances classes across scripts of all videos before any frame
+    is decoded. Surplus chunks are removed from scripts, so only the
+    selected chunks reach writer. Statistics of scripts are updated.
+
+    Args:
+        scripts (dict): Where: key - video name, value - script
+        class_balance (dict): Settings with keys 'caps', 'ratios',
+            'strata' and 'seed'
+
+    Returns:
+        dict: Target number of chunks of every class
+    """
+    class_strata = OrderedDict()
+    for video, script in scripts.items():
+        for num, chunk in enumerate(script['chunks']):
+            stratum = get_stratum(video, chunk, class_balance['strata'])
+            class_strata.setdefault(chunk['class'], OrderedDict()) \
+                .setdefault(stratum, []).append((video, num))
+    class_counts = {
+        class_name: sum(len(ids) for ids in strata.values())
+        for class_name, strata in class_strata.items()
+    }
+    targets = get_class_targets(
+        class_counts,
+        class_balance['caps'],
+        class_balance['ratios']
+    )
+    rng = random.Random(class_balance['seed'])
+    selected_chunks = set()
+    for class_name, strata in class_strata.items():
+        selected_chunks.update(
+            get_stratified_sample(strata, targets[class_name], rng)
+        )
+    for video, script in scripts.items():
+        script['chunks'] = tuple(
+            chunk for num, chunk in enumerate(script['chunks'])
+            if (video, num) in selected_chunks
+        )
+        script['statistics'] = get_chunks_stats(script['chunks'])
+    return targets
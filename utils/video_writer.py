@@ -3,31 +3,56 @@
 
 import os
 import cv2
+import logging
 import numpy as np
 
 from collections import OrderedDict
 
 from utils import constants as c
+from utils import augmentation
+from utils import profiler
 
 
 
 class ChunkWriter:
-    def __init__(self, source, output, script, logger):
+    def __init__(self, source, output, script, logger, chunk_offset=0,
+                 capture=None):
         """Writer loads capture from video file and yield video chunks from
         it. It uses script from ExtractionTask class to define chunks and
         labels.
 
+        Writer can read frames by itself with 'write_chunks' or receive
+        them from the shared decoded stream with 'start_stream',
+        'add_stream_frame' and 'finish_stream'.
+
+        Every chunk is written once per output resolution from script
+        settings. Box is cropped once to the largest resolution, smaller
+        levels are downscaled from it with area interpolation.
+
+        Augmentations from script settings are derived from crops of the
+        original chunk, so augmented chunks do not need extra decoding.
+
+        Durations of writing stages are collected by own stage profiler
+        of the writer and returned with report.
+
         Args:
             source (str): Path to source video file
             output (str): Path to root output directory
             script (dict): property of ExtractionTask from dataset
                 generator main module
             logger (obj): logger object from main module
+            chunk_offset (int, optional): Number of the first chunk, if
+                script is a part of the bigger one. Defaults to 0.
+            capture (cv2.VideoCapture, optional): Shared capture of the
+                source. Defaults to None - writer opens its own one.
         """
         self.source_path = source
         self.output_path = output
         self.script = script
         self.logger = logger
+        # Level is checked once, messages are not built if it is off
+        self.debug = logger is not None and logger.isEnabledFor(logging.DEBUG)
+        self.chunk_offset = chunk_offset
         self.mode = self.script['script_settings']['mode']
         if self.mode == 'singleshot' or self.mode == 'difference':
             self.fps = 1
@@ -35,79 +60,303 @@ class ChunkWriter:
         elif self.mode == 'sequence':
             self.chunk_size = self.script['script_settings']['chunk_size']
             self.fps = self.chunk_size
-        self.resolution = c.EXTRACTOR_RESOLUTION
+        self.resolutions = [
+            tuple(resolution) for resolution in
+            self.script['script_settings'].get('resolutions', [c.EXTRACTOR_RESOLUTION])
+        ]
+        self.resolution = self.resolutions[0]
+        self.level_paths = self.__get_level_paths()
         self.broken_chunks = []
+        self.written_chunks = []
+        self.valid_chunks_counter = 0
+        self.augmented_chunks_counter = 0
+        self.processed_chunks_counter = 0
+        self.decoded_frames_counter = 0
+        self.written_bytes_counter = 0
+        self.class_counters = OrderedDict()
+        self.augmentations = self.script['script_settings'].get('augmentations', [])
+        self.augmentation_stride = \
+            self.script['script_settings'].get('augmentation_stride', c.AUGMENTATION_STRIDE)
         self.source_name = self.script['source_name']
         self.chunks = self.script['chunks']
+        self.profiler = profiler.get_new_profiler()
         # Loads capture to the memory and prepares output directories
-        self.capture = self.__read_video(self.source_path)
+        if capture is None:
+            capture = self.__read_video(self.source_path)
+        self.capture = capture
         self.codec = self.__load_codec()
-        self.__create_subdirs_for_each_class()
+        with profiler.collect(self.profiler):
+            self.__create_subdirs_for_each_class()
 
 
     def write_chunks(self):
         """Iterate over all chunks in script and write it to the output.
+        Every frame is read from capture with positioning to the frame.
         Writing process stages:
-        1. Creates output file
-        2. Add frames from script sequence
+        1. Collects frames from script sequence
+        2. Creates output file
         3. Test chunk integrity
         4. If passed - continue. Else - delete chunk.
         """
-        self.valid_chunks_counter = 0
+        with profiler.collect(self.profiler):
+            for num, chunk in enumerate(self.chunks):
+                crops = [
+                    self.__get_frame_from_capture(frame, coordinates)
+                    for frame, coordinates in self.__get_chunk_frames(chunk)
+                ]
+                self.__write_chunk(num, chunk, crops)
+
+
+    def start_stream(self):
+        """Prepares writer to receive frames from the shared decoded
+        stream. Collects requests of every frame from all chunks.
+        """
+        self.frame_requests = {}
+        self.pending_crops = {}
         for num, chunk in enumerate(self.chunks):
-            try:
-                if len(chunk['sequence'].keys()) > 3:
-                    center_index = (self.chunk_size - 1) // 2
-                    frame_num = list(chunk['sequence'].keys())[center_index]
-                else:
-                    frame_num = list(chunk['sequence'].keys())[0]
-            except IndexError:
-                frame_num = 'ERROR'
-            chunk_path = self.__get_chunk_path(num, frame_num, chunk)
-            log_msg = f"Writing: {chunk_path}"
-            output = self.__get_output(chunk_path)
-            if self.mode == 'difference':
-                sequences = list(chunk['sequence'].items())
-                self.__add_difference_chunk(output, sequences)
+            chunk_frames = self.__get_chunk_frames(chunk)
+            self.pending_crops[num] = [None] * len(chunk_frames)
+            for position, (frame, coordinates) in enumerate(chunk_frames):
+                self.frame_requests.setdefault(frame, []).append(
+                    (num, position, coordinates)
+                )
+
+
+    def get_stream_frames(self):
+        """Returns frames which writer still needs from the stream.
+
+        Returns:
+            set: Frame numbers
+        """
+        return set(self.frame_requests.keys())
+
+
+    def add_stream_frame(self, frame, image):
+        """Crops decoded frame for every chunk which needs it. Chunk is
+        written as soon as all its crops are collected, so only chunks
+        in progress are kept in memory.
+
+        Args:
+            frame (int): Frame number
+            image (array | None): Decoded frame. None if frame can not
+                be decoded
+        """
+        with profiler.collect(self.profiler):
+            for num, position, coordinates in self.frame_requests.pop(frame, []):
+                crops = self.pending_crops[num]
+                crops[position] = self.__get_crop(image, coordinates)
+                if all(crop is not None for crop in crops):
+                    del self.pending_crops[num]
+                    self.__write_chunk(num, self.chunks[num], crops)
+
+
+    def finish_stream(self):
+        """Writes chunks with frames which were not received from the
+        stream. Missing frames are black as in 'write_chunks'.
+        """
+        with profiler.collect(self.profiler):
+            for num, crops in sorted(self.pending_crops.items()):
+                crops = [
+                    crop if crop is not None else self.__get_crop(None, None)
+                    for crop in crops
+                ]
+                self.__write_chunk(num, self.chunks[num], crops)
+        self.pending_crops = {}
+        self.frame_requests = {}
+
+
+    def __get_chunk_frames(self, chunk):
+        """Returns frames of the chunk which should be read from source.
+        Difference chunk needs only the first and the last frame. Strided
+        frames out of the chunk are read after frames of the chunk.
+
+        Args:
+            chunk (dict): Dict from extraction task script.
+
+        Returns:
+            list: Tuples (frame, coordinates)
+        """
+        chunk_frames = list(chunk['sequence'].items())
+        if self.mode == 'difference':
+            chunk_frames = [chunk_frames[0], chunk_frames[-1]]
+        return chunk_frames + augmentation.get_extra_frames(
+            chunk, self.augmentations, self.mode
+        )
+
+
+    def __write_chunk(self, num, chunk, crops):
+        """Writes chunk and its augmented chunks from prepared crops to
+        the output.
+
+        Args:
+            num (int): Number of chunk in script
+            chunk (dict): Dict from extraction task script.
+            crops (list): Cropped and resized images of chunk frames
+                and of strided frames out of the chunk
+        """
+        frame_crops = dict(zip(
+            [frame for frame, _ in self.__get_chunk_frames(chunk)], crops
+        ))
+        crops = crops[:len(crops) - len(
+            augmentation.get_extra_frames(chunk, self.augmentations, self.mode)
+        )]
+        try:
+            if len(chunk['sequence'].keys()) > 3:
+                center_index = (self.chunk_size - 1) // 2
+                frame_num = list(chunk['sequence'].keys())[center_index]
             else:
-                for frame, coordinates in chunk['sequence'].items():
-                    self.__add_frame_to_chunk(output, frame, coordinates)
+                frame_num = list(chunk['sequence'].keys())[0]
+        except IndexError:
+            frame_num = 'ERROR'
+        chunk_is_valid = self.__write_chunk_variant(
+            num, frame_num, chunk['class'], None, crops, chunk
+        )
+        self.processed_chunks_counter += 1
+        if chunk_is_valid:
+            self.valid_chunks_counter += 1
+        chunk_augmentations = augmentation.get_chunk_augmentations(
+            chunk, self.augmentations, self.mode
+        )
+        for augmentation_name in chunk_augmentations:
+            with profiler.stage('augmentation'):
+                stride_crops = None
+                if augmentation_name == 'stride':
+                    stride_crops = [frame_crops[frame] for frame in chunk['stride_sequence']]
+                augmented_crops = augmentation.apply_augmentation(
+                    crops, augmentation_name, stride_crops
+                )
+            chunk_is_valid = self.__write_chunk_variant(
+                num,
+                frame_num,
+                augmentation.get_augmented_class(chunk['class'], augmentation_name),
+                augmentation.get_augmentation_suffix(
+                    augmentation_name, self.augmentation_stride
+                ),
+                augmented_crops,
+                chunk
+            )
+            if chunk_is_valid:
+                self.augmented_chunks_counter += 1
+        profiler.sample_memory()
+
+
+    def __write_chunk_variant(self, num, frame_num, chunk_class, suffix,
+                              crops, chunk) -> bool:
+        """Writes original or augmented chunk to every output resolution.
 
-            output.release()
+        Args:
+            num (int): Number of chunk in script
+            frame_num (int): Number of center frame of sequence
+            chunk_class (str): Class of the written chunk
+            suffix (str | None): Suffix of augmented chunk file name
+            crops (list): Cropped and resized images of chunk frames
+            chunk (dict): Dict from extraction task script.
+
+        Returns:
+            bool: True if chunk is written, else - False
+        """
+        if self.mode == 'difference':
+            with profiler.stage('alignment'):
+                images = [self.__get_difference_image(crops[0], crops[-1])]
+        else:
+            images = crops
+        chunk_paths = []
+        chunk_validation_passed = True
+        for resolution, level_path in self.level_paths.items():
+            chunk_path = self.__get_chunk_path(
+                num + self.chunk_offset, frame_num, chunk, level_path,
+                chunk_class, suffix
+            )
+            # Chunk is written to the temporary file and renamed only
+            # when it is ready, so partial chunks are never left behind
+            temp_chunk_path = self.__get_temp_chunk_path(chunk_path)
+            level_images = images
+            if resolution != self.resolution:
+                with profiler.stage('crop_resize'):
+                    level_images = [
+                        cv2.resize(image, resolution, interpolation=cv2.INTER_AREA)
+                        for image in images
+                    ]
+            with profiler.stage('encode'):
+                output = self.__get_output(temp_chunk_path, resolution)
+                for image in level_images:
+                    output.write(image)
+
+                output.release()
 
             if self.mode == 'sequence':
-                chunk_validation_passed = self.__validate_chunk(chunk_path)
-            if self.mode not in ['singleshot', 'difference'] and not chunk_validation_passed:
+                with profiler.stage('validate'):
+                    chunk_validation_passed = chunk_validation_passed \
+                        and self.__validate_chunk(temp_chunk_path)
+            chunk_paths.append((chunk_path, temp_chunk_path))
+
+        # Levels of the chunk are kept or removed together
+        for chunk_path, temp_chunk_path in chunk_paths:
+            if not chunk_validation_passed:
                 self.broken_chunks.append(chunk_path)
                 try:
-                    os.remove(chunk_path)
-                    log_msg = f"WARNING: BROKEN_CHUNK: {chunk_path}"
+                    with profiler.stage('filesystem'):
+                        os.remove(temp_chunk_path)
+                    if self.debug:
+                        self.logger.debug("WARNING: BROKEN_CHUNK: %s", chunk_path)
                 except OSError:
-                    log_msg = f"FAILED TO REMOVE: {chunk_path}"
-                    pass
+                    if self.debug:
+                        self.logger.debug("FAILED TO REMOVE: %s", temp_chunk_path)
             else:
-                self.valid_chunks_counter += 1
-            if c.ENABLE_DEBUG_LOGGER:
-                self.logger.debug(log_msg)
+                with profiler.stage('filesystem'):
+                    os.replace(temp_chunk_path, chunk_path)
+                    self.written_bytes_counter += os.path.getsize(chunk_path)
+                self.written_chunks.append(chunk_path)
+                if self.debug:
+                    self.logger.debug("Writing: %s", chunk_path)
+        if chunk_validation_passed:
+            self.class_counters[chunk_class] = \
+                self.class_counters.get(chunk_class, 0) + 1
+        return chunk_validation_passed
 
 
     def get_report(self):
             """Creates report from writer. Report content:
             - valid chunks counter
+            - augmented chunks counter
             - broken chunks counter
+            - processed chunks of script counter
+            - decoded frames counter
+            - written bytes counter
+            - written chunks of every class
             - list of broken chunks
+            - list of written chunks
+            - durations and memory peaks of writing stages
 
             Returns:
                 OrderedDict: Availible keys: [
                     'Valid chunks total',
+                    'Augmented chunks total',
                     'Broken chunks total',
-                    'Broken chunks list'
+                    'Processed chunks total',
+                    'Decoded frames total',
+                    'Written bytes total',
+                    'Classes',
+                    'Broken chunks list',
+                    'Written chunks list',
+                    'Stage timings',
+                    'Stage memory'
                     ]
             """
             report = OrderedDict()
             report['Valid chunks total'] = self.valid_chunks_counter
+            report['Augmented chunks total'] = self.augmented_chunks_counter
             report['Broken chunks total'] = len(self.broken_chunks)
+            report['Processed chunks total'] = self.processed_chunks_counter
+            report['Decoded frames total'] = self.decoded_frames_counter
+            report['Written bytes total'] = self.written_bytes_counter
+            report['Classes'] = self.class_counters
             report['Broken chunks list'] = self.broken_chunks
+            report['Written chunks list'] = self.written_chunks
+            report['Stage timings'] = \
+                self.profiler.get_timings() if self.profiler is not None else {}
+            report['Stage memory'] = \
+                self.profiler.get_memory_peaks() if self.profiler is not None else {}
             return report
 
 
@@ -143,36 +392,69 @@ class ChunkWriter:
         self.capture.release()
 
 
+    def __get_level_paths(self):
+        """Generates output directories of every resolution. Single
+        resolution is written to the output directory itself.
+
+        Returns:
+            OrderedDict: Output directory of every resolution
+        """
+        level_paths = OrderedDict()
+        for resolution in self.resolutions:
+            level_path = self.output_path
+            if len(self.resolutions) > 1:
+                level_path = os.path.join(
+                    self.output_path,
+                    get_resolution_dir_name(resolution)
+                )
+            level_paths[resolution] = level_path
+        return level_paths
+
+
     def __create_subdirs_for_each_class(self):
-        """Creates output directories for every label class in script
+        """Creates output directories for every label class in script,
+        classes of augmented chunks and every output resolution
         """
-        available_classes = self.script['statistics']['classes'].keys()
-        for label_class in available_classes:
-            class_dir_path = os.path.join(self.output_path, label_class)
-            if os.path.isdir(class_dir_path):
-                pass
-            else:
-                os.mkdir(class_dir_path)
+        available_classes = set(self.script['statistics']['classes'].keys())
+        for chunk in self.chunks:
+            for augmentation_name in augmentation.get_chunk_augmentations(
+                    chunk, self.augmentations, self.mode):
+                available_classes.add(
+                    augmentation.get_augmented_class(chunk['class'], augmentation_name)
+                )
+        for level_path in self.level_paths.values():
+            for label_class in available_classes:
+                class_dir_path = os.path.join(level_path, label_class)
+                # Several workers can create the same directory at once
+                with profiler.stage('filesystem'):
+                    os.makedirs(class_dir_path, exist_ok=True)
 
 
-    def __get_chunk_path(self, num, frame_num, chunk):
+    def __get_chunk_path(self, num, frame_num, chunk, level_path,
+                         class_name=None, suffix=None):
         """Generates path to save new chunk. Filename format:
         {file}_{label_name}_{class_type}_{class_name}_tr{track_num}_
-        seq{chunk_num}_fr{frame_num}.mjpg
+        seq{chunk_num}_fr{frame_num}[_{suffix}].mjpg
 
         Args:
             num (int): Number of iterator step - unique for chunk
             frame_num (int): Number of center frame of sequence
             chunk (dict): Dict from extraction task script.
+            level_path (str): Output directory of the resolution
+            class_name (str, optional): Class of augmented chunk.
+                Defaults to None - class of chunk.
+            suffix (str, optional): Suffix of augmented chunk. Defaults
+                to None.
 
         Returns:
             str: Full path to file with class subdirectory
         """
-        class_path = os.path.join(self.output_path, chunk['class'])
+        if class_name is None:
+            class_name = chunk['class']
+        class_path = os.path.join(level_path, class_name)
         file = self.source_name
         extension = c.OUTPUT_EXTENTION
         label_name = chunk['label']
-        class_name = chunk['class']
         class_type = chunk['type']
         track_num = str.zfill(str(chunk['track']), 4)
         chunk_num = str.zfill(str(num), 4)
@@ -182,15 +464,34 @@ class ChunkWriter:
         chunk_name = \
             f"{file}_{label_name}_{class_type}_{class_name}_" \
             f"tr{track_num}_seq{chunk_num}_fr{frame_num}"
+        if suffix is not None:
+            chunk_name = f"{chunk_name}_{suffix}"
         chunk_path = os.path.join(class_path, f"{chunk_name}.{extension}")
         return chunk_path
 
 
-    def __get_output(self, chunk_path):
+    @staticmethod
+    def __get_temp_chunk_path(chunk_path):
+        """Generates path of the temporary file for the chunk. Extension
+        is kept at the end, as cv2 chooses container by it.
+
+        Args:
+            chunk_path (str): Full path to new chunk
+
+        Returns:
+            str: Full path to the temporary chunk file
+        """
+        chunk_name, extension = os.path.splitext(chunk_path)
+        temp_chunk_path = f"{chunk_name}.{c.TEMP_CHUNK_SUFFIX}{extension}"
+        return temp_chunk_path
+
+
+    def __get_output(self, chunk_path, resolution):
         """Creates empty video output job to write chunk to.
 
         Args:
             chunk_path (str): Full path to new chunk
+            resolution (tuple): Width and heights of chunk in pixels
 
         Returns:
             cv2.VideoWriter: cv2 writer object
@@ -199,45 +500,53 @@ class ChunkWriter:
             chunk_path,
             self.codec,
             self.fps,
-            self.resolution,
+            resolution,
         )
         return video_output
 
 
     def __get_frame_from_capture(self, frame, coordinates):
-        self.capture.set(1, frame)
-        status, image = self.capture.read()
-        if status:
-            # Box coordinates from two points: (A[ax, ay], B[bx, by])
-            ax, ay, bx, by = coordinates
-            image_crop = image[ay:by, ax:bx]
-        else:
-            # Black image for empty
-            image_crop = np.zeros([1, 1, 3], dtype=np.uint8)
-        image_crop = self.__resize_image_with_fill(
-            input_image=image_crop,
-            output_image_resolution=c.EXTRACTOR_RESOLUTION
-        )
-        return image_crop
+        with profiler.stage('seek'):
+            self.capture.set(1, frame)
+        with profiler.stage('decode'):
+            status, image = self.capture.read()
+        self.decoded_frames_counter += 1
+        if not status:
+            image = None
+        return self.__get_crop(image, coordinates)
 
 
-    def __add_difference_chunk(self, output, sequences):
-        """
-        TODO: Add docstring
+    def __get_crop(self, image, coordinates):
+        """Crops box from the frame and resizes it to the largest output
+        resolution.
+
+        Args:
+            image (array | None): Decoded frame. None for missing frame
+            coordinates (tuple): Box coordinates (ax, ay, bx, by)
+
+        Returns:
+            array: Cropped and resized image
         """
-        img_end_aligned = np.zeros
-        img_start = self.__get_frame_from_capture(sequences[0][0], sequences[0][1])
-        img_end = self.__get_frame_from_capture(sequences[-1][0], sequences[-1][1])
+        with profiler.stage('crop_resize'):
+            image_crop = crop_box(image, coordinates, self.resolution)
+        return image_crop
+
+
+    @staticmethod
+    def __get_difference_image(img_start, img_end):
+        """Aligns the last image of sequence to the first one and
+        subtracts them. Minor details are cleared with threshold.
 
+        Args:
+            img_start (array): First image of sequence
+            img_end (array): Last image of sequence
+
+        Returns:
+            array: Binary difference image
+        """
         img_start_gray = cv2.cvtColor(img_start, cv2.COLOR_BGR2GRAY)
         img_end_gray = cv2.cvtColor(img_end, cv2.COLOR_BGR2GRAY)
-        cv2.imwrite('1_grey.jpg', img_start_gray)
-        cv2.imwrite('2_grey.jpg', img_end_gray)
-        cv2.imwrite('1.jpg', img_start)
-        cv2.imwrite('2.jpg', img_end)
-        print(img_start.shape, img_end.shape)
         sz = img_start.shape
-        img_end_aligned = np.zeros(sz)
         warp_mode = cv2.MOTION_HOMOGRAPHY
         #warp_mode = cv2.MOTION_TRANSLATION
         if warp_mode == cv2.MOTION_HOMOGRAPHY :
@@ -266,27 +575,12 @@ class ChunkWriter:
                                              warp_matrix,
                                              (sz[1],sz[0]),
                                              flags=cv2.INTER_LINEAR + cv2.WARP_INVERSE_MAP)
-        cv2.imwrite('3_aligned.jpg', img_end_aligned)
         diff = cv2.subtract(img_end_aligned, img_start)
         threshold = c.DIFF_THRESHOLD
         # Clear minor details
         diff[diff >= threshold] = 255
         diff[diff < threshold] = 0
-
-        output.write(diff)
-
-
-    def __add_frame_to_chunk(self, output, frame, coordinates):
-        """Adds specific frame from video capture to the cv2.VideoWriter
-        object.
-
-        Args:
-            output (cv2.VideoWriter): cv2 writer object to write to
-            frame (int): Target frame number
-            coordinates (dict): Coordinates of box to crop image
-        """
-        image_crop = self.__get_frame_from_capture(frame, coordinates)
-        output.write(image_crop)
+        return diff
 
 
     def __validate_chunk(self, chunk_path) -> bool:
@@ -309,65 +603,104 @@ class ChunkWriter:
         return chunk_has_no_errors
 
 
-    @staticmethod
-    def __resize_image_with_fill(input_image, output_image_resolution):
-        """Resize image to the target resolution with saving aspect
-        ratio and filling with black borders unknown parts.
+
+def get_resolution_dir_name(resolution):
+    """Generates name of the output directory of the resolution.
+
+    Args:
+        resolution (tuple): Width and heights in pixels
+
+    Returns:
+        str: Directory name. ex.: '224x224'
+    """
+    return f"{resolution[0]}x{resolution[1]}"
+
+
+
+def resize_image_with_fill(input_image, output_image_resolution):
+    """Resize image to the target resolution with saving aspect
+    ratio and filling with black borders unknown parts (letterbox).
+    Used by writer and by inference, so models get the same crops.
+
+    Args:
+        input_image (array): Image to resize
+        output_image_resolution (tuple): Width and heights in pixels
+
+    Returns:
+        array: Cropped and resized image. If needed - with borders.
+    """
+    assert all([dimension > 0 for dimension in input_image.shape])
+    def get_image_borders(image_shape, output_image_resolution) -> tuple:
+        """Subtask. Calculate borders size for cropped image.
 
         Args:
-            input_image (array): Image to resize
-            output_image_resolution (tuple): Width and heights in pixels
+            image_shape (tuple): Image width and heights
+            output_image_resolution (tuple): Width and heights in
+                pixels
 
         Returns:
-            array: Cropped and resized image. If needed - with borders.
+            tuple: New borders for vertical and horizontal parts
         """
-        assert all([dimension > 0 for dimension in input_image.shape])
-        def get_image_borders(image_shape, output_image_resolution) -> tuple:
-            """Subtask. Calculate borders size for cropped image.
+        vertical_border = 0
+        horizontal_border = 0
+        input_img_w = image_shape[0]
+        input_img_h = image_shape[1]
+        output_img_w = output_image_resolution[0]
+        output_img_h = output_image_resolution[1]
+        input_img_aspect_ratio = \
+            input_img_w / input_img_h
+        output_img_aspect_ratio = \
+            output_img_w / output_img_h
+        if output_img_aspect_ratio >= input_img_aspect_ratio:
+            vertical_border = int(
+                ((output_img_aspect_ratio * input_img_h) - input_img_w) / 2
+            )
+        else:
+            horizontal_border = int(
+                ((output_img_aspect_ratio * input_img_w) - input_img_h) / 2
+            )
+        borders = (vertical_border, horizontal_border)
+        return borders
 
-            Args:
-                image_shape (tuple): Image width and heights
-                output_image_resolution (tuple): Width and heights in
-                    pixels
+    border_v, border_h = \
+        get_image_borders(input_image.shape, output_image_resolution)
+    output_image = cv2.copyMakeBorder(
+        input_image,
+        border_v, border_v,
+        border_h, border_h,
+        cv2.BORDER_CONSTANT, 0
+    )
+    output_image = cv2.resize(output_image, output_image_resolution)
+    return output_image
 
-            Returns:
-                tuple: New borders for vertical and horizontal parts
-            """
-            vertical_border = 0
-            horizontal_border = 0
-            input_img_w = image_shape[0]
-            input_img_h = image_shape[1]
-            output_img_w = output_image_resolution[0]
-            output_img_h = output_image_resolution[1]
-            input_img_aspect_ratio = \
-                input_img_w / input_img_h
-            output_img_aspect_ratio = \
-                output_img_w / output_img_h
-            if output_img_aspect_ratio >= input_img_aspect_ratio:
-                vertical_border = int(
-                    ((output_img_aspect_ratio * input_img_h) - input_img_w) / 2
-                )
-            else:
-                horizontal_border = int(
-                    ((output_img_aspect_ratio * input_img_w) - input_img_h) / 2
-                )
-            borders = (vertical_border, horizontal_border)
-            return borders
-
-        border_v, border_h = \
-            get_image_borders(input_image.shape, output_image_resolution)
-        output_image = cv2.copyMakeBorder(
-            input_image,
-            border_v, border_v,
-            border_h, border_h,
-            cv2.BORDER_CONSTANT, 0
-        )
-        output_image = cv2.resize(output_image, output_image_resolution)
-        return output_image
+
+
+def crop_box(image, coordinates, resolution):
+    """Crops box from the frame and resizes it to the resolution.
+
+    Args:
+        image (array | None): Decoded frame. None for missing frame
+        coordinates (tuple | None): Box coordinates (ax, ay, bx, by)
+        resolution (tuple): Width and heights in pixels
+
+    Returns:
+        array: Cropped and resized image. Black for missing frame
+    """
+    if image is not None:
+        # Box coordinates from two points: (A[ax, ay], B[bx, by])
+        ax, ay, bx, by = coordinates
+        image_crop = image[ay:by, ax:bx]
+    else:
+        # Black image for empty
+        image_crop = np.zeros([1, 1, 3], dtype=np.uint8)
+    return resize_image_with_fill(
+        input_image=image_crop,
+        output_image_resolution=resolution
+    )
 
 
 
-def start_writing_video_chunks(source, output, script, logger):
+def start_writing_video_chunks(source, output, script, logger, chunk_offset=0):
     """Starts process of writing video chunks from source file to output
     directory.
 
@@ -377,13 +710,84 @@ def start_writing_video_chunks(source, output, script, logger):
         script (dict): property of ExtractionTask from dataset
             generator main module
         logger (obj): logger object from main module
+        chunk_offset (int, optional): Number of the first chunk, if
+            script is a part of the bigger one. Defaults to 0.
     """
-    if c.ENABLE_DEBUG_LOGGER:
-        log_msg = f"Writing to '{output}': " \
-                  f"{len(script['chunks'])} chunks in file"
-        logger.debug(log_msg)
-    writer = ChunkWriter(source, output, script, logger)
+    if logger is not None and logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Writing to '%s': %d chunks in file",
+                     output, len(script['chunks']))
+    writer = ChunkWriter(source, output, script, logger, chunk_offset)
     writer.write_chunks()
     writer.release()
     writer_report = writer.get_report()
     return writer_report
+
+
+
+def read_frames(capture, frames):
+    """Decodes frames from capture in ascending order. Short gaps between
+    frames are skipped with 'grab' without conversion of the image, long
+    gaps and backward steps are skipped with positioning of capture.
+
+    Args:
+        capture (cv2.VideoCapture): Capture of the source
+        frames (iterable): Frame numbers
+
+    Yields:
+        tuple: (frame, image). Image is None if frame can not be decoded
+    """
+    position = 0
+    for frame in sorted(frames):
+        if frame < position or (frame - position) > c.STREAM_MAX_GRAB_GAP:
+            with profiler.stage('seek'):
+                capture.set(cv2.CAP_PROP_POS_FRAMES, frame)
+            position = frame
+        with profiler.stage('decode'):
+            while position < frame:
+                capture.grab()
+                position += 1
+            status, image = capture.read()
+        position += 1
+        yield frame, (image if status else None)
+
+
+
+def start_writing_shared_stream(source, parts, logger):
+    """Starts process of writing chunks of several scripts of the same
+    source. Frames needed by all scripts are unioned and decoded once,
+    every writer receives its crops from the shared decoded stream.
+    Stages and decoded frames of the shared decoding are recorded by the
+    first writer.
+
+    Args:
+        source (str): Path to source video file
+        parts (list): Dicts with keys 'key', 'output' and 'script'
+        logger (obj): logger object from main module
+
+    Returns:
+        list: Tuples (part key, writer report)
+    """
+    capture = cv2.VideoCapture(source)
+    writers = []
+    for part in parts:
+        if logger is not None and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Writing to '%s': %d chunks in file",
+                         part['output'], len(part['script']['chunks']))
+        writer = ChunkWriter(source, part['output'], part['script'], logger,
+                             capture=capture)
+        writer.start_stream()
+        writers.append(writer)
+    frames = set()
+    for writer in writers:
+        frames.update(writer.get_stream_frames())
+    with profiler.collect(writers[0].profiler):
+        for frame, image in read_frames(capture, frames):
+            writers[0].decoded_frames_counter += 1
+            for writer in writers:
+                writer.add_stream_frame(frame, image)
+    reports = []
+    for part, writer in zip(parts, writers):
+        writer.finish_stream()
+        reports.append((part['key'], writer.get_report()))
+    capture.release()
+    return reports